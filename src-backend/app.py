@@ -1,25 +1,160 @@
 #!/usr/bin/env python3
 import os
+import base64
+import codecs
+import ctypes
+import ctypes.util
+import hashlib
+import io
+import ipaddress
+import queue
 import socket
+import sqlite3
+import struct
 import pickle
 import json
+import bisect
+import builtins
+import contextlib
+import cProfile
+import functools
+import gzip
+import hmac
+import marshal
+import math
+import pstats
+import sys
+import itertools
 import re
+import select
+import signal
+import threading
 import time as _time
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import formatdate, parsedate_to_datetime
 from http.server import BaseHTTPRequestHandler, HTTPServer
-from urllib.parse import urlparse, parse_qs
+from urllib.parse import urlparse, parse_qs, quote
+
+try:  # optional: brotli variants of static assets
+    import brotli
+except ImportError:
+    brotli = None
+try:  # optional: faster JSON encoding
+    import orjson
+except ImportError:
+    orjson = None
+try:  # optional: zstd compression of API responses
+    import zstandard
+except ImportError:
+    zstandard = None
 
 # Path to the fail2ban control socket. It can be overridden via the
 # environment variable F2B_SOCKET when running the container. The socket
 # must be mounted into the container so that this application can
 # communicate with the running fail2ban server.
 SOCKET_PATH = os.getenv('F2B_SOCKET', '/var/run/fail2ban/fail2ban.sock')
+# Several fail2ban servers: F2B_SOCKET="edge1=/run/edge1.sock,edge2=/run/edge2.sock"
+# or a file with one "name=path" per line; the first host is the default
+HOSTS_FILE = os.getenv("F2B_HOSTS_FILE", "")
 
 # Marker used by the fail2ban server to delimit pickle messages.
 END_MARKER = b"<F2B_END_COMMAND>"
+# Sent by the client before it closes a connection for good.
+CLOSE_MARKER = b"<F2B_CLOSE_COMMAND>"
+# Number of persistent connections kept to the fail2ban socket
+# (0 = open a new connection for every command).
+SOCKET_POOL_SIZE = int(os.getenv("F2B_POOL_SIZE", "4"))
+# Socket deadlines in seconds (0 = none): connecting, and the whole
+# exchange per command class (reads, other writes, server/jail control).
+CONNECT_TIMEOUT = float(os.getenv("F2B_CONNECT_TIMEOUT", "2"))
+READ_TIMEOUT = float(os.getenv("F2B_READ_TIMEOUT", "5"))
+WRITE_TIMEOUT = float(os.getenv("F2B_WRITE_TIMEOUT", "15"))
+CONTROL_TIMEOUT = float(os.getenv("F2B_CONTROL_TIMEOUT", "120"))
+# Circuit breaker: consecutive socket failures until requests fail fast,
+# and seconds until the next trial request (threshold 0 = disabled).
+BREAKER_THRESHOLD = int(os.getenv("F2B_BREAKER_THRESHOLD", "5"))
+BREAKER_RESET_SEC = float(os.getenv("F2B_BREAKER_RESET", "10"))
+# Read results up to this many seconds old are served (marked stale) while
+# fail2ban does not answer (0 = never).
+STALE_MAX_AGE = float(os.getenv("F2B_STALE_MAX", "300"))
+# Socket receive: bytes per recv_into() and max. size of one reply.
+RECV_SIZE = int(os.getenv("F2B_RECV_SIZE", "65536"))
+MAX_REPLY_SIZE = int(os.getenv("F2B_MAX_REPLY", str(256 * 1024 * 1024)))
 STATIC_ROOT = os.path.abspath(os.getenv("STATIC_ROOT", "public"))
-IPV4_RE = re.compile(
-    r"^((25[0-5]|2[0-4]\d|[01]?\d\d?)\.){3}(25[0-5]|2[0-4]\d|[01]?\d\d?)$")
-_OVERVIEW_CACHE = {"data": None, "ts": 0, "ttl": 0}
+# JSON responses smaller than this are sent uncompressed.
+JSON_COMPRESS_MIN = int(os.getenv("JSON_COMPRESS_MIN", "1024"))
+# Static files up to this size are kept in memory (with compressed variants);
+# larger ones are sent from disk.
+STATIC_PRELOAD_MAX = int(os.getenv("STATIC_PRELOAD_MAX", str(8 * 1024 * 1024)))
+STATIC_CONTENT_TYPES = {
+    ".html": "text/html",
+    ".css": "text/css",
+    ".js": "application/javascript",
+    ".mjs": "application/javascript",
+    ".json": "application/json",
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".gif": "image/gif",
+    ".svg": "image/svg+xml",
+    ".ico": "image/x-icon",
+    ".map": "application/json",
+    ".woff": "font/woff",
+    ".woff2": "font/woff2",
+    ".ttf": "font/ttf",
+}
+# Vite build output with a content hash in the name, e.g. index-Cv005UWa.js
+HASHED_ASSET_RE = re.compile(r"-[A-Za-z0-9_-]{8}\.[a-z0-9]+$")
+# Command result cache: max. number of entries (0 = disabled).
+CACHE_SIZE = int(os.getenv("F2B_CACHE_SIZE", "512"))
+# Sorted banned-IP indexes kept for paging/filters (LRU, one per host and
+# per host and jail).
+INDEX_CACHE_SIZE = 64
+# Background state collector: refresh interval in seconds (0 = disabled,
+# every read goes to the socket).
+COLLECT_INTERVAL = float(os.getenv("F2B_COLLECT_INTERVAL", "0"))
+# Jail counter series (/api/jail/{jail}/series): sampling interval in seconds
+# (0 = disabled) and resolutions as (step in seconds, window in seconds):
+# every sample for 1 h, 1 min for 24 h and 10 min for 7 d. Steps are rounded
+# to whole multiples of the interval (see series_levels()).
+SERIES_INTERVAL = float(os.getenv("F2B_SERIES_INTERVAL", "0"))
+SERIES_WINDOWS = ((0, 3600), (60, 86400), (600, 7 * 86400))
+# Block size used when reading log files backwards for /api/file tails.
+TAIL_BLOCK_SIZE = 64 * 1024
+# Live log streaming (/api/file/stream): max. concurrent streams (each one
+# runs on its own thread, not on an HTTP worker), polling interval when
+# inotify is not available and keep-alive interval.
+STREAM_MAX_CLIENTS = int(os.getenv("STREAM_MAX_CLIENTS", "32"))
+STREAM_POLL_SEC = float(os.getenv("STREAM_POLL_SEC", "1"))
+STREAM_KEEPALIVE_SEC = 15
+# Parallel per-jail requests (/api/jails/status, collector): worker threads.
+# More than F2B_POOL_SIZE only wait for a socket connection.
+FANOUT_WORKERS = int(os.getenv("F2B_FANOUT", str(max(SOCKET_POOL_SIZE, 1))))
+# Bulk ban/unban: addresses per multi-address banip/unbanip command,
+# commands pipelined per round trip and max. items per request.
+BULK_CHUNK_SIZE = int(os.getenv("F2B_BULK_CHUNK", "500"))
+BULK_WINDOW = 8
+BULK_MAX_ITEMS = 100000
+# Bearer token for /api/admin/* (unset: admin endpoints are disabled).
+ADMIN_TOKEN = os.getenv("F2B_ADMIN_TOKEN", "")
+# Upper bound for one profiling session in seconds.
+PROFILE_MAX_SEC = float(os.getenv("F2B_PROFILE_MAX", "300"))
+# Ban history (/api/history/*): fail2ban's SQLite database (default: the
+# path fail2ban reports), the sidecar database holding an indexed copy of
+# its bans table (in a private state directory), seconds between syncs and
+# read connections per database. Every sync re-reads the bans of the last
+# HISTORY_SYNC_OVERLAP seconds before the newest copied one.
+HISTORY_SOURCE = os.getenv("F2B_DB_FILE", "")
+HISTORY_DB = os.getenv("F2B_HISTORY_DB", os.path.join(
+    os.getenv("XDG_STATE_HOME") or os.path.expanduser("~/.local/state"),
+    "fail2ban-web", "history.sqlite3"))
+HISTORY_SYNC_SEC = float(os.getenv("F2B_HISTORY_SYNC", "10"))
+HISTORY_POOL_SIZE = int(os.getenv("F2B_HISTORY_POOL", "4"))
+HISTORY_SYNC_BATCH = 10000
+HISTORY_SYNC_OVERLAP = 300
 
 # -------- helpers -------------------------------------------------------------
 
@@ -32,91 +167,180 @@ def _value_line(raw) -> str:
     return (s[0].strip() if s else "")
 
 
-def get_jail_extrainfo(jail: str) -> dict:
-    """Get extra info for a jail (e.g. maxmatches, maxlines, maxretry, findtime, bantime)."""
+EXTRAINFO_KEYS = ("maxlines", "maxmatches", "maxretry", "findtime", "bantime")
+
+
+def _extrainfo_commands(jail: str) -> list:
+    return [["get", jail, key] for key in EXTRAINFO_KEYS]
+
+
+def _parse_extrainfo(raws) -> dict:
+    return {key: _value_line(raw) for key, raw in zip(EXTRAINFO_KEYS, raws)}
+
+
+def get_jail_status(jail: str, max_age: float | None = None,
+                    fields: set | None = None) -> dict:
+    """
+    Parsed jail status plus extra info, fetched in one pipelined batch.
+    `fields` (e.g. {"actions.currentlyBanned", "extra.bantime"} or whole
+    sections like "filter") limits the result, and only the commands
+    needed for it are sent.
+    """
+    if fields is None:
+        raws = cached_commands(
+            [["status", jail]] + _extrainfo_commands(jail), max_age)
+        result = parse_jail_status(raws[0])
+        try:
+            result["extra"] = _parse_extrainfo(raws[1:])
+        except Exception as e:
+            result.setdefault("_errors", {})["extrainfo"] = str(e)
+        return result
+
+    wants_status = any(f.split(".")[0] in ("filter", "actions") for f in fields)
+    extra_keys = [k for k in EXTRAINFO_KEYS
+                  if "extra" in fields or "extra." + k in fields]
+    commands = ([["status", jail]] if wants_status else []) + \
+        [["get", jail, k] for k in extra_keys]
+    raws = cached_commands(commands, max_age) if commands else []
+    result = parse_jail_status(raws[0]) if wants_status else {}
+    if extra_keys:
+        result["extra"] = {k: _value_line(raw)
+                           for k, raw in zip(extra_keys, raws[len(raws) - len(extra_keys):])}
+    return project_fields(result, fields)
+
+
+def project_fields(obj: dict, fields: set) -> dict:
+    """Copy of `obj` with only the given dotted paths ("actions.totalBanned")."""
+    out = {}
+    for path in fields:
+        src, dst = obj, out
+        keys = path.split(".")
+        for i, key in enumerate(keys):
+            if not isinstance(src, dict) or key not in src:
+                break
+            if i == len(keys) - 1:
+                dst[key] = src[key]
+            else:
+                src = src[key]
+                dst = dst.setdefault(key, {})
+    return out
+
+
+def _fields_param(query: str) -> set | None:
+    """Field paths of a `fields=a.b,c` query parameter, None if absent."""
+    value = parse_qs(query).get("fields", [""])[0]
+    fields = {f.strip() for f in value.split(",") if f.strip()}
+    return fields or None
+
+
+def get_jails_status(jails, max_age: float | None = None, fetch=None) -> dict:
+    """
+    Status of several jails as {jail: status}, fetched in parallel on the
+    fan-out pool (one pipelined batch per jail), so the total time is about
+    that of the slowest jail. A jail that fails gets {"error": ...} instead
+    of failing the whole result. `fetch(jail)` replaces get_jail_status.
+    """
+    fetch = fetch or (lambda jail: get_jail_status(jail, max_age))
+    host = current_host()
+
+    def run(jail):
+        select_host(host)
+        try:
+            return fetch(jail)
+        finally:
+            select_host(None)
+
+    return fan_out(_FANOUT, jails, run)
+
+
+def fan_out(executor, items, fn) -> dict:
+    """
+    Run fn(item) for all items on `executor` and wait for them. Returns
+    {item: result}, or {item: {"error": ...}} where fn raised. Stale marks
+    and Server-Timing phases of the workers are handed to the calling
+    thread; parallel work counts with its slowest item.
+    """
+    marks = []
+
+    def run(item):
+        take_stale()
+        take_timings()
+        try:
+            return fn(item)
+        finally:
+            marks.append((take_stale(), take_timings()))
+
+    futures = [(item, executor.submit(run, item)) for item in items]
     out = {}
-    raw = send_command(["get", jail, "maxlines"])
-    out["maxlines"] = _value_line(raw)
-    raw = send_command(["get", jail, "maxmatches"])
-    out["maxmatches"] = _value_line(raw)
-    raw = send_command(["get", jail, "maxretry"])
-    out["maxretry"] = _value_line(raw)
-    raw = send_command(["get", jail, "findtime"])
-    out["findtime"] = _value_line(raw)
-    raw = send_command(["get", jail, "bantime"])
-    out["bantime"] = _value_line(raw)
+    for item, future in futures:
+        try:
+            out[item] = future.result()
+        except Exception as e:
+            out[item] = {"error": str(e)}
+    slowest = {}
+    for age, totals in marks:
+        if age is not None:
+            mark_stale(age)
+        for name, seconds in totals.items():
+            slowest[name] = max(slowest.get(name, 0.0), seconds)
+    add_timings(slowest)
     return out
 
 
-def _build_overview(fields: set | None = None) -> dict:
-    """Collect overview values in one go (sequential socket calls, single HTTP response)."""
+def _build_overview(fields: set | None = None, max_age: float | None = None) -> dict:
+    """Collect overview values in one go (one pipelined batch, single HTTP response)."""
     fields = fields or {
         "version", "loglevel",
         "db.file", "db.maxmatches", "db.purgeage",
         "banned"
     }
 
+    # field -> fail2ban command, in output order
+    wanted = [(f, cmd) for f, cmd in (
+        ("version", ["version"]),
+        ("loglevel", ["get", "loglevel"]),
+        ("db.file", ["get", "dbfile"]),
+        ("db.maxmatches", ["get", "dbmaxmatches"]),
+        ("db.purgeage", ["get", "dbpurgeage"]),
+        ("banned", ["banned"]),
+    ) if f in fields]
+    raws = dict(zip((f for f, _ in wanted),
+                    cached_commands([cmd for _, cmd in wanted], max_age))) if wanted else {}
+
     out = {}
 
-    if "version" in fields:
-        raw = send_command(["version"])
-        out["version"] = flatten_response(raw).strip()
+    if "version" in raws:
+        out["version"] = flatten_response(raws["version"]).strip()
 
-    if "loglevel" in fields:
-        raw = send_command(["get", "loglevel"])
-        out["loglevel"] = _value_line(raw)
+    if "loglevel" in raws:
+        out["loglevel"] = _value_line(raws["loglevel"])
 
     # db subtree
     db = {}
     wants_db = any(k.startswith("db.") for k in fields)
     if wants_db:
-        if "db.file" in fields:
-            raw = send_command(["get", "dbfile"])
-            db["file"] = _value_line(raw)
-        if "db.maxmatches" in fields:
-            raw = send_command(["get", "dbmaxmatches"])
-            db["maxmatches"] = _value_line(raw)
-        if "db.purgeage" in fields:
-            raw = send_command(["get", "dbpurgeage"])
-            db["purgeage"] = _value_line(raw)
+        if "db.file" in raws:
+            db["file"] = _value_line(raws["db.file"])
+        if "db.maxmatches" in raws:
+            db["maxmatches"] = _value_line(raws["db.maxmatches"])
+        if "db.purgeage" in raws:
+            db["purgeage"] = _value_line(raws["db.purgeage"])
         out["db"] = db
 
-    if "banned" in fields:
-        raw = send_command(["banned"])
-        ips = _collect_ips(raw)
+    if "banned" in raws:
+        ips = _collect_ips(raws["banned"])
         out["banned"] = {"ips": ips, "count": len(ips)}
 
     return out
 
 
+_IP_SPLIT_RE = re.compile(r"[\s,;]+")
+
+
 def _collect_ips(obj):
-    """Sammelt rekursiv IPv4-Adressen aus beliebigen fail2ban Antworten (list/tuple/str)."""
-    ips = set()
-
-    def walk(x):
-        if isinstance(x, (list, tuple)):
-            for it in x:
-                walk(it)
-        elif isinstance(x, dict):
-            for v in x.values():
-                walk(v)
-        elif isinstance(x, (bytes, bytearray)):
-            try:
-                s = x.decode("utf-8", errors="ignore")
-            except Exception:
-                s = ""
-            for token in re.split(r"[\s,;]+", s.strip()):
-                if IPV4_RE.match(token):
-                    ips.add(token)
-        else:
-            s = str(x)
-            # Tokens aus Whitespace/Komma/Strichpunkt trennen
-            for token in re.split(r"[\s,;]+", s.strip()):
-                if IPV4_RE.match(token):
-                    ips.add(token)
-    walk(obj)
-    # sortiert zurückgeben
-    return sorted(ips, key=lambda ip: tuple(int(p) for p in ip.split(".")))
+    """Collect all IPv4/IPv6 addresses from a fail2ban reply, sorted numerically."""
+    with timing("parse"):
+        return BannedIndex.from_reply(obj).to_list()
 
 
 def _safe_join_static(relpath: str) -> str:
@@ -127,8 +351,150 @@ def _safe_join_static(relpath: str) -> str:
     return abs_path
 
 
-def _is_valid_ipv4(ip: str) -> bool:
-    return bool(re.match(r"^((25[0-5]|2[0-4]\d|[01]?\d\d?)\.){3}(25[0-5]|2[0-4]\d|[01]?\d\d?)$", ip or ""))
+def _decode_lines(buf: bytes) -> list:
+    """Decode a byte range into lines (universal newlines, no line endings)."""
+    text = buf.decode("utf-8", errors="replace")
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    lines = text.split("\n")
+    if lines and lines[-1] == "":
+        lines.pop()
+    return lines
+
+
+def _read_tail(f, n: int, start: int, end: int, block_size: int = TAIL_BLOCK_SIZE) -> list:
+    """Last n lines of the byte range [start, end) of a binary file, read backwards."""
+    if n <= 0:
+        return []
+    blocks = []
+    newlines = 0
+    pos = end
+    # one newline more than n lines are needed to be sure the first is complete
+    while pos > start and newlines <= n:
+        step = min(block_size, pos - start)
+        pos -= step
+        f.seek(pos)
+        block = f.read(step)
+        newlines += block.count(b"\n")
+        blocks.append(block)
+    return _decode_lines(b"".join(reversed(blocks)))[-n:]
+
+
+def _read_head(f, n: int, start: int, end: int, block_size: int = TAIL_BLOCK_SIZE):
+    """
+    First n complete lines of the byte range [start, end) of a binary file,
+    read forwards in blocks. Returns (lines, offset just after the last one).
+    """
+    blocks = []
+    pos = start
+    f.seek(start)
+    while pos < end and n > 0:
+        block = f.read(min(block_size, end - pos))
+        if not block:
+            break
+        cut = 0
+        while n > 0:
+            nl = block.find(b"\n", cut)
+            if nl == -1:
+                break
+            cut = nl + 1
+            n -= 1
+        if n > 0:
+            cut = len(block)
+        blocks.append(block[:cut])
+        pos += cut
+    return _decode_lines(b"".join(blocks)), pos
+
+
+def _tail_lines(path: str, n: int, block_size: int = TAIL_BLOCK_SIZE) -> list:
+    """
+    Return the last n lines of a file by reading fixed-size blocks backwards
+    from the end, so the cost depends on n and not on the file size.
+    """
+    with open(path, "rb") as f:
+        end = f.seek(0, os.SEEK_END)
+        return _read_tail(f, n, 0, end, block_size)
+
+
+def _last_line_end(f, start: int, end: int, block_size: int = TAIL_BLOCK_SIZE) -> int:
+    """Offset just after the last newline in [start, end), or start if there is none."""
+    pos = end
+    while pos > start:
+        step = min(block_size, pos - start)
+        pos -= step
+        f.seek(pos)
+        idx = f.read(step).rfind(b"\n")
+        if idx != -1:
+            return pos + idx + 1
+    return start
+
+
+def _format_cursor(st, offset: int) -> str:
+    return f"{st.st_dev}:{st.st_ino}:{offset}"
+
+
+def _parse_cursor(value: str):
+    """Return (dev, ino, offset) or None for an empty/invalid cursor."""
+    try:
+        dev, ino, offset = (int(p) for p in value.split(":"))
+    except (AttributeError, ValueError):
+        return None
+    return (dev, ino, offset) if offset >= 0 else None
+
+
+def _follow_file(path: str, n: int, cursor: str) -> dict:
+    """
+    Return the complete lines appended since `cursor` plus a new cursor.
+    A missing cursor, a different inode/device (logrotate) or a file shorter
+    than the cursor offset (truncation) restart from the beginning of the
+    current file and set "reset". n < 0 limits the result to the last -n
+    lines (the earlier ones are skipped), n > 0 to the first n lines of the
+    new range; the cursor then points behind them, so the following lines
+    come with the next call.
+    """
+    with open(path, "rb") as f:
+        st = os.fstat(f.fileno())
+        prev = _parse_cursor(cursor)
+        reset = (prev is None
+                 or (prev[0], prev[1]) != (st.st_dev, st.st_ino)
+                 or prev[2] > st.st_size)
+        start = 0 if reset else prev[2]
+        # only hand out complete lines; a partial last line waits for the next poll
+        end = _last_line_end(f, start, st.st_size)
+        if n < 0:
+            lines = _read_tail(f, -n, start, end)
+        elif n > 0:
+            lines, end = _read_head(f, n, start, end)
+        else:
+            f.seek(start)
+            lines = _decode_lines(f.read(end - start))
+    return {"lines": lines, "cursor": _format_cursor(st, end), "reset": reset}
+
+
+def _head_lines(path: str, n: int) -> list:
+    """Return the first n lines of a file (fewer if the file is shorter)."""
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        if n <= 0:
+            return f.readlines()
+        return list(itertools.islice(f, n))
+
+
+def _parse_ip(ip: str):
+    """
+    Parse an IP once: (4, int) for IPv4, (6, 16 packed bytes) for IPv6,
+    None if it is neither.
+    """
+    if not ip or not isinstance(ip, str):
+        return None
+    try:
+        if ":" in ip:
+            return 6, socket.inet_pton(socket.AF_INET6, ip)
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, ip), "big")
+    except (OSError, ValueError):
+        return None
+
+
+def _is_valid_ip(ip: str) -> bool:
+    return _parse_ip(ip) is not None
 
 
 def _bool(v, default=False):
@@ -141,225 +507,3414 @@ def _bool(v, default=False):
     return default
 
 
-def _json(self, status=200, obj=None, ctype="application/json"):
+def _etag(body: bytes) -> str:
+    """Strong ETag from a cheap content hash."""
+    return '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+
+# ETag suffix per content-coding; a compressed variant is its own representation
+ETAG_SUFFIXES = {"gzip": "-gz", "br": "-br", "zstd": "-zstd"}
+
+
+def _etag_base(tag: str) -> str:
+    tag = tag.strip()
+    if tag.startswith("W/"):
+        tag = tag[2:]
+    for suffix in ETAG_SUFFIXES.values():
+        if tag.endswith(suffix + '"'):
+            return tag[:-len(suffix) - 1] + '"'
+    return tag
+
+
+def _etag_matches(if_none_match, etag: str) -> bool:
+    """If-None-Match comparison; any encoding variant of etag matches."""
+    if not if_none_match:
+        return False
+    base = _etag_base(etag)
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or _etag_base(tag) == base:
+            return True
+    return False
+
+
+def _accepted_encodings(header) -> set:
+    """Codings from an Accept-Encoding header, without the ones with q=0."""
+    out = set()
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        params = params.replace(" ", "")
+        if name and params not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            out.add(name.strip().lower())
+    return out
+
+
+def _dumps(obj) -> bytes:
+    """Compact JSON, via orjson when it is installed."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            pass  # e.g. ints beyond 64 bit
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+
+def _compress(body: bytes, coding: str) -> bytes:
+    if coding == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(body)
+    return gzip.compress(body, compresslevel=6, mtime=0)
+
+
+class EncodedBody:
+    """
+    A serialized JSON body. ETag and compressed variants are computed on
+    first use and kept, so responses sent repeatedly (snapshots) pay for
+    them once.
+    """
+
+    __slots__ = ("body", "_etag", "_variants")
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self._etag = None
+        self._variants = {}
+
+    @property
+    def etag(self) -> str:
+        if self._etag is None:
+            self._etag = _etag(self.body)
+        return self._etag
+
+    def variant(self, coding: str) -> bytes:
+        data = self._variants.get(coding)
+        if data is None:
+            data = self._variants[coding] = _compress(self.body, coding)
+        return data
+
+
+def _encode_json(obj) -> EncodedBody:
+    """Serialized body for responses that are sent repeatedly."""
+    return EncodedBody(_dumps(obj))
+
+
+def _pick_coding(self, size: int):
+    if size < JSON_COMPRESS_MIN:
+        return None
+    accepted = _accepted_encodings(self.headers.get("Accept-Encoding"))
+    if zstandard is not None and "zstd" in accepted:
+        return "zstd"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+# JSON response totals: uncompressed and sent bytes, serialize+compress time
+_JSON_STATS = {"responses": 0, "body_bytes": 0,
+               "sent_bytes": 0, "encode_seconds": 0.0}
+_JSON_STATS_LOCK = threading.Lock()
+
+
+def _json(self, status=200, obj=None, ctype="application/json", headers=None, encoded=None):
+    """
+    Send a JSON response, compressed if the client accepts it and the body
+    is at least JSON_COMPRESS_MIN bytes. Successful GETs carry an ETag and
+    are answered with 304 if the client already has that version.
+    `encoded` may pass a precomputed EncodedBody from _encode_json().
+    """
+    started = _time.perf_counter()
+    if encoded is None and obj is not None:
+        encoded = EncodedBody(_dumps(obj))
+    conditional = status == 200 and self.command == "GET" and encoded is not None
+    if conditional and _etag_matches(self.headers.get("If-None-Match"), encoded.etag):
+        status = 304
+    coding = None
+    body = None
+    if encoded is not None and status != 304:
+        coding = _pick_coding(self, len(encoded.body))
+        body = encoded.variant(coding) if coding else encoded.body
+    if encoded is not None:
+        encode_seconds = _time.perf_counter() - started
+        add_timings({"encode": encode_seconds})
+        with _JSON_STATS_LOCK:
+            _JSON_STATS["responses"] += 1
+            _JSON_STATS["body_bytes"] += len(encoded.body) if body is not None else 0
+            _JSON_STATS["sent_bytes"] += len(body) if body is not None else 0
+            _JSON_STATS["encode_seconds"] += encode_seconds
+
     self.send_response(status)
-    self.send_header("Content-Type", ctype)
+    if status != 304:
+        self.send_header("Content-Type", ctype)
+    if conditional:
+        etag = encoded.etag
+        if coding:
+            etag = etag[:-1] + ETAG_SUFFIXES[coding] + '"'
+        self.send_header("ETag", etag)
+        # clients may keep the body but must revalidate before reusing it
+        self.send_header("Cache-Control", "no-cache")
+    if encoded is not None and len(encoded.body) >= JSON_COMPRESS_MIN:
+        self.send_header("Vary", "Accept-Encoding")
+    if coding:
+        self.send_header("Content-Encoding", coding)
+    stale = take_stale()
+    if stale is not None:
+        # fail2ban did not answer: the body holds the last good result
+        self.send_header("Warning", '110 - "Response is Stale"')
+        self.send_header("X-Stale-Age", f"{stale:.0f}")
+    timings = take_timings()
+    if timings:
+        self.send_header("Server-Timing", server_timing(timings))
+    for k, v in (headers or {}).items():
+        self.send_header(k, v)
+    if body is not None:
+        self.send_header("Content-Length", str(len(body)))
     self.end_headers()
-    if obj is not None:
-        self.wfile.write(json.dumps(obj).encode())
+    if body is not None:
+        self.wfile.write(body)
 
-# -------- socket bridge -------------------------------------------------------
 
+def _unavailable(self, error):
+    """503 for a fail2ban socket that timed out, is busy or behind an open breaker."""
+    _json(self, 503, {"error": str(error)},
+          headers={"Retry-After": str(max(1, int(BREAKER_RESET_SEC)))})
 
-def send_command(command):
+# -------- metrics -------------------------------------------------------------
+
+# Latency buckets in seconds for HTTP requests and socket commands
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _ShardedMetric:
     """
-    Send a command to the fail2ban socket and return the unpickled response.
-    Accepts a string (e.g. "status sshd") or a list of args (["status","sshd"]).
+    Base for metrics updated without a lock: every thread writes to its own
+    {labels: value} shard, and collecting sums up the shards. Only the first
+    update of a thread registers its shard under the lock.
     """
-    if isinstance(command, str):
-        args = command.strip().split()
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+        METRICS.append(self)
+
+    def _shard(self) -> dict:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def _merged(self) -> dict:
+        out = {}
+        for shard in list(self._shards):
+            for labels, value in list(shard.items()):
+                out[labels] = self._merge(out.get(labels), value)
+        return out
+
+
+class Counter(_ShardedMetric):
+    kind = "counter"
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    @staticmethod
+    def _merge(a, b):
+        return b if a is None else a + b
+
+    def samples(self):
+        merged = self._merged()
+        if not merged and not self.labelnames:
+            merged = {(): 0}
+        for labels, value in merged.items():
+            yield self.name, labels, value
+
+
+class Gauge(Counter):
+    """Up/down gauge; inc() and dec() of one unit may run on any thread."""
+
+    kind = "gauge"
+
+    def dec(self, labels: tuple = (), amount: float = 1):
+        self.inc(labels, -amount)
+
+
+class Histogram(_ShardedMetric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames=(),
+                 buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, labels: tuple, value: float):
+        shard = self._shard()
+        series = shard.get(labels)
+        if series is None:
+            # one count per bucket, +Inf, then the sum
+            series = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    @staticmethod
+    def _merge(a, b):
+        return list(b) if a is None else [x + y for x, y in zip(a, b)]
+
+    def samples(self):
+        for labels, series in self._merged().items():
+            total = 0
+            for le, count in zip(self.buckets + ("+Inf",), series):
+                total += count
+                yield self.name + "_bucket", labels + (("le", le),), total
+            yield self.name + "_sum", labels, series[-1]
+            yield self.name + "_count", labels, total
+
+
+class GaugeFunc:
+    """Value read from a callback at scrape time: fn() -> {labels: value}."""
+
+    def __init__(self, name: str, help_text: str, labelnames, fn,
+                 kind: str = "gauge"):
+        self.name = name
+        self.kind = kind
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+        METRICS.append(self)
+
+    def samples(self):
+        for labels, value in self.fn().items():
+            yield self.name, labels, value
+
+
+METRICS = []
+
+
+def _label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_metrics() -> bytes:
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in METRICS:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            pairs = list(zip(metric.labelnames, labels[:len(metric.labelnames)]))
+            pairs += list(labels[len(metric.labelnames):])  # e.g. ("le", 0.5)
+            label_str = ",".join(f'{k}="{_label_value(v)}"' for k, v in pairs)
+            value = repr(float(value)) if isinstance(value, float) else str(value)
+            lines.append(f"{name}{{{label_str}}} {value}" if label_str
+                         else f"{name} {value}")
+    return ("\n".join(lines) + "\n").encode()
+
+
+HTTP_REQUESTS = Counter("f2b_http_requests_total",
+                        "HTTP requests by route template and status.",
+                        ("method", "route", "status"))
+HTTP_SECONDS = Histogram("f2b_http_request_duration_seconds",
+                         "HTTP request latency by route template.",
+                         ("method", "route"))
+HTTP_IN_FLIGHT = Gauge("f2b_http_requests_in_flight",
+                       "HTTP requests being handled.")
+SOCKET_SECONDS = Histogram("f2b_socket_request_duration_seconds",
+                           "fail2ban socket round trip by command verb "
+                           "(pipelined batches: verbs joined with +).",
+                           ("verb",))
+SOCKET_COMMANDS = Counter("f2b_socket_commands_total",
+                          "Commands sent to fail2ban by verb.", ("verb",))
+SOCKET_ERRORS = Counter("f2b_socket_errors_total",
+                        "Failed socket requests by verb and error.",
+                        ("verb", "error"))
+SOCKET_SENT_BYTES = Counter("f2b_socket_sent_bytes_total",
+                            "Bytes sent to fail2ban by verb.", ("verb",))
+SOCKET_RECEIVED_BYTES = Counter("f2b_socket_received_bytes_total",
+                                "Bytes received from fail2ban by verb.", ("verb",))
+SOCKET_IN_FLIGHT = Gauge("f2b_socket_requests_in_flight",
+                         "Socket requests waiting for fail2ban.")
+CACHE_LOOKUPS = Counter("f2b_cache_lookups_total",
+                        "Command cache lookups by result (hit, miss, stale).",
+                        ("result",))
+COALESCED = Counter("f2b_socket_coalesced_total",
+                    "Read batches that joined an identical running request.")
+
+
+def _cache_hit_ratio() -> dict:
+    merged = CACHE_LOOKUPS._merged()
+    total = sum(merged.values())
+    return {(): merged.get(("hit",), 0) / total if total else 0.0}
+
+
+GaugeFunc("f2b_cache_hit_ratio", "Share of command cache lookups that were hits.",
+          (), _cache_hit_ratio)
+GaugeFunc("f2b_cache_entries", "Entries in the command cache.", (),
+          lambda: {(): sum(len(h.cache._entries) for h in HOSTS.values())})
+GaugeFunc("f2b_socket_breaker_open", "1 while the socket circuit breaker is open.",
+          ("host",), lambda: {(h.name,): int(h.pool.breaker.state != "closed")
+                              for h in HOSTS.values()})
+GaugeFunc("f2b_snapshot_age_seconds", "Age of the collector snapshot (-1 = none).",
+          (), lambda: {(): _time.time() - _COLLECTOR._snapshot["ts"]
+                       if _COLLECTOR._snapshot else -1})
+GaugeFunc("f2b_json_responses_total", "JSON responses sent.", (),
+          lambda: {(): _JSON_STATS["responses"]}, "counter")
+GaugeFunc("f2b_json_body_bytes_total", "Uncompressed JSON body bytes.", (),
+          lambda: {(): _JSON_STATS["body_bytes"]}, "counter")
+GaugeFunc("f2b_json_sent_bytes_total", "JSON body bytes sent after compression.", (),
+          lambda: {(): _JSON_STATS["sent_bytes"]}, "counter")
+GaugeFunc("f2b_json_encode_seconds_total", "Time spent encoding JSON responses.", (),
+          lambda: {(): _JSON_STATS["encode_seconds"]}, "counter")
+
+
+# Every API route of do_GET/do_POST; "{name}" matches one path segment.
+# Requests are labelled with their route, everything else with "unmatched",
+# so the label set stays bounded whatever paths clients send.
+API_ROUTES = {
+    "GET": (
+        "/api/overview", "/api/status", "/api/jails", "/api/banned",
+        "/api/jails/status", "/api/jail/{jail}/status",
+        "/api/jail/{jail}/series", "/api/file", "/api/file/stream",
+        "/api/version", "/api/loglevel", "/api/db/file",
+        "/api/db/maxmatches", "/api/db/purgeage", "/api/history/bans",
+        "/api/history/top", "/api/history/repeat", "/api/history/histogram",
+        "/api/admin/profile", "/api/hosts", "/api/hosts/status",
+        "/api/hosts/jails", "/api/hosts/banned", "/api/hosts/jails/status",
+        "/api/hosts/jail/{jail}/status",
+    ),
+    "POST": (
+        "/api/jail/{jail}/ban", "/api/jail/{jail}/unban",
+        "/api/jail/{jail}/ban/bulk", "/api/jail/{jail}/unban/bulk",
+        "/api/jail/{jail}/restart", "/api/jail/{jail}/reload",
+        "/api/jail/{jail}/bantime", "/api/jail/{jail}/findtime",
+        "/api/jail/{jail}/maxretry", "/api/jail/{jail}/maxmatches",
+        "/api/jail/{jail}/maxlines", "/api/server/start",
+        "/api/server/restart", "/api/server/reload", "/api/server/stop",
+        "/api/version", "/api/unban/all", "/api/unban/{ip}", "/api/unban",
+        "/api/loglevel", "/api/db/maxmatches", "/api/db/purgeage",
+        "/api/hosts/jail/{jail}/ban", "/api/hosts/jail/{jail}/unban",
+        "/api/hosts/unban",
+    ),
+}
+
+
+def _compile_routes(routes: dict) -> dict:
+    """{(method, number of segments): [(template, segments)]}, table order."""
+    table = {}
+    for method, templates in routes.items():
+        for template in templates:
+            segments = template.strip("/").split("/")
+            table.setdefault((method, len(segments)), []).append(
+                (template, segments))
+    return table
+
+
+_ROUTE_TABLE = _compile_routes(API_ROUTES)
+
+
+def _route_template(method: str, path: str, status: int | None) -> str:
+    """Route label without IDs, e.g. /api/jail/{jail}/status."""
+    if path == "/metrics" and method == "GET":
+        return path
+    if not path.startswith("/api/"):
+        return "static" if method == "GET" and status != 404 else "unmatched"
+    parts = path.strip("/").split("/")
+    for template, segments in _ROUTE_TABLE.get((method, len(parts)), ()):
+        if all(seg == part or seg.startswith("{")
+               for seg, part in zip(segments, parts)):
+            return template
+    return "unmatched"
+
+# -------- profiling -----------------------------------------------------------
+
+class ProfileSession:
+    """
+    One profiling run over the live server, ended after `seconds` or after
+    `requests` handled requests, whichever comes first.
+
+    mode "sample": the stacks of the threads that are handling a request
+    are recorded every `interval` seconds (collapsed-stack output, for
+    flamegraph.pl/speedscope). mode "cprofile": every request runs under
+    its own cProfile.Profile, merged into one pstats.Stats; from Python
+    3.12 on one profiler sees all threads, so a single one runs instead.
+    """
+
+    # cProfile is built on sys.monitoring, which is process-wide
+    GLOBAL_CPROFILE = sys.version_info >= (3, 12)
+
+    def __init__(self, mode: str, seconds: float, requests: int | None = None,
+                 interval: float = 0.005):
+        self.mode = mode
+        self.deadline = _time.monotonic() + seconds
+        self.remaining = requests
+        self.interval = interval
+        self.requests = 0
+        self.samples = 0
+        self.stacks = {}    # collapsed stack -> samples
+        self.stats = None   # pstats.Stats
+        self.done = threading.Event()
+        self._busy = set()  # idents of threads inside a request
+        self._lock = threading.Lock()
+
+    def run(self):
+        """Block until the session is over."""
+        profile = None
+        if self.mode == "cprofile" and self.GLOBAL_CPROFILE:
+            profile = cProfile.Profile()
+            profile.enable()
+        try:
+            if self.mode == "sample":
+                self._sample()
+            self.done.wait(max(0.0, self.deadline - _time.monotonic()))
+        finally:
+            self.done.set()
+            if profile is not None:
+                profile.disable()
+                self.stats = pstats.Stats(profile)
+
+    def handle(self, fn):
+        """Run one request handler `fn` inside the session."""
+        ident = threading.get_ident()
+        profile = None
+        self._busy.add(ident)
+        if self.mode == "cprofile" and not self.GLOBAL_CPROFILE:
+            profile = cProfile.Profile()
+            profile.enable()
+        try:
+            return fn()
+        finally:
+            if profile is not None:
+                profile.disable()
+            self._busy.discard(ident)
+            with self._lock:
+                if profile is not None:
+                    if self.stats is None:
+                        self.stats = pstats.Stats(profile)
+                    else:
+                        self.stats.add(profile)
+                self.requests += 1
+                if self.remaining is not None and self.requests >= self.remaining:
+                    self.done.set()
+
+    def _sample(self):
+        while not self.done.wait(self.interval):
+            if _time.monotonic() >= self.deadline:
+                return
+            frames = sys._current_frames()
+            for ident in list(self._busy):
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}"
+                                 f":{code.co_firstlineno})")
+                    frame = frame.f_back
+                key = ";".join(reversed(stack))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+                self.samples += 1
+
+    def collapsed(self) -> bytes:
+        lines = sorted(self.stacks.items(), key=lambda kv: -kv[1])
+        return "".join(f"{stack} {count}\n" for stack, count in lines).encode()
+
+    def pstats_text(self, sort: str = "cumulative", limit: int = 50) -> bytes:
+        if self.stats is None:
+            return b"no requests were profiled\n"
+        out = io.StringIO()
+        self.stats.stream = out
+        self.stats.sort_stats(sort).print_stats(limit)
+        return out.getvalue().encode()
+
+    def pstats_dump(self) -> bytes:
+        """Binary pstats file as written by Stats.dump_stats()."""
+        return marshal.dumps(self.stats.stats if self.stats is not None else {})
+
+
+# The running profiling session, if any
+_PROFILE = None
+_PROFILE_LOCK = threading.Lock()
+
+PROFILE_SORT_KEYS = ("cumulative", "tottime", "calls", "ncalls", "time",
+                     "cumtime", "filename", "name")
+
+
+def _admin_authorized(self) -> bool:
+    auth = self.headers.get("Authorization", "")
+    scheme, _, token = auth.partition(" ")
+    return (bool(ADMIN_TOKEN) and scheme.lower() == "bearer"
+            and hmac.compare_digest(token.strip().encode(), ADMIN_TOKEN.encode()))
+
+
+def _send_bytes(self, status: int, body: bytes, ctype: str, headers=None):
+    """Send a non-JSON response that must not be cached."""
+    self.send_response(status)
+    self.send_header("Content-Type", ctype)
+    self.send_header("Content-Length", str(len(body)))
+    self.send_header("Cache-Control", "no-store")
+    for k, v in (headers or {}).items():
+        self.send_header(k, v)
+    self.end_headers()
+    self.wfile.write(body)
+
+
+def _admin_profile(self, query: dict):
+    """GET /api/admin/profile: profile the server, then send the result."""
+    global _PROFILE
+
+    mode = query.get("mode", ["sample"])[0]
+    fmt = query.get("format", ["collapsed" if mode == "sample" else "text"])[0]
+    sort = query.get("sort", ["cumulative"])[0]
+    try:
+        seconds = float(query.get("seconds", ["10"])[0])
+        requests = int(query["requests"][0]) if "requests" in query else None
+        interval = float(query.get("interval", ["5"])[0]) / 1000
+        limit = int(query.get("limit", ["50"])[0])
+        if mode not in ("sample", "cprofile"):
+            raise ValueError("mode must be sample or cprofile")
+        if (mode, fmt) not in (("sample", "collapsed"), ("cprofile", "text"),
+                               ("cprofile", "pstats")):
+            raise ValueError(f"format {fmt} is not available for mode {mode}")
+        if sort not in PROFILE_SORT_KEYS:
+            raise ValueError("sort must be one of " + ", ".join(PROFILE_SORT_KEYS))
+        if not 0 < seconds <= PROFILE_MAX_SEC:
+            raise ValueError(f"seconds must be in (0, {PROFILE_MAX_SEC:g}]")
+        if requests is not None and requests < 1:
+            raise ValueError("requests must be >= 1")
+        if interval <= 0:
+            raise ValueError("interval must be > 0")
+    except (KeyError, ValueError) as e:
+        _json(self, 400, {"error": str(e)})
+        return
+
+    session = ProfileSession(mode, seconds, requests, interval)
+    with _PROFILE_LOCK:
+        if _PROFILE is not None:
+            _json(self, 409, {"error": "a profiling session is already running"})
+            return
+        _PROFILE = session
+    try:
+        session.run()
+    finally:
+        with _PROFILE_LOCK:
+            _PROFILE = None
+
+    summary = {"X-Profile-Requests": str(session.requests)}
+    if mode == "sample":
+        summary["X-Profile-Samples"] = str(session.samples)
+        _send_bytes(self, 200, session.collapsed(), "text/plain; charset=utf-8", summary)
+    elif fmt == "pstats":
+        summary["Content-Disposition"] = 'attachment; filename="app.pstats"'
+        _send_bytes(self, 200, session.pstats_dump(), "application/octet-stream", summary)
     else:
-        args = command
+        _send_bytes(self, 200, session.pstats_text(sort, limit),
+                    "text/plain; charset=utf-8", summary)
 
-    payload = pickle.dumps(list(args), protocol=0)
-    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
-        client.connect(SOCKET_PATH)
-        client.sendall(payload + END_MARKER)
-        data = b""
-        while True:
-            chunk = client.recv(4096)
-            if not chunk:
+# -------- banned IP index -----------------------------------------------------
+
+
+class BannedIndex:
+    """
+    Sorted set of banned IPs stored as packed integers: IPv4 in an
+    array('I'), IPv6 as 16-byte big-endian records in a bytearray (byte
+    order is numeric order). Addresses are parsed once on insert; iteration
+    is in numeric order, IPv4 before IPv6.
+    """
+
+    __slots__ = ("v4", "v6")
+
+    def __init__(self, v4=None, v6=None):
+        self.v4 = v4 if v4 is not None else array("I")
+        self.v6 = v6 if v6 is not None else bytearray()
+
+    @classmethod
+    def from_ips(cls, ips):
+        v4, v6 = set(), set()
+        for ip in ips:
+            parsed = _parse_ip(ip)
+            if parsed is None:
+                continue
+            (v4 if parsed[0] == 4 else v6).add(parsed[1])
+        return cls(array("I", sorted(v4)), bytearray(b"".join(sorted(v6))))
+
+    @classmethod
+    def from_reply(cls, obj):
+        """
+        Build the index from any fail2ban reply (nested lists/dicts/strings).
+        Each string is parsed as one address first and only split into
+        tokens if that fails, which is the hot path for `banned` replies.
+        """
+        v4, v6 = set(), set()
+        pton, frombytes = socket.inet_pton, int.from_bytes
+        af4, af6 = socket.AF_INET, socket.AF_INET6
+
+        def add(tok) -> bool:
+            try:
+                if ":" in tok:
+                    v6.add(pton(af6, tok))
+                else:
+                    v4.add(frombytes(pton(af4, tok), "big"))
+                return True
+            except (OSError, ValueError):
+                return False
+
+        def walk(x):
+            if isinstance(x, str):
+                if not add(x):
+                    for tok in _IP_SPLIT_RE.split(x.strip()):
+                        add(tok)
+            elif isinstance(x, (list, tuple)):
+                for it in x:
+                    # inlined fast path for plain address strings
+                    if type(it) is str and ":" not in it:
+                        try:
+                            v4.add(frombytes(pton(af4, it), "big"))
+                            continue
+                        except (OSError, ValueError):
+                            pass
+                    walk(it)
+            elif isinstance(x, dict):
+                for v in x.values():
+                    walk(v)
+            elif isinstance(x, (bytes, bytearray)):
+                walk(x.decode("utf-8", errors="ignore"))
+            else:
+                walk(str(x))
+
+        walk(obj)
+        return cls(array("I", sorted(v4)), bytearray(b"".join(sorted(v6))))
+
+    def copy(self):
+        return BannedIndex(array("I", self.v4), bytearray(self.v6))
+
+    @property
+    def v6_count(self) -> int:
+        return len(self.v6) // 16
+
+    def __len__(self):
+        return len(self.v4) + self.v6_count
+
+    def _v6_at(self, i: int) -> bytes:
+        return bytes(self.v6[i * 16:(i + 1) * 16])
+
+    def _v6_bisect(self, packed: bytes, right: bool = False) -> int:
+        lo, hi = 0, self.v6_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value = self._v6_at(mid)
+            if value < packed or (right and value == packed):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _find(self, parsed):
+        """(position, present) of a parsed address in its column."""
+        family, value = parsed
+        if family == 4:
+            i = bisect.bisect_left(self.v4, value)
+            return i, i < len(self.v4) and self.v4[i] == value
+        i = self._v6_bisect(value)
+        return i, i < self.v6_count and self._v6_at(i) == value
+
+    def __contains__(self, ip) -> bool:
+        parsed = _parse_ip(ip)
+        return parsed is not None and self._find(parsed)[1]
+
+    def add(self, ip: str) -> bool:
+        """Insert in sorted position; False if invalid or already present."""
+        parsed = _parse_ip(ip)
+        if parsed is None:
+            return False
+        i, present = self._find(parsed)
+        if present:
+            return False
+        if parsed[0] == 4:
+            self.v4.insert(i, parsed[1])
+        else:
+            self.v6[i * 16:i * 16] = parsed[1]
+        return True
+
+    def discard(self, ip: str) -> bool:
+        parsed = _parse_ip(ip)
+        if parsed is None:
+            return False
+        i, present = self._find(parsed)
+        if not present:
+            return False
+        if parsed[0] == 4:
+            del self.v4[i]
+        else:
+            del self.v6[i * 16:(i + 1) * 16]
+        return True
+
+    @staticmethod
+    def _v4_str(value: int) -> str:
+        return socket.inet_ntop(socket.AF_INET, value.to_bytes(4, "big"))
+
+    def __iter__(self):
+        for value in self.v4:
+            yield self._v4_str(value)
+        for i in range(self.v6_count):
+            yield socket.inet_ntop(socket.AF_INET6, self._v6_at(i))
+
+    def to_list(self) -> list:
+        return list(self)
+
+    def _str_at(self, family: int, i: int) -> str:
+        if family == 4:
+            return self._v4_str(self.v4[i])
+        return socket.inet_ntop(socket.AF_INET6, self._v6_at(i))
+
+    def ranges(self, net: str | None = None, prefix: str | None = None) -> list:
+        """
+        Positions matching the filters as sorted, disjoint (family, start,
+        end) slices of the two columns. `net` is a CIDR block, `prefix` a
+        textual prefix of the address (e.g. "203.0.11"); both are resolved
+        by bisection. Only an IPv6 text prefix is a scan, since compressed
+        IPv6 notation does not map to a numeric range.
+        """
+        out = [(4, 0, len(self.v4)), (6, 0, self.v6_count)]
+        if net:
+            out = _intersect_ranges(out, self._net_ranges(net))
+        if prefix:
+            out = _intersect_ranges(out, self._prefix_ranges(prefix))
+        return [r for r in out if r[1] < r[2]]
+
+    def _value_ranges(self, family: int, bounds) -> list:
+        """Column slices for inclusive numeric (lo, hi) bounds."""
+        out = []
+        for lo, hi in bounds:
+            if family == 4:
+                out.append((4, bisect.bisect_left(self.v4, lo),
+                            bisect.bisect_right(self.v4, hi)))
+            else:
+                out.append((6, self._v6_bisect(lo.to_bytes(16, "big")),
+                            self._v6_bisect(hi.to_bytes(16, "big"), right=True)))
+        return out
+
+    def _net_ranges(self, net: str) -> list:
+        network = ipaddress.ip_network(net.strip(), strict=False)
+        return self._value_ranges(network.version, [(
+            int(network.network_address), int(network.broadcast_address))])
+
+    def _prefix_ranges(self, prefix: str) -> list:
+        prefix = prefix.strip().lower()
+        out = []
+        parts = prefix.split(".")
+        if re.fullmatch(r"[0-9.]*", prefix) and len(parts) <= 4:
+            full, partial = parts[:-1], parts[-1]
+            if all(p.isdigit() and str(int(p)) == p and int(p) <= 255 for p in full):
+                shift = 8 * (3 - len(full))
+                base = 0
+                for p in full:
+                    base = (base << 8) | int(p)
+                base <<= 8 * (4 - len(full))
+                low_bits = (1 << shift) - 1
+                out += self._value_ranges(4, [
+                    (base | (a << shift), base | (b << shift) | low_bits)
+                    for a, b in _octet_runs(partial)])
+        if "." not in prefix and re.fullmatch(r"[0-9a-f:]*", prefix):
+            # compressed IPv6 text has no numeric order: scan that column
+            n = self.v6_count
+            i = 0
+            while i < n:
+                if not self._str_at(6, i).startswith(prefix):
+                    i += 1
+                    continue
+                j = i + 1
+                while j < n and self._str_at(6, j).startswith(prefix):
+                    j += 1
+                out.append((6, i, j))
+                i = j
+        return out
+
+    def _after(self, family: int, ip: str) -> int:
+        """First position in `family`'s column that sorts after `ip`."""
+        parsed = _parse_ip(ip)
+        if parsed is None:
+            raise ValueError("invalid cursor")
+        if parsed[0] != family:
+            # IPv4 sorts before all of IPv6
+            return 0 if parsed[0] < family else (
+                len(self.v4) if family == 4 else self.v6_count)
+        if family == 4:
+            return bisect.bisect_right(self.v4, parsed[1])
+        return self._v6_bisect(parsed[1], right=True)
+
+    def page(self, ranges, offset: int = 0, limit: int | None = None,
+             after: str | None = None):
+        """
+        (ips, total, last) for one page of `ranges`: total counts all
+        matches, `after` continues behind that address (keyset paging) and
+        `last` is set when more matches follow the page.
+        """
+        total = sum(end - start for _, start, end in ranges)
+        if after is not None:
+            ranges = [(f, max(start, self._after(f, after)), end)
+                      for f, start, end in ranges]
+        ips = []
+        remaining = total if limit is None else limit
+        skip = offset
+        more = False
+        for family, start, end in ranges:
+            if start >= end:
+                continue
+            if skip >= end - start:
+                skip -= end - start
+                continue
+            start += skip
+            skip = 0
+            if remaining <= 0:
+                more = True
                 break
-            data += chunk
-            if END_MARKER in data:
-                data = data.replace(END_MARKER, b"")
+            stop = min(end, start + remaining)
+            ips.extend(self._str_at(family, i) for i in range(start, stop))
+            remaining -= stop - start
+            if stop < end:
+                more = True
                 break
-    try:
-        return pickle.loads(data)
-    except Exception:
+        return ips, total, (ips[-1] if more and ips else None)
+
+
+def _octet_runs(partial: str) -> list:
+    """Inclusive ranges of octet values whose decimal text starts with `partial`."""
+    if partial == "":
+        return [(0, 255)]
+    if not partial.isdigit() or len(partial) > 3:
+        return []
+    value = int(partial)
+    if partial != str(value):
+        return []  # leading zero: nothing but "0" itself is canonical
+    if value == 0:
+        return [(0, 0)]
+    runs = []
+    scale = 1
+    while value * scale <= 255:
+        runs.append((value * scale, min(255, value * scale + scale - 1)))
+        scale *= 10
+    return runs
+
+
+def _intersect_ranges(a: list, b: list) -> list:
+    """Intersection of two sorted lists of (family, start, end) slices."""
+    out = []
+    for fa, sa, ea in a:
+        for fb, sb, eb in b:
+            if fa == fb and max(sa, sb) < min(ea, eb):
+                out.append((fa, max(sa, sb), min(ea, eb)))
+    return sorted(out)
+
+
+BANNED_QUERY_KEYS = ("offset", "limit", "cursor", "net", "prefix", "jail")
+
+
+def _banned_query(qs) -> dict | None:
+    """
+    Paging and filter parameters of a banned-list request, or None if the
+    request has none (then the full list is returned as before). Raises
+    ValueError for malformed values.
+    """
+    if not any(k in qs for k in BANNED_QUERY_KEYS):
+        return None
+    offset = int(qs.get("offset", ["0"])[0] or 0)
+    limit = qs.get("limit", [""])[0]
+    limit = int(limit) if limit else None
+    if offset < 0 or (limit is not None and limit < 0):
+        raise ValueError("offset and limit must not be negative")
+    cursor = qs.get("cursor", [""])[0] or None
+    if cursor is not None:
         try:
-            return data.decode('utf-8', errors='ignore')
+            cursor = base64.urlsafe_b64decode(
+                cursor + "=" * (-len(cursor) % 4)).decode()
         except Exception:
-            return str(data)
+            raise ValueError("invalid cursor")
+        if _parse_ip(cursor) is None:
+            raise ValueError("invalid cursor")
+    return {"offset": offset, "limit": limit, "after": cursor,
+            "net": qs.get("net", [""])[0] or None,
+            "prefix": qs.get("prefix", [""])[0] or None,
+            "jail": qs.get("jail", [""])[0] or None}
+
+
+def shape_jail_status(status: dict, fields: set | None, query: dict | None,
+                      index) -> dict:
+    """
+    Apply a `fields` projection and banned-list paging to a jail status.
+    `index()` returns the jail's BannedIndex and is only called for paging.
+    """
+    if fields is not None:
+        status = project_fields(status, fields)
+    if query is not None:
+        status = paged_jail_status(status, index(), query)
+    return status
+
+
+def _jail_filter(query: str) -> list | None:
+    """Jail names of a `jails=a,b` query parameter, None if absent."""
+    value = parse_qs(query).get("jails", [""])[0]
+    if not value.strip():
+        return None
+    return list(dict.fromkeys(j.strip() for j in value.split(",") if j.strip()))
+
+
+def banned_page(index: BannedIndex, query: dict) -> dict:
+    """One page of a banned index as {ips, count, offset, limit, next}."""
+    ranges = index.ranges(query["net"], query["prefix"])
+    ips, total, last = index.page(
+        ranges, query["offset"], query["limit"], query["after"])
+    return {
+        "ips": ips,
+        "count": total,
+        "offset": query["offset"],
+        "limit": query["limit"],
+        "next": (base64.urlsafe_b64encode(last.encode()).decode().rstrip("=")
+                 if last is not None else None),
+    }
+
+
+def paged_jail_status(status: dict, index: BannedIndex, query: dict) -> dict:
+    """Jail status with `bannedIPList` replaced by one page of it."""
+    if "bannedIPList" not in status.get("actions", {}):
+        return status  # not among the requested fields
+    page = banned_page(index, query)
+    actions = {**status["actions"], "bannedIPList": page["ips"],
+               "bannedIPCount": page["count"], "next": page["next"]}
+    return {**status, "actions": actions}
+
+
+_INDEXES = OrderedDict()  # key -> (cached reply, BannedIndex built from it)
+_INDEXES_LOCK = threading.Lock()
+
+
+def _indexed(key: str, raw, build) -> BannedIndex:
+    """Index of a cached reply, rebuilt only when the cache returns a new reply."""
+    with _INDEXES_LOCK:
+        hit = _INDEXES.get(key)
+        if hit is not None and hit[0] is raw:
+            _INDEXES.move_to_end(key)
+            return hit[1]
+    # only successful builds are kept, so unknown jails leave no entry
+    index = build(raw)
+    with _INDEXES_LOCK:
+        _INDEXES[key] = (raw, index)
+        _INDEXES.move_to_end(key)
+        while len(_INDEXES) > INDEX_CACHE_SIZE:
+            _INDEXES.popitem(last=False)
+    return index
+
+
+def _jail_banned_index(status: dict) -> BannedIndex:
+    return BannedIndex.from_ips(status["actions"]["bannedIPList"])
+
+
+def banned_index(jail: str | None = None) -> BannedIndex:
+    """Sorted index of all banned IPs, or of one jail's banned IPs."""
+    host = current_host().name
+    if jail is None:
+        return _indexed(host, cached_command(["banned"]), BannedIndex.from_reply)
+    return _indexed(f"{host}:jail:{jail}", cached_command(["status", jail]),
+                    lambda raw: _jail_banned_index(parse_jail_status(raw)))
+
+
+# -------- socket bridge -------------------------------------------------------
+
+
+class _StaleConnection(Exception):
+    """A pooled connection was closed by the fail2ban server while idle."""
+
+
+class CircuitOpenError(ConnectionError):
+    """fail2ban failed repeatedly; requests fail fast for a while."""
+
+
+class PoolBusyError(Exception):
+    """
+    No pooled connection became free before the deadline. This is local
+    contention, not a fail2ban failure, so the breaker does not count it.
+    """
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive socket failures. While open, calls
+    fail immediately with CircuitOpenError; after `reset_after` seconds one
+    trial call is let through, which closes the breaker again on success.
+    """
+
+    def __init__(self, threshold: int, reset_after: float):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        return "half-open" if self._trial else "open"
+
+    def before(self):
+        if self.threshold <= 0:
+            return
+        with self._lock:
+            if self._opened_at is None:
+                return
+            wait = self.reset_after - (_time.monotonic() - self._opened_at)
+            if self._trial or wait > 0:
+                raise CircuitOpenError(
+                    f"fail2ban unavailable after {self._failures} failures, "
+                    f"next attempt in {max(wait, 0):.0f}s")
+            self._trial = True
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def cancel(self):
+        """The call ended without reaching fail2ban: free the trial slot."""
+        with self._lock:
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial = False
+            if self.threshold > 0 and self._failures >= self.threshold:
+                self._opened_at = _time.monotonic()
+
+
+def _remaining(deadline: float | None) -> float | None:
+    """Seconds left until a monotonic deadline (None = no deadline)."""
+    if deadline is None:
+        return None
+    left = deadline - _time.monotonic()
+    if left <= 0:
+        raise TimeoutError("deadline exceeded")
+    return left
+
+
+class SocketPool:
+    """
+    Keeps up to `size` connections to the fail2ban socket open and reuses
+    them for subsequent commands. fail2ban handles any number of commands on
+    one connection, so this saves a connect/accept per command. Every
+    request has a deadline, and a circuit breaker stops new attempts for a
+    while after repeated failures.
+    """
+
+    def __init__(self, path: str, size: int, breaker: CircuitBreaker | None = None):
+        self.path = path
+        self.size = size
+        self.breaker = breaker or CircuitBreaker(0, 0)
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size) if size > 0 else None
+
+    def _connect(self, deadline: float | None = None):
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            timeout = _remaining(deadline)
+            if CONNECT_TIMEOUT > 0:
+                timeout = min(timeout or CONNECT_TIMEOUT, CONNECT_TIMEOUT)
+            conn.settimeout(timeout)
+            conn.connect(self.path)
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    @staticmethod
+    def _healthy(conn) -> bool:
+        """An idle connection must not be readable: that means EOF or junk."""
+        try:
+            readable, _, _ = select.select([conn], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return not readable
+
+    def _acquire(self, deadline: float | None = None):
+        """Return (connection, reused)."""
+        if self._slots is None:
+            return self._connect(deadline), False
+        acquired = False
+        try:
+            acquired = self._slots.acquire(timeout=_remaining(deadline))
+            if acquired:
+                # the wait may have used up the whole deadline
+                _remaining(deadline)
+        except TimeoutError:
+            if acquired:
+                self._slots.release()
+            acquired = False
+        if not acquired:
+            raise PoolBusyError("no fail2ban connection became free in time")
+        try:
+            while True:
+                with self._lock:
+                    conn = self._idle.pop() if self._idle else None
+                if conn is None:
+                    return self._connect(deadline), False
+                if self._healthy(conn):
+                    return conn, True
+                conn.close()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _release(self, conn):
+        if self._slots is None:
+            conn.close()
+            return
+        with self._lock:
+            self._idle.append(conn)
+        self._slots.release()
+
+    def _discard(self, conn):
+        conn.close()
+        if self._slots is not None:
+            self._slots.release()
+
+    def request(self, payloads: list, timeout: float | None = None) -> list:
+        """
+        Write all framed commands back-to-back on one connection and return
+        the raw replies (without marker) in the same order. Raises
+        TimeoutError if connecting and answering take longer than `timeout`
+        seconds, CircuitOpenError while the breaker is open and PoolBusyError
+        if all pooled connections stay busy until then.
+        """
+        self.breaker.before()
+        deadline = _time.monotonic() + timeout if timeout else None
+        try:
+            replies = self._request(payloads, deadline)
+        except OSError as e:
+            # only failures to connect or talk to fail2ban count
+            self.breaker.failure()
+            if isinstance(e, TimeoutError):
+                raise TimeoutError(
+                    f"fail2ban did not answer within {timeout:g}s") from e
+            raise
+        except BaseException:
+            self.breaker.cancel()
+            raise
+        self.breaker.success()
+        return replies
+
+    def _request(self, payloads: list, deadline: float | None) -> list:
+        conn, reused = self._acquire(deadline)
+        try:
+            try:
+                replies, complete = _exchange(conn, payloads, reused, deadline)
+            except (BrokenPipeError, ConnectionResetError, _StaleConnection):
+                if not reused:
+                    raise
+                # idle connection went away (e.g. fail2ban restarted): retry once
+                conn.close()
+                conn = self._connect(deadline)
+                replies, complete = _exchange(conn, payloads, False, deadline)
+        except BaseException:
+            self._discard(conn)
+            raise
+        if complete:
+            self._release(conn)
+        else:
+            self._discard(conn)
+        if len(replies) < len(payloads):
+            raise ConnectionError(
+                f"fail2ban closed the connection after {len(replies)} of {len(payloads)} replies")
+        return replies
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            try:
+                conn.sendall(CLOSE_MARKER + END_MARKER)
+            except OSError:
+                pass
+            conn.close()
+
+
+def _exchange(conn, payloads: list, reused: bool, deadline: float | None = None):
+    """
+    Write the commands and read one reply per command. Returns
+    (replies, complete) where complete is False if the server closed the
+    connection early; a partial last reply is kept as it is.
+
+    Data is received with recv_into() into one growing bytearray, and the
+    end marker is only searched in the newly received bytes (plus the
+    marker length before them), so large replies cost linear time.
+    """
+    conn.settimeout(_remaining(deadline))
+    conn.sendall(b"".join(payloads))
+    replies = []
+    mlen = len(END_MARKER)
+    buf = bytearray(2 * RECV_SIZE)
+    view = memoryview(buf)
+    start = end = 0  # current reply is buf[start:end]
+    try:
+        while len(replies) < len(payloads):
+            if len(buf) - end < RECV_SIZE:
+                # move the current reply to the front, grow if still too small
+                if start:
+                    buf[:end - start] = buf[start:end]
+                    end -= start
+                    start = 0
+                if len(buf) - end < RECV_SIZE:
+                    if end > MAX_REPLY_SIZE:
+                        raise ConnectionError(
+                            f"fail2ban reply exceeds {MAX_REPLY_SIZE} bytes")
+                    view.release()
+                    buf.extend(bytes(len(buf)))
+                    view = memoryview(buf)
+            conn.settimeout(_remaining(deadline))
+            n = conn.recv_into(view[end:end + RECV_SIZE])
+            if not n:
+                if reused and not replies and end == start:
+                    raise _StaleConnection()
+                if end > start:
+                    replies.append(bytes(view[start:end]))
+                return replies, False
+            idx = buf.find(END_MARKER, max(start, end - mlen + 1), end + n)
+            end += n
+            while idx != -1 and len(replies) < len(payloads):
+                replies.append(bytes(view[start:idx]))
+                start = idx + mlen
+                idx = buf.find(END_MARKER, start, end)
+        return replies, True
+    finally:
+        view.release()
+
+
+_FANOUT = ThreadPoolExecutor(max_workers=FANOUT_WORKERS,
+                             thread_name_prefix="fanout")
+
+
+def _encode_command(command) -> bytes:
+    if isinstance(command, str):
+        args = command.strip().split()
+    else:
+        args = command
+    return pickle.dumps(list(args), protocol=0) + END_MARKER
+
+
+class RemoteError(Exception):
+    """An exception from fail2ban whose class is not loaded here."""
+
+    def __init__(self, name: str, *args):
+        super().__init__(*args)
+        self.name = name
+
+    def __str__(self):
+        return f"{self.name.rsplit('.', 1)[-1]}: {super().__str__()}"
+
+
+class _ReplyUnpickler(pickle.Unpickler):
+    """
+    Unpickler for fail2ban replies. Containers, strings and numbers need no
+    class lookup; besides those only sets and built-in exceptions are
+    created. Other exception classes (e.g. fail2ban's own) become
+    RemoteError, anything else is refused.
+    """
+
+    SAFE_BUILTINS = {"set", "frozenset", "bytearray", "complex"}
+    # protocols < 3 use the Python 2 module names
+    BUILTIN_MODULES = {"builtins", "__builtin__", "exceptions"}
+
+    def find_class(self, module, name):
+        if module == "_codecs" and name == "encode":
+            return codecs.encode  # bytes in protocols < 3
+        if module in self.BUILTIN_MODULES:
+            if name in self.SAFE_BUILTINS:
+                return getattr(builtins, name)
+            cls = getattr(builtins, name, None)
+            if isinstance(cls, type) and issubclass(cls, BaseException):
+                return cls
+        if name.endswith(("Error", "Exception")):
+            return lambda *args: RemoteError(f"{module}.{name}", *args)
+        raise pickle.UnpicklingError(f"refusing to load {module}.{name}")
+
+
+def _decode_reply(data: bytes):
+    try:
+        # the C unpickler reads a plain BytesIO op by op; buffered is ~3x faster
+        stream = io.BufferedReader(
+            io.BytesIO(data), max(8192, min(len(data), 1024 * 1024)))
+        return _ReplyUnpickler(stream).load()
+    except Exception:
+        try:
+            return data.decode('utf-8', errors='ignore')
+        except Exception:
+            return str(data)
+
+
+def send_command(command):
+    """
+    Send a command to the fail2ban socket and return the unpickled response.
+    Accepts a string (e.g. "status sshd") or a list of args (["status","sshd"]).
+    """
+    return send_commands([command])[0]
+
+
+def send_commands(commands) -> list:
+    """
+    Send several commands pipelined over one connection and return their
+    unpickled responses in order. Costs roughly one round trip in total.
+    Identical read-only batches that are already in flight are not sent
+    again; the callers share the result of the running one.
+    """
+    keys = tuple(_command_key(c) for c in commands)
+    if keys and all(_is_safe_read(k) for k in keys):
+        return list(current_host().inflight.run(keys, lambda: _send_now(keys)))
+    return _send_now(keys)
+
+
+def _send_now(keys) -> list:
+    timeouts = [_command_timeout(k) for k in keys]
+    timeout = None if not timeouts or None in timeouts else max(timeouts)
+    payloads = [_encode_command(k) for k in keys]
+    verbs = [k[0] if k else "" for k in keys]
+    label = ("+".join(sorted(set(verbs))),)
+    SOCKET_IN_FLIGHT.inc()
+    started = _time.perf_counter()
+    try:
+        with timing("socket"):
+            replies = current_host().pool.request(payloads, timeout)
+    except Exception as e:
+        SOCKET_ERRORS.inc(label + (type(e).__name__,))
+        raise
+    finally:
+        SOCKET_IN_FLIGHT.dec()
+        SOCKET_SECONDS.observe(label, _time.perf_counter() - started)
+    for verb, payload, reply in zip(verbs, payloads, replies):
+        SOCKET_COMMANDS.inc((verb,))
+        SOCKET_SENT_BYTES.inc((verb,), len(payload))
+        SOCKET_RECEIVED_BYTES.inc((verb,), len(reply))
+    return [_decode_reply(data) for data in replies]
+
+
+# Commands that only read state and may therefore be merged
+SAFE_READ_VERBS = {"status", "banned", "get", "version", "ping"}
+# Server/jail control commands, which may legitimately take long
+CONTROL_VERBS = {"start", "stop", "restart", "reload"}
+
+
+def _is_safe_read(key: tuple) -> bool:
+    return key[0] in SAFE_READ_VERBS
+
+
+def _command_timeout(key: tuple) -> float | None:
+    if _is_safe_read(key):
+        timeout = READ_TIMEOUT
+    elif key[0] in CONTROL_VERBS:
+        timeout = CONTROL_TIMEOUT
+    else:
+        timeout = WRITE_TIMEOUT
+    return timeout or None
+
+
+class _Flight:
+    """One in-progress fill that other callers can wait for."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class InflightRequests:
+    """Single-flight: concurrent calls with the same key share one execution."""
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def run(self, key, fn):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            COALESCED.inc()
+            with timing("socket"):
+                flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+        try:
+            flight.value = fn()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.done.set()
+        return flight.value
+
+    def forget_all(self):
+        """Make later callers start a new request instead of joining one."""
+        with self._lock:
+            self._flights.clear()
+
+
+# `set <key> <value>` targets that are server-wide and not jail names
+GLOBAL_SET_KEYS = {"loglevel", "logtarget", "syslogsocket",
+                   "dbfile", "dbmaxmatches", "dbpurgeage"}
+
+
+def write_command(command, invalidates=None):
+    """
+    send_command() for commands that change fail2ban state. Afterwards the
+    cached results it makes stale (`invalidates`, default: derived from the
+    command) are dropped and the collector snapshot is refreshed, so readers
+    see their own writes.
+    """
+    raw = send_command(command)
+    _written(command, invalidates)
+    return raw
+
+
+def _written(command, invalidates=None):
+    """Drop what a completed write made stale and refresh the snapshot."""
+    host = current_host()
+    # reads already running may predate the write
+    host.inflight.forget_all()
+    args = _command_key(command)
+    host.cache.invalidate(_invalidated_keys(args) if invalidates is None else invalidates)
+    if host is DEFAULT_HOST:
+        _COLLECTOR.refresh_for(args)
+
+
+def reply_error(raw) -> str | None:
+    """Error text of a failed fail2ban reply ([1, exception]), else None."""
+    if isinstance(raw, (list, tuple)) and len(raw) == 2 and raw[0] not in (0, "0"):
+        return str(raw[1])
+    return None
+
+
+def flatten_response(resp):
+    """Recursively flatten nested lists/tuples to a newline-separated string."""
+    if isinstance(resp, (list, tuple)):
+        parts = [flatten_response(item) for item in resp]
+        return "\n".join(part for part in parts if part)
+    return str(resp)
+
+# -------- command cache -------------------------------------------------------
+
+# TTL in seconds per read command, matched by the longest command prefix.
+# Commands without a match are not cached.
+CACHE_TTLS = {
+    ("version",): 300.0,
+    ("status",): 2.0,
+    ("banned",): 2.0,
+    ("get",): 10.0,
+}
+
+
+def _command_key(command) -> tuple:
+    if isinstance(command, str):
+        return tuple(command.strip().split())
+    return tuple(str(a) for a in command)
+
+
+def _invalidated_keys(args: tuple) -> list:
+    """Cache key prefixes made stale by a write command."""
+    verb = args[0] if args else ""
+    if verb == "set" and len(args) >= 3:
+        target, key = args[1], args[2]
+        if target in GLOBAL_SET_KEYS:
+            return [("get", target)]
+        if key in ("banip", "unbanip"):
+            return [("status", target), ("banned",)]
+        return [("get", target, key), ("status", target)]
+    if verb == "unban":
+        return [("status",), ("banned",)]
+    # reload, restart, start, stop, ...: anything may have changed
+    return [()]
+
+
+class CommandCache:
+    """
+    LRU cache of decoded fail2ban replies keyed by the command tuple, with
+    per-command TTLs (CACHE_TTLS). Concurrent misses for the same key are
+    filled once (single-flight); the other callers wait for that result.
+    """
+
+    def __init__(self, size: int, ttls: dict):
+        self.size = size
+        self.ttls = ttls
+        self._entries = OrderedDict()  # key -> (timestamp, value)
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def ttl_for(self, key: tuple) -> float:
+        for n in range(len(key), 0, -1):
+            ttl = self.ttls.get(key[:n])
+            if ttl is not None:
+                return ttl
+        return 0.0
+
+    def get_many(self, commands, max_age: float | None = None) -> list:
+        """
+        Return the replies for `commands` in order. Fresh entries (younger
+        than the command TTL, capped by max_age) come from the cache, all
+        misses are fetched together in one pipelined batch.
+        """
+        keys = [_command_key(c) for c in commands]
+        results = [None] * len(keys)
+        mine = {}     # key -> flight this call has to fill
+        waiting = {}  # key -> flight filled by another call
+        now = _time.time()
+        with self._lock:
+            for i, key in enumerate(keys):
+                ttl = self.ttl_for(key) if self.size > 0 else 0.0
+                if max_age is not None:
+                    ttl = min(ttl, max_age)
+                entry = self._entries.get(key)
+                if entry is not None and now - entry[0] < ttl:
+                    self._entries.move_to_end(key)
+                    results[i] = entry[1]
+                    CACHE_LOOKUPS.inc(("hit",))
+                    continue
+                CACHE_LOOKUPS.inc(("miss",))
+                if key in mine or key in waiting:
+                    continue
+                flight = self._flights.get(key) if ttl > 0 else None
+                if flight is not None:
+                    waiting[key] = flight
+                else:
+                    flight = _Flight()
+                    mine[key] = flight
+                    if ttl > 0:
+                        self._flights[key] = flight
+
+        try:
+            if mine:
+                order = list(mine)
+                try:
+                    values = send_commands([list(k) for k in order])
+                except BaseException as e:
+                    self._finish(mine, error=e)
+                    raise
+                self._finish(mine, values=dict(zip(order, values)))
+
+            with timing("socket"):
+                for key, flight in waiting.items():
+                    flight.done.wait()
+                    if flight.error is not None:
+                        raise flight.error
+        except (OSError, PoolBusyError):
+            # fail2ban does not answer: fall back to the last good replies
+            if max_age == 0 or not self._fill_stale(keys, results):
+                raise
+            return results
+
+        for i, key in enumerate(keys):
+            if results[i] is None:
+                flight = mine.get(key) or waiting[key]
+                results[i] = flight.value
+        return results
+
+    def _fill_stale(self, keys, results) -> bool:
+        """
+        Fill the missing results with expired entries up to STALE_MAX_AGE
+        old and mark the current request stale. False if one is missing.
+        """
+        now = _time.time()
+        stale = {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                if results[i] is not None:
+                    continue
+                entry = self._entries.get(key)
+                if entry is None or now - entry[0] > STALE_MAX_AGE:
+                    return False
+                stale[i] = entry
+        for i, (ts, value) in stale.items():
+            results[i] = value
+            mark_stale(now - ts)
+            CACHE_LOOKUPS.inc(("stale",))
+        return True
+
+    def _finish(self, flights: dict, values: dict | None = None, error=None):
+        now = _time.time()
+        with self._lock:
+            for key, flight in flights.items():
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                    if error is None and self.size > 0:
+                        self._entries[key] = (now, values[key])
+                        self._entries.move_to_end(key)
+                flight.value = values[key] if error is None else None
+                flight.error = error
+                flight.done.set()
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, prefixes):
+        """Drop all entries whose key starts with one of the prefixes."""
+        prefixes = [tuple(p) for p in prefixes]
+        with self._lock:
+            for key in [k for k in self._entries
+                        if any(k[:len(p)] == p for p in prefixes)]:
+                del self._entries[key]
+            # fills started before the write must not be stored
+            for key in [k for k in self._flights
+                        if any(k[:len(p)] == p for p in prefixes)]:
+                del self._flights[key]
+
+
+# Age in seconds of the oldest stale result used for the current request
+_STALE = threading.local()
+
+
+def mark_stale(age: float):
+    _STALE.age = max(getattr(_STALE, "age", None) or 0.0, age)
+
+
+def take_stale() -> float | None:
+    """Stale age recorded in this thread since the last call, then reset."""
+    age = getattr(_STALE, "age", None)
+    _STALE.age = None
+    return age
+
+
+# Seconds per phase (socket, parse, encode) of the current request,
+# sent as Server-Timing header
+_TIMINGS = threading.local()
+
+
+@contextlib.contextmanager
+def timing(name: str):
+    """Add the time spent in the block to `name`; nested blocks count once."""
+    active = getattr(_TIMINGS, "active", None)
+    if active is None:
+        active = _TIMINGS.active = set()
+    if name in active:
+        yield
+        return
+    active.add(name)
+    started = _time.perf_counter()
+    try:
+        yield
+    finally:
+        active.discard(name)
+        add_timings({name: _time.perf_counter() - started})
+
+
+def timed(name: str):
+    """Decorator form of timing()."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            with timing(name):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+
+def add_timings(totals: dict):
+    """Add {phase: seconds} to the timings of this thread."""
+    mine = getattr(_TIMINGS, "totals", None)
+    if mine is None:
+        mine = _TIMINGS.totals = {}
+    for name, seconds in totals.items():
+        mine[name] = mine.get(name, 0.0) + seconds
+
+
+def take_timings() -> dict:
+    """Timings recorded in this thread since the last call, then reset."""
+    totals = getattr(_TIMINGS, "totals", None) or {}
+    _TIMINGS.totals = {}
+    return totals
+
+
+def server_timing(totals: dict) -> str:
+    """Server-Timing header value, durations in ms."""
+    return ", ".join(f"{name};dur={seconds * 1000:.2f}"
+                     for name, seconds in totals.items())
+
+
+def cached_command(command, max_age: float | None = None):
+    """send_command() through the result cache."""
+    return current_host().cache.get_many([command], max_age)[0]
+
+
+def cached_commands(commands, max_age: float | None = None) -> list:
+    """send_commands() through the result cache."""
+    return current_host().cache.get_many(commands, max_age)
+
+# -------- hosts ---------------------------------------------------------------
+
+
+class Host:
+    """One fail2ban server: its socket pool, command cache and in-flight reads."""
+
+    def __init__(self, name: str, path: str):
+        self.name = name
+        self.path = path
+        self.pool = SocketPool(path, SOCKET_POOL_SIZE,
+                               CircuitBreaker(BREAKER_THRESHOLD, BREAKER_RESET_SEC))
+        self.cache = CommandCache(CACHE_SIZE, CACHE_TTLS)
+        self.inflight = InflightRequests()
+
+
+HOST_NAME_RE = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+
+def parse_hosts(spec: str) -> dict:
+    """
+    {name: socket path} from "name=path" entries separated by commas or
+    newlines ("#" starts a comment). A single bare path is the host "local".
+    """
+    entries = [line.split("#", 1)[0].strip()
+               for chunk in spec.splitlines() for line in chunk.split(",")]
+    entries = [e for e in entries if e]
+    if len(entries) == 1 and "=" not in entries[0]:
+        return {"local": entries[0]}
+    hosts = {}
+    for entry in entries:
+        name, sep, path = (part.strip() for part in entry.partition("="))
+        if not sep or not path or not HOST_NAME_RE.match(name):
+            raise ValueError(f"invalid host entry {entry!r} (expected name=/path/to/socket)")
+        if name in hosts:
+            raise ValueError(f"duplicate host {name!r}")
+        hosts[name] = path
+    if not hosts:
+        raise ValueError("no fail2ban socket configured")
+    return hosts
+
+
+def _load_hosts() -> dict:
+    if HOSTS_FILE:
+        with open(HOSTS_FILE) as f:
+            spec = f.read()
+    else:
+        spec = SOCKET_PATH
+    return {name: Host(name, path) for name, path in parse_hosts(spec).items()}
+
+
+HOSTS = _load_hosts()
+# the default host serves every request without ?host=
+DEFAULT_HOST = next(iter(HOSTS.values()))
+
+# Requests to several hosts run here, one task per host
+_HOST_FANOUT = ThreadPoolExecutor(max_workers=len(HOSTS), thread_name_prefix="hosts")
+
+# Host the current thread talks to (None: the default host)
+_HOST = threading.local()
+
+
+def current_host() -> Host:
+    return getattr(_HOST, "host", None) or DEFAULT_HOST
+
+
+def select_host(host: Host | None):
+    """Make this thread's socket commands go to `host` (None: default)."""
+    _HOST.host = host
+
+
+def for_each_host(fn, names=None) -> dict:
+    """
+    fn() once per host (all hosts, or the ones in `names`), concurrently,
+    so the total time is that of the slowest host. Returns {host: result};
+    a host that fails or is unknown gets {"error": ...} instead.
+    """
+    names = list(HOSTS) if names is None else names
+    known = [n for n in names if n in HOSTS]
+
+    def run(name):
+        select_host(HOSTS[name])
+        try:
+            return fn()
+        finally:
+            select_host(None)
+
+    done = fan_out(_HOST_FANOUT, known, run)
+    return {n: done[n] if n in done else {"error": "Unknown host"} for n in names}
+
+# -------- parsers -------------------------------------------------------------
+
+
+def parse_global_status(output_or_resp):
+    # structured preferred
+    if not isinstance(output_or_resp, str):
+        d = _normalize_structured_response(output_or_resp)
+        if d:
+            jails = int(d.get("Number of jail", 0) or 0)
+            jail_list_raw = d.get("Jail list", "")
+            if isinstance(jail_list_raw, str):
+                lst = [s.strip() for s in jail_list_raw.replace(
+                    ',', ' ').split() if s.strip()]
+            elif isinstance(jail_list_raw, (list, tuple)):
+                lst = [str(x).strip() for x in jail_list_raw if str(x).strip()]
+            else:
+                lst = []
+            return {"jails": jails, "list": lst}
+
+    # fallback text
+    output = str(output_or_resp)
+    lines = output.splitlines()
+    jails = 0
+    jail_list = []
+    for line in lines:
+        m = re.search(r"Number of jail:\s*(\d+)", line)
+        if m:
+            jails = int(m.group(1))
+        m = re.search(r"Jail list:\s*(.+)", line)
+        if m:
+            jail_list = re.split(r",?\s+", m.group(1).strip())
+    jail_list = [j for j in jail_list if j]
+    return {"jails": jails, "list": jail_list}
+
+
+@timed("parse")
+def parse_jail_status(output_or_resp):
+    # structured
+    if not isinstance(output_or_resp, str):
+        d = _normalize_structured_response(output_or_resp)
+        if d:
+            filt = d.get("Filter", {})
+            act = d.get("Actions", {})
+
+            def g(obj, *keys, default=0):
+                for k in keys:
+                    if k in obj:
+                        return obj[k]
+                return default
+
+            currently_failed = int(
+                g(filt, "Currently failed", "currently failed", default=0) or 0)
+            total_failed = int(
+                g(filt, "Total failed", "total failed", default=0) or 0)
+            file_list_raw = g(filt, "File list", "file list", default=[])
+            file_list = _process_file_list(file_list_raw)
+
+            currently_banned = int(
+                g(act, "Currently banned", "currently banned", default=0) or 0)
+            total_banned = int(
+                g(act, "Total banned", "total banned", default=0) or 0)
+            banned_raw = g(act, "Banned IP list", "banned IP list", default=[])
+
+            if isinstance(banned_raw, str):
+                banned_list = [s.strip()
+                               for s in banned_raw.split() if s.strip()]
+            elif isinstance(banned_raw, (list, tuple)):
+                banned_list = [str(x).strip()
+                               for x in banned_raw if str(x).strip()]
+            else:
+                banned_list = []
+
+            return {
+                "filter": {
+                    "currentlyFailed": currently_failed,
+                    "totalFailed": total_failed,
+                    "fileList": file_list,
+                },
+                "actions": {
+                    "currentlyBanned": currently_banned,
+                    "totalBanned": total_banned,
+                    "bannedIPList": banned_list,
+                },
+            }
+
+    # fallback text
+    output = str(output_or_resp)
+    lines = output.splitlines()
+    currently_failed = 0
+    total_failed = 0
+    file_list = []
+    currently_banned = 0
+    total_banned = 0
+    banned_ip_list = []
+
+    for line in lines:
+        m = re.search(r"Currently failed:\s*(\d+)", line)
+        if m:
+            currently_failed = int(m.group(1))
+            continue
+        m = re.search(r"Total failed:\s*(\d+)", line)
+        if m:
+            total_failed = int(m.group(1))
+            continue
+        m = re.search(r"File list:\s*(.+)", line)
+        if m:
+            raw_files = re.split(r",?\s+", m.group(1).strip())
+            file_list = _process_file_list(raw_files)
+            continue
+        m = re.search(r"Currently banned:\s*(\d+)", line)
+        if m:
+            currently_banned = int(m.group(1))
+            continue
+        m = re.search(r"Total banned:\s*(\d+)", line)
+        if m:
+            total_banned = int(m.group(1))
+            continue
+        m = re.search(r"Banned IP list:\s*(.+)", line)
+        if m:
+            banned_ip_list = re.split(r"\s+", m.group(1).strip())
+            continue
+
+    banned_ip_list = [ip for ip in banned_ip_list if ip]
+    return {
+        "filter": {
+            "currentlyFailed": currently_failed,
+            "totalFailed": total_failed,
+            "fileList": file_list,
+        },
+        "actions": {
+            "currentlyBanned": currently_banned,
+            "totalBanned": total_banned,
+            "bannedIPList": banned_ip_list,
+        },
+    }
+
+
+def _process_file_list(file_list_raw):
+    """Converts file_list_raw to a list of {path, exists} objects."""
+    if isinstance(file_list_raw, str):
+        paths = [s.strip()
+                 for s in re.split(r",\s*|\s+", file_list_raw) if s.strip()]
+    elif isinstance(file_list_raw, (list, tuple)):
+        paths = [str(x).strip() for x in file_list_raw if str(x).strip()]
+    else:
+        paths = []
+    return [{"path": p, "exists": os.path.exists(p)} for p in paths]
+
+
+def _pairs_to_dict(obj):
+    """Recursively converts [("Key", Value), ...] structures into dicts."""
+    if isinstance(obj, (list, tuple)):
+        if all(isinstance(x, (list, tuple)) and len(x) == 2 for x in obj):
+            d = {}
+            for k, v in obj:
+                d[str(k)] = _pairs_to_dict(v)
+            return d
+    return obj
+
+
+def _normalize_structured_response(resp):
+    """
+    Fail2ban often returns [0, [(k,v), ...]].
+    Returns a dict or None if unrecognizable.
+    """
+    root = resp
+    if isinstance(root, (list, tuple)) and len(root) == 2 and isinstance(root[1], (list, tuple)):
+        root = root[1]
+    if isinstance(root, (list, tuple)) and all(isinstance(x, (list, tuple)) and len(x) == 2 for x in root):
+        return _pairs_to_dict(root)
+    return None
+
+# -------- state collector -----------------------------------------------------
+
+
+class StateCollector:
+    """
+    Optionally polls fail2ban in the background (global status, every jail's
+    status and extra info, the banned list) and keeps the result as an
+    immutable snapshot. Read endpoints answer from the latest snapshot
+    instead of querying the socket on every request.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        # older snapshots are not served (e.g. fail2ban is down)
+        self.max_age = max(3 * interval, 10.0)
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    def start(self):
+        if not self.enabled or self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._run, name="state-collector", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def current(self):
+        """Latest snapshot, or None if disabled, not yet collected or too old."""
+        snap = self._snapshot
+        if snap is None or _time.time() - snap["ts"] > self.max_age:
+            return None
+        return snap
+
+    @staticmethod
+    def encoded(snap, name: str, obj) -> EncodedBody:
+        """Encoded body of a snapshot part, computed once per snapshot."""
+        memo = snap["_encoded"]
+        enc = memo.get(name)
+        if enc is None:
+            enc = memo[name] = _encode_json(obj)
+        return enc
+
+    @staticmethod
+    def banned_index(snap, jail: str | None = None) -> BannedIndex:
+        """Global or per-jail banned index, built once per snapshot."""
+        if jail is None:
+            return snap["banned_index"]
+        memo = snap["_encoded"]
+        index = memo.get(("index", jail))
+        if index is None:
+            index = memo[("index", jail)] = _jail_banned_index(
+                snap["jails"][jail])
+        return index
+
+    @staticmethod
+    def age_headers(snap) -> dict:
+        return {"X-Snapshot-Age": f"{_time.time() - snap['ts']:.3f}"}
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh_all()
+            except Exception as e:
+                print(f"state collector: {e}")
+            self._stop.wait(self.interval)
+
+    def refresh_all(self):
+        status = parse_global_status(cached_command(["status"], max_age=0))
+        jails = {}
+        for jail, jail_status in get_jails_status(status["list"], max_age=0).items():
+            if "error" in jail_status:
+                print(f"state collector: jail {jail}: {jail_status['error']}")
+            else:
+                jails[jail] = jail_status
+        index = self._collect_banned()
+        with self._lock:
+            self._snapshot = {"ts": _time.time(), "status": status,
+                              "jails": jails, "banned_index": index,
+                              "banned": self._banned_dict(index),
+                              "_encoded": {}}
+
+    def refresh_jail(self, jail: str, op: str | None = None, ips=()):
+        """
+        Refresh one jail. For banip/unbanip the global banned index is
+        updated in place instead of fetching the whole banned list again.
+        """
+        snap = self._snapshot
+        if snap is None or jail not in snap["jails"]:
+            return
+        jail_status = get_jail_status(jail, max_age=0)
+        with self._lock:
+            old = self._snapshot
+            jails = {**old["jails"], jail: jail_status}
+            index = old["banned_index"]
+            if op == "banip":
+                index = index.copy()
+                for ip in ips:
+                    index.add(ip)
+            elif op == "unbanip":
+                index = index.copy()
+                # only gone if no other jail still bans it; one set per
+                # refresh keeps bulk unbans linear
+                still_banned = set()
+                for j in jails.values():
+                    still_banned.update(j["actions"]["bannedIPList"])
+                for ip in ips:
+                    if ip not in still_banned:
+                        index.discard(ip)
+            self._snapshot = {**old, "ts": _time.time(), "jails": jails,
+                              "banned_index": index,
+                              "banned": self._banned_dict(index),
+                              "_encoded": {}}
+
+    @staticmethod
+    def _collect_banned() -> BannedIndex:
+        return BannedIndex.from_reply(cached_command(["banned"], max_age=0))
+
+    @staticmethod
+    def _banned_dict(index: BannedIndex) -> dict:
+        return {"ips": index.to_list(), "count": len(index)}
+
+    def refresh_for(self, command):
+        """Refresh whatever a write command may have changed."""
+        if self._snapshot is None:
+            return
+        args = _command_key(command)
+        try:
+            if args[0] == "set" and len(args) >= 3 and args[1] not in GLOBAL_SET_KEYS:
+                self.refresh_jail(args[1], args[2], args[3:])
+            elif args[0] == "set":
+                pass  # server-wide settings are not part of the snapshot
+            else:
+                # unban, reload, restart, start, stop, ...
+                self.refresh_all()
+        except Exception as e:
+            # the write itself succeeded; the next cycle catches up
+            print(f"state collector: refresh after {args[0]}: {e}")
+
+
+_COLLECTOR = StateCollector(COLLECT_INTERVAL)
+
+# -------- jail series ---------------------------------------------------------
+
+# Recorded per jail; "current" values are averaged when downsampling,
+# the totals keep their last value
+SERIES_FIELDS = ("currentlyFailed", "totalFailed", "currentlyBanned", "totalBanned")
+SERIES_PATHS = ("filter.currentlyFailed", "filter.totalFailed",
+                "actions.currentlyBanned", "actions.totalBanned")
+SERIES_AVERAGED = (True, False, True, False)
+
+
+class SeriesRing:
+    """
+    One resolution of a jail's counters: the last `slots` rows of
+    (timestamp, values) in arrays allocated once, overwritten in a ring.
+    """
+
+    def __init__(self, step: float, slots: int, width: int):
+        self.step = step
+        self.slots = slots
+        self.width = width
+        self.ts = array("I", [0]) * slots
+        self.values = array("d", [0.0]) * (slots * width)
+        self.head = 0   # next slot to write
+        self.count = 0  # slots in use
+
+    def append(self, ts: int, values):
+        i = self.head
+        self.ts[i] = ts
+        base = i * self.width
+        for k in range(self.width):
+            self.values[base + k] = values[k]
+        self.head = (i + 1) % self.slots
+        if self.count < self.slots:
+            self.count += 1
+
+    def _slot(self, n: int) -> int:
+        """Slot of the n-th oldest row."""
+        return (self.head - self.count + n) % self.slots
+
+    def _bisect(self, ts: float) -> int:
+        """Number of rows older than `ts`."""
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.ts[self._slot(mid)] < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def window(self, since: float, until: float) -> tuple:
+        """Rows with since <= ts < until as (ts array, [values array per field])."""
+        first, last = self._bisect(since), self._bisect(until)
+        w = self.width
+        # at most two contiguous runs of slots: before and after the wrap
+        runs = []
+        if last > first:
+            start, end = self._slot(first), self._slot(last - 1) + 1
+            runs = [(start, end)] if start < end else [(start, self.slots), (0, end)]
+        ts = array("I")
+        columns = [array("d") for _ in range(w)]
+        for start, end in runs:
+            ts += self.ts[start:end]
+            for k in range(w):
+                columns[k] += self.values[start * w + k:end * w:w]
+        return ts, columns
+
+
+def series_levels(interval: float, windows=SERIES_WINDOWS) -> tuple:
+    """
+    Ring layout as (multiple of the interval, slots) per resolution, so each
+    (step, window) of `windows` holds for any sampling interval. A step is
+    rounded to a whole multiple of the previous one; a step that is not
+    coarser than the previous one only extends that ring's window.
+    """
+    levels = []
+    for step, window in windows:
+        mult = max(1, round(step / interval))
+        if levels:
+            prev = levels[-1][0]
+            mult = max(prev, mult // prev * prev)
+            if mult == prev:
+                levels[-1] = (prev, max(levels[-1][1], math.ceil(window / (interval * prev))))
+                continue
+        levels.append((mult, math.ceil(window / (interval * mult))))
+    return tuple(levels)
+
+
+class JailSeries:
+    """A jail's counters at every resolution of `levels` (see series_levels())."""
+
+    def __init__(self, interval: float, levels):
+        width = len(SERIES_FIELDS)
+        self.rings = [SeriesRing(round(interval * mult, 6), slots, width)
+                      for mult, slots in levels]
+        # rows of level i that make up one row of level i + 1
+        self._ratios = [b[0] // a[0] for a, b in zip(levels, levels[1:])]
+        self._pending = [array("d", [0.0]) * width for _ in self._ratios]
+        self._pending_count = [0] * len(self._ratios)
+        self.last_seen = 0
+
+    def record(self, ts: int, values):
+        self.last_seen = ts
+        self._append(0, ts, values)
+
+    def _append(self, level: int, ts: int, values):
+        self.rings[level].append(ts, values)
+        if level == len(self._ratios):
+            return
+        pending = self._pending[level]
+        for k, averaged in enumerate(SERIES_AVERAGED):
+            pending[k] = pending[k] + values[k] if averaged else values[k]
+        n = self._pending_count[level] = self._pending_count[level] + 1
+        if n < self._ratios[level]:
+            return
+        for k, averaged in enumerate(SERIES_AVERAGED):
+            if averaged:
+                pending[k] /= n
+        self._pending_count[level] = 0
+        self._append(level + 1, ts, pending)
+        for k in range(len(pending)):
+            pending[k] = 0.0
+
+    def ring_for(self, span: float, step: float | None = None) -> SeriesRing:
+        """The finest resolution covering `span` seconds, or the one with `step`."""
+        if step is not None:
+            for ring in self.rings:
+                if abs(ring.step - step) < 1e-6:
+                    return ring
+            raise ValueError("step must be one of "
+                             + ", ".join(f"{r.step:g}" for r in self.rings))
+        for ring in self.rings:
+            if ring.step * ring.slots >= span:
+                return ring
+        return self.rings[-1]
+
+
+class SeriesSampler:
+    """
+    Records SERIES_FIELDS of every jail on every host each `interval`
+    seconds into fixed-size JailSeries, so memory does not grow with the
+    uptime. Jails not seen for the longest window are dropped.
+    """
+
+    def __init__(self, interval: float, levels=None):
+        self.interval = interval
+        if levels is None and interval > 0:
+            levels = series_levels(interval)
+        self.levels = levels
+        self._series = {}  # (host, jail) -> JailSeries
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    def start(self):
+        if not self.enabled or self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._run, name="series-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        # fixed rate: a slow round does not shift the following ones
+        next_at = _time.monotonic()
+        while not self._stop.wait(max(0.0, next_at - _time.monotonic())):
+            next_at += self.interval
+            try:
+                self.sample()
+            except Exception as e:
+                print(f"series sampler: {e}")
+
+    def sample(self):
+        ts = int(_time.time())
+        results = for_each_host(self._sample_host)
+        keep_after = ts - max(self.interval * m * n for m, n in self.levels)
+        with self._lock:
+            for host, statuses in results.items():
+                if "error" in statuses:
+                    continue
+                for jail, status in statuses.items():
+                    values = [_lookup(status, path) for path in SERIES_PATHS]
+                    if any(not isinstance(v, (int, float)) for v in values):
+                        continue  # jail failed this round: leave a gap
+                    series = self._series.get((host, jail))
+                    if series is None:
+                        series = self._series[(host, jail)] = JailSeries(
+                            self.interval, self.levels)
+                    series.record(ts, values)
+            for key in [k for k, v in self._series.items() if v.last_seen < keep_after]:
+                del self._series[key]
+
+    def _sample_host(self) -> dict:
+        max_age = self.interval / 2
+        jails = parse_global_status(cached_command(["status"], max_age))["list"]
+        fields = set(SERIES_PATHS)
+        return get_jails_status(
+            jails, fetch=lambda jail: get_jail_status(jail, max_age, fields=fields))
+
+    def window(self, host: str, jail: str, since: float, until: float,
+               step: float | None = None) -> dict | None:
+        """Columns of a jail's series between since and until, None if unknown."""
+        with self._lock:
+            series = self._series.get((host, jail))
+            if series is None:
+                return None
+            ring = series.ring_for(until - since, step)
+            ts, columns = ring.window(since, until)
+        return {"jail": jail, "step": ring.step, "ts": ts.tolist(),
+                "values": {name: col.tolist() for name, col in zip(SERIES_FIELDS, columns)}}
+
+
+def _lookup(obj, path: str):
+    for key in path.split("."):
+        if not isinstance(obj, dict):
+            return None
+        obj = obj.get(key)
+    return obj
+
+
+_SERIES = SeriesSampler(SERIES_INTERVAL)
+
+
+def jail_series(jail: str, qs: dict) -> dict | None:
+    """GET /api/jail/{jail}/series: ?window=1h (default) or since/until, optional step."""
+    now = _time.time()
+    until = parse_time(qs["until"][0]) if qs.get("until") else now + 1
+    if qs.get("since"):
+        since = parse_time(qs["since"][0])
+    else:
+        window = qs.get("window", ["1h"])[0].strip()
+        m = RELATIVE_TIME_RE.match(window)
+        if not m:
+            raise ValueError(f"invalid window {window!r} (e.g. 1h, 24h, 7d)")
+        since = until - int(m.group(1)) * TIME_UNITS[m.group(2)]
+    if since >= until:
+        raise ValueError("since must be before until")
+    step = float(qs["step"][0]) if qs.get("step") else None
+    return _SERIES.window(current_host().name, jail, since, until, step)
+
+# -------- static assets -------------------------------------------------------
+
+
+class StaticAssets:
+    """
+    The frontend build loaded into memory once, with gzip (and brotli, if
+    available) variants and caching headers: content-hashed files are
+    immutable, everything else (index.html) is revalidated via ETag or
+    Last-Modified.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self._files = {}
+
+    def load(self):
+        files = {}
+        for dirpath, _dirs, names in os.walk(self.root):
+            for name in names:
+                abs_path = os.path.join(dirpath, name)
+                try:
+                    if os.path.getsize(abs_path) > STATIC_PRELOAD_MAX:
+                        continue
+                    files[os.path.relpath(abs_path, self.root)] = self._entry(abs_path)
+                except OSError as e:
+                    print(f"static: skipping {abs_path}: {e}")
+        self._files = files
+
+    @staticmethod
+    def _entry(abs_path: str) -> dict:
+        with open(abs_path, "rb") as f:
+            body = f.read()
+        mtime = os.path.getmtime(abs_path)
+        ext = os.path.splitext(abs_path)[1].lower()
+        ctype = STATIC_CONTENT_TYPES.get(ext, "application/octet-stream")
+        etag = hashlib.blake2b(body, digest_size=12).hexdigest()
+        variants = {"identity": (body, f'"{etag}"')}
+        compressible = ctype.startswith("text/") or ctype in (
+            "application/javascript", "application/json", "image/svg+xml")
+        if compressible and len(body) > 256:
+            gz = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(gz) < len(body) * 0.9:
+                variants["gzip"] = (gz, f'"{etag}{ETAG_SUFFIXES["gzip"]}"')
+            if brotli is not None:
+                br = brotli.compress(body, quality=11)
+                if len(br) < len(body) * 0.9:
+                    variants["br"] = (br, f'"{etag}{ETAG_SUFFIXES["br"]}"')
+        if HASHED_ASSET_RE.search(os.path.basename(abs_path)):
+            cache_control = "public, max-age=31536000, immutable"
+        else:
+            cache_control = "no-cache"
+        return {
+            "ctype": ctype,
+            "variants": variants,
+            "mtime": int(mtime),
+            "last_modified": formatdate(mtime, usegmt=True),
+            "cache_control": cache_control,
+        }
+
+    def get(self, abs_path: str):
+        return self._files.get(os.path.relpath(abs_path, self.root))
+
+
+_STATIC = StaticAssets(STATIC_ROOT)
+
+
+def _not_modified(self, entry: dict) -> bool:
+    inm = self.headers.get("If-None-Match")
+    if inm:
+        return _etag_matches(inm, entry["variants"]["identity"][1])
+    ims = self.headers.get("If-Modified-Since")
+    if ims:
+        try:
+            return entry["mtime"] <= parsedate_to_datetime(ims).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _send_static(self, entry: dict):
+    """Send a preloaded static file in the best encoding the client accepts."""
+    accepted = _accepted_encodings(self.headers.get("Accept-Encoding"))
+    coding = next((c for c in ("br", "gzip") if c in entry["variants"] and c in accepted),
+                  "identity")
+    body, etag = entry["variants"][coding]
+    not_modified = _not_modified(self, entry)
+
+    self.send_response(304 if not_modified else 200)
+    self.send_header("ETag", etag)
+    self.send_header("Last-Modified", entry["last_modified"])
+    self.send_header("Cache-Control", entry["cache_control"])
+    if len(entry["variants"]) > 1:
+        self.send_header("Vary", "Accept-Encoding")
+    if not_modified:
+        self.end_headers()
+        return
+    self.send_header("Content-Type", entry["ctype"])
+    if coding != "identity":
+        self.send_header("Content-Encoding", coding)
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+
+def _send_static_file(self, file_path: str):
+    """Send a file that is not preloaded straight from disk (sendfile)."""
+    ext = os.path.splitext(file_path)[1].lower()
+    ctype = STATIC_CONTENT_TYPES.get(ext, "application/octet-stream")
+    with open(file_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(size))
+        self.end_headers()
+        self.connection.sendfile(f)
+
+
+# -------- live log streaming --------------------------------------------------
+
+
+class _Inotify:
+    """Minimal ctypes binding to Linux inotify. Raises OSError if unavailable."""
+
+    IN_MODIFY = 0x002
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_MOVE_SELF = 0x800
+    _EVENT = struct.Struct("iIII")
+
+    def __init__(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c")
+                               or "libc.so.6", use_errno=True)
+            self._add = libc.inotify_add_watch
+            self._rm = libc.inotify_rm_watch
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError) as e:
+            raise OSError(f"inotify not available: {e}")
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.fd = fd
+
+    def add_watch(self, path: str, mask: int) -> int:
+        wd = self._add(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed: {path}")
+        return wd
+
+    def rm_watch(self, wd: int):
+        self._rm(self.fd, wd)
+
+    def read(self, timeout: float) -> list:
+        """Wait up to timeout seconds and return [(wd, name), ...]."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        pos = 0
+        while pos + self._EVENT.size <= len(buf):
+            wd, _mask, _cookie, length = self._EVENT.unpack_from(buf, pos)
+            pos += self._EVENT.size
+            name = buf[pos:pos + length].rstrip(b"\0")
+            pos += length
+            events.append((wd, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class _StreamSubscriber:
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=256)
+        self.overflow = False
+
+
+class FileWatcher:
+    """
+    Follows one file and fans new lines out to all subscribers, so any number
+    of clients watching the same log share a single watch and a single read.
+    Uses inotify on the file (writes) and its directory (rotation) and falls
+    back to polling os.stat() when inotify is not available.
+    """
+
+    _registry = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._subs = set()
+        self._stop = threading.Event()
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            end = _last_line_end(f, 0, st.st_size)
+        self._cursor = _format_cursor(st, end)
+        self._stat = (st.st_ino, st.st_size)
+        self._thread = threading.Thread(
+            target=self._run, name=f"watch:{path}", daemon=True)
+
+    @classmethod
+    def subscribe(cls, path: str, n: int):
+        """
+        Register a subscriber for path and return (watcher, subscriber,
+        snapshot). The snapshot (last -n lines, first n lines, whole file for
+        n == 0) is followed by the updates from the current end of the file.
+        """
+        with cls._registry_lock:
+            watcher = cls._registry.get(path)
+            if watcher is None:
+                watcher = cls(path)
+                cls._registry[path] = watcher
+                watcher._thread.start()
+            sub = _StreamSubscriber()
+            with watcher._lock:
+                snapshot = watcher._snapshot(n)
+                watcher._subs.add(sub)
+        return watcher, sub, snapshot
+
+    def unsubscribe(self, sub):
+        with self._registry_lock:
+            with self._lock:
+                self._subs.discard(sub)
+                if self._subs:
+                    return
+            self._stop.set()
+            if self._registry.get(self.path) is self:
+                del self._registry[self.path]
+
+    def _snapshot(self, n: int) -> list:
+        dev, ino, end = _parse_cursor(self._cursor)
+        with open(self.path, "rb") as f:
+            st = os.fstat(f.fileno())
+            if (st.st_dev, st.st_ino) != (dev, ino) or st.st_size < end:
+                # rotated since the last check; the next update resets anyway
+                return []
+            if n < 0:
+                return _read_tail(f, -n, 0, end)
+            if n > 0:
+                return _read_head(f, n, 0, end)[0]
+            f.seek(0)
+            return _decode_lines(f.read(end))
+
+    def _check(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return
+        if (st.st_ino, st.st_size) == self._stat:
+            return
+        with self._lock:
+            try:
+                update = _follow_file(self.path, 0, self._cursor)
+            except OSError:
+                return
+            self._cursor = update["cursor"]
+            self._stat = (st.st_ino, st.st_size)
+            if not update["lines"] and not update["reset"]:
+                return
+            for sub in self._subs:
+                try:
+                    sub.queue.put_nowait(update)
+                except queue.Full:
+                    sub.overflow = True
+
+    def _run(self):
+        try:
+            ino = _Inotify()
+        except OSError:
+            ino = None
+        name = os.path.basename(self.path)
+        file_wd = None
+        try:
+            if ino is not None:
+                ino.add_watch(os.path.dirname(self.path),
+                              ino.IN_CREATE | ino.IN_MOVED_TO | ino.IN_MOVED_FROM | ino.IN_DELETE)
+                # bind-mounted files do not report writes via the directory
+                file_wd = ino.add_watch(self.path, ino.IN_MODIFY | ino.IN_MOVE_SELF | ino.IN_DELETE_SELF)
+        except OSError:
+            ino.close()
+            ino = None
+        try:
+            while not self._stop.is_set():
+                if ino is None:
+                    self._stop.wait(STREAM_POLL_SEC)
+                    self._check()
+                    continue
+                # periodic rescan as a safety net for missed events
+                events = ino.read(STREAM_KEEPALIVE_SEC)
+                if events and not any(wd == file_wd or ev_name == name
+                                      for wd, ev_name in events):
+                    continue
+                prev_ino = self._stat[0]
+                self._check()
+                if self._stat[0] != prev_ino:
+                    # rotated: move the file watch to the new inode
+                    try:
+                        ino.rm_watch(file_wd)
+                        file_wd = ino.add_watch(
+                            self.path, ino.IN_MODIFY | ino.IN_MOVE_SELF | ino.IN_DELETE_SELF)
+                    except OSError:
+                        pass
+        finally:
+            if ino is not None:
+                ino.close()
+
+
+_STREAM_SLOTS = threading.BoundedSemaphore(max(1, STREAM_MAX_CLIENTS))
+# set on shutdown; every stream loop checks it and is woken up through its queue
+_STREAMS_STOP = threading.Event()
+
+
+def stop_streams():
+    """End all open log streams so the server can shut down."""
+    _STREAMS_STOP.set()
+    with FileWatcher._registry_lock:
+        watchers = list(FileWatcher._registry.values())
+    for watcher in watchers:
+        watcher._stop.set()
+        with watcher._lock:
+            subs = list(watcher._subs)
+        for sub in subs:
+            try:
+                sub.queue.put_nowait(None)
+            except queue.Full:
+                # busy stream, it sees the event after the next update
+                pass
+
+
+def _stream_loop(write, sub, file_path):
+    try:
+        while not sub.overflow and not _STREAMS_STOP.is_set():
+            try:
+                update = sub.queue.get(timeout=STREAM_KEEPALIVE_SEC)
+            except queue.Empty:
+                # also detects clients that went away
+                write(b": keep-alive\n\n")
+                continue
+            if update is None:
+                break
+            write(b"data: " + _dumps({"path": file_path, "lines": update["lines"],
+                                      "reset": update["reset"]}) + b"\n\n")
+        # client is too slow: close, EventSource reconnects with a fresh snapshot
+    except OSError:
+        # BrokenPipeError, ConnectionResetError, TimeoutError
+        pass
+
+
+def _stream_file(self, qs):
+    """Server-Sent Events stream of a log file (GET /api/file/stream)."""
+    file_path = qs.get("path", [""])[0]
+    try:
+        lines_param = int(qs.get("lines", ["-100"])[0])
+    except ValueError:
+        lines_param = -100
+
+    abs_path = os.path.abspath(file_path)
+    if not os.path.exists(abs_path) or not os.path.isfile(abs_path):
+        _json(self, 404, {"error": "File not found", "path": file_path})
+        return
+    if _STREAMS_STOP.is_set() or not _STREAM_SLOTS.acquire(blocking=False):
+        _json(self, 503, {"error": "Too many log streams"})
+        return
+    detached = False
+    try:
+        try:
+            watcher, sub, snapshot = FileWatcher.subscribe(
+                abs_path, lines_param)
+        except Exception as e:
+            _json(self, 500, {"error": str(e)})
+            return
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("X-Accel-Buffering", "no")
+            self.end_headers()
+            self.wfile.write(b"data: " + _dumps(
+                {"path": file_path, "lines": snapshot, "reset": True}) + b"\n\n")
+            self.wfile.flush()
+            self.close_connection = True
+            detach = getattr(self.server, "detach", None)
+            if detach is None:
+                # single-threaded server: stream on this thread
+                def write(data):
+                    self.wfile.write(data)
+                    self.wfile.flush()
+                _stream_loop(write, sub, file_path)
+                return
+            # hand the connection to its own thread so the worker is freed
+            conn = self.request
+            detach(conn)
+            detached = True
+
+            def serve():
+                try:
+                    _stream_loop(conn.sendall, sub, file_path)
+                finally:
+                    watcher.unsubscribe(sub)
+                    _STREAM_SLOTS.release()
+                    self.server.release_detached(conn)
+
+            threading.Thread(target=serve, name=f"stream:{abs_path}",
+                             daemon=True).start()
+        except OSError:
+            pass
+        finally:
+            if not detached:
+                watcher.unsubscribe(sub)
+    finally:
+        if not detached:
+            _STREAM_SLOTS.release()
+
+
+# -------- ban history ---------------------------------------------------------
+
+class HistoryUnavailable(Exception):
+    """fail2ban's database cannot be read (no database, not mounted, ...)."""
+
+
+class SQLitePool:
+    """Up to `size` reusable connections from `connect()`, one per user at a time."""
+
+    def __init__(self, connect, size: int):
+        self._connect = connect
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max(size, 1))
+
+    @contextlib.contextmanager
+    def connection(self):
+        with self._slots:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            try:
+                yield conn
+            except sqlite3.DatabaseError:
+                conn.close()  # may be broken, e.g. the file was replaced
+                raise
+            self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def _connect_readonly(path: str):
+    # mode=ro never writes; WAL databases only need a readable -shm file
+    conn = sqlite3.connect(f"file:{quote(os.path.abspath(path))}?mode=ro",
+                           uri=True, timeout=5, check_same_thread=False)
+    conn.execute("PRAGMA query_only = 1")
+    return conn
+
+
+class BanHistory:
+    """
+    Ban history of one fail2ban server. SQLite cannot index a table of
+    another database file, so the `bans` rows of fail2ban's database are
+    copied incrementally (read-only) into a sidecar database that has
+    covering indexes for the history queries. Rows fail2ban purges after
+    dbpurgeage stay in the sidecar.
+
+    The sync follows timeofban, not rowid: fail2ban deletes rows on unban
+    and SQLite hands the rowid of a deleted last row to the next insert.
+    Each sync re-reads a trailing HISTORY_SYNC_OVERLAP window per jail
+    (late inserts, clock steps); UNIQUE (jail, ip, timeofban) drops the
+    rows already copied.
+    """
+
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS bans (
+            id INTEGER PRIMARY KEY, jail TEXT NOT NULL, ip TEXT NOT NULL,
+            timeofban INTEGER NOT NULL, bantime INTEGER, bancount INTEGER,
+            UNIQUE (jail, ip, timeofban))""",
+        # rowid watermarks of older versions
+        "DROP TABLE IF EXISTS sync",
+        """CREATE TABLE IF NOT EXISTS synced (
+            source TEXT PRIMARY KEY, last_time INTEGER NOT NULL)""",
+    )
+    # created after the first copy, which is faster than maintaining them
+    INDEXES = (
+        "CREATE INDEX IF NOT EXISTS bans_time"
+        " ON bans (timeofban, id, jail, ip, bantime, bancount)",
+        "CREATE INDEX IF NOT EXISTS bans_jail_time"
+        " ON bans (jail, timeofban, id, ip, bantime, bancount)",
+        "CREATE INDEX IF NOT EXISTS bans_ip_time"
+        " ON bans (ip, timeofban, id, jail, bantime, bancount)",
+    )
+
+    def __init__(self, source: str, sidecar: str):
+        self.source = source
+        self.sidecar = sidecar
+        self.synced_at = 0.0
+        self._sync_lock = threading.Lock()
+        self._open_lock = threading.Lock()
+        self._writer = None
+        self._first = None  # thread of the first (full) copy
+        self._first_error = None
+        self._sources = SQLitePool(lambda: _connect_readonly(source), HISTORY_POOL_SIZE)
+        self._readers = SQLitePool(lambda: _connect_readonly(sidecar), HISTORY_POOL_SIZE)
+
+    def _open_writer(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.sidecar)),
+                    mode=0o700, exist_ok=True)
+        conn = sqlite3.connect(self.sidecar, timeout=5, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode = WAL")  # readers don't block the sync
+        conn.execute("PRAGMA synchronous = NORMAL")
+        with conn:
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+        return conn
+
+    def _writer_conn(self):
+        with self._open_lock:
+            if self._writer is None:
+                self._writer = self._open_writer()
+            return self._writer
+
+    @property
+    def syncing(self) -> bool:
+        """True while the first copy runs; queries see only part of the rows."""
+        return not self.synced_at and self._first is not None and self._first.is_alive()
+
+    def start(self):
+        """
+        Create the sidecar and start the first copy on a background thread,
+        which may take long for a big database. Raises HistoryUnavailable if
+        the previous attempt failed (the next call tries again).
+        """
+        with self._open_lock:
+            if self.synced_at or (self._first is not None and self._first.is_alive()):
+                return
+            error, self._first_error = self._first_error, None
+            self._first = threading.Thread(
+                target=self._first_sync, name="history-sync", daemon=True)
+            self._first.start()
+        if error is not None:
+            raise error
+        try:
+            self._writer_conn()
+        except sqlite3.Error as e:
+            raise HistoryUnavailable(f"ban history not available: {e}") from e
+
+    def _first_sync(self):
+        try:
+            self.sync()
+        except HistoryUnavailable as e:
+            self._first_error = e
+
+    def sync(self, wait: bool = True):
+        """Copy new rows from fail2ban's database. Without `wait`, skip if one runs."""
+        if not self._sync_lock.acquire(blocking=wait):
+            return
+        try:
+            writer = self._writer_conn()
+            row = writer.execute("SELECT last_time FROM synced WHERE source = ?",
+                                 (self.source,)).fetchone()
+            newest = row[0] if row else 0
+            since = newest - HISTORY_SYNC_OVERLAP if row else 0
+            with self._sources.connection() as src:
+                for jail in self._jails(src):
+                    # walks fail2ban's (jail, timeofban) index; rowid breaks ties
+                    key = (since, 0)
+                    while True:
+                        rows = src.execute(
+                            "SELECT timeofban, rowid, ip, bantime, bancount FROM bans"
+                            " WHERE jail = ? AND (timeofban, rowid) > (?, ?)"
+                            " ORDER BY timeofban, rowid LIMIT ?",
+                            (jail, *key, HISTORY_SYNC_BATCH)).fetchall()
+                        if not rows:
+                            break
+                        key = rows[-1][:2]
+                        newest = max(newest, key[0])
+                        with writer:
+                            writer.executemany(
+                                "INSERT OR IGNORE INTO bans"
+                                " (jail, ip, timeofban, bantime, bancount)"
+                                " VALUES (?, ?, ?, ?, ?)",
+                                [(jail, ip, t, bantime, bancount)
+                                 for t, _rowid, ip, bantime, bancount in rows if ip])
+            with writer:
+                writer.execute(
+                    "INSERT OR REPLACE INTO synced (source, last_time) VALUES (?, ?)",
+                    (self.source, newest))
+            if not self.synced_at:
+                with writer:
+                    for statement in self.INDEXES:
+                        writer.execute(statement)
+            self.synced_at = _time.monotonic()
+        except sqlite3.Error as e:
+            raise HistoryUnavailable(f"ban history not available: {e}") from e
+        finally:
+            self._sync_lock.release()
+
+    @staticmethod
+    def _jails(src):
+        """Jail names in fail2ban's bans table, one index lookup per jail."""
+        jail = src.execute("SELECT min(jail) FROM bans").fetchone()[0]
+        while jail is not None:
+            yield jail
+            jail = src.execute("SELECT min(jail) FROM bans WHERE jail > ?",
+                               (jail,)).fetchone()[0]
+
+    def query(self, sql: str, params=()) -> list:
+        """
+        Rows of `sql` on the sidecar, synced at most HISTORY_SYNC_SEC ago.
+        During the first copy the rows copied so far are used.
+        """
+        if not self.synced_at:
+            self.start()
+        elif _time.monotonic() - self.synced_at > HISTORY_SYNC_SEC:
+            # someone else syncing: answer from what is there
+            self.sync(wait=False)
+        with self._readers.connection() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def close(self):
+        self._sources.close()
+        self._readers.close()
+        if self._writer is not None:
+            self._writer.close()
+
+
+_HISTORIES = {}  # host name -> BanHistory
+_HISTORIES_LOCK = threading.Lock()
+
+
+def _start_history():
+    """Begin the first copy of the default host's history at startup."""
+    try:
+        ban_history().start()
+    except Exception as e:
+        # fail2ban down or without a database: the first query tries again
+        print(f"ban history: {e}")
+
+
+def ban_history() -> BanHistory:
+    """BanHistory of the current host."""
+    host = current_host()
+    with _HISTORIES_LOCK:
+        history = _HISTORIES.get(host.name)
+    if history is not None:
+        return history
+    source = HISTORY_SOURCE if host is DEFAULT_HOST else ""
+    if not source:
+        source = _value_line(cached_command(["get", "dbfile"]))
+    if not source or source in ("None", ":memory:"):
+        raise HistoryUnavailable("fail2ban does not use a database (dbfile)")
+    if not os.path.isfile(source):
+        raise HistoryUnavailable(f"database {source} not found; mount it or set F2B_DB_FILE")
+    sidecar = HISTORY_DB if host is DEFAULT_HOST else f"{HISTORY_DB}.{host.name}"
+    with _HISTORIES_LOCK:
+        return _HISTORIES.setdefault(host.name, BanHistory(source, sidecar))
+
+
+RELATIVE_TIME_RE = re.compile(r"^(\d+)([smhdw])$")
+TIME_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+
+
+def parse_time(value: str) -> int:
+    """Unix time from epoch seconds, ISO 8601 or an age like 7d / 12h (ago)."""
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    m = RELATIVE_TIME_RE.match(value)
+    if m:
+        return int(_time.time()) - int(m.group(1)) * TIME_UNITS[m.group(2)]
+    try:
+        dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"invalid time {value!r} (epoch, ISO 8601 or e.g. 7d)")
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+def _encode_cursor(*values) -> str:
+    raw = "\x1f".join(str(v) for v in values).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str, count: int) -> list:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        values = raw.split("\x1f")
+    except Exception:
+        values = []
+    if len(values) != count:
+        raise ValueError("invalid cursor")
+    return values
+
+
+def _history_filter(qs: dict) -> tuple:
+    """WHERE clause and parameters for since/until/jail/ip."""
+    where, params = [], []
+    if qs.get("since"):
+        where.append("timeofban >= ?")
+        params.append(parse_time(qs["since"][0]))
+    if qs.get("until"):
+        where.append("timeofban < ?")
+        params.append(parse_time(qs["until"][0]))
+    if qs.get("jail"):
+        where.append("jail = ?")
+        params.append(qs["jail"][0])
+    if qs.get("ip"):
+        where.append("ip = ?")
+        params.append(qs["ip"][0])
+    return where, params
+
+
+def _history_limit(qs: dict, default: int) -> int:
+    limit = int(qs.get("limit", [str(default)])[0])
+    if not 0 < limit <= 10000:
+        raise ValueError("limit must be between 1 and 10000")
+    return limit
+
+
+def history_bans(qs: dict) -> dict:
+    """Bans newest first, filtered by since/until/jail/ip, keyset-paged."""
+    history = ban_history()
+    limit = _history_limit(qs, 100)
+    where, params = _history_filter(qs)
+    if qs.get("cursor"):
+        ts, row_id = (int(v) for v in _decode_cursor(qs["cursor"][0], 2))
+        where.append("(timeofban < ? OR (timeofban = ? AND id < ?))")
+        params += [ts, ts, row_id]
+    rows = history.query(
+        "SELECT id, jail, ip, timeofban, bantime, bancount FROM bans"
+        + (" WHERE " + " AND ".join(where) if where else "")
+        + " ORDER BY timeofban DESC, id DESC LIMIT ?", params + [limit + 1])
+    page = rows[:limit]
+    return {
+        "bans": [{"jail": jail, "ip": ip, "timeofban": ts, "bantime": bantime,
+                  "bancount": bancount} for _, jail, ip, ts, bantime, bancount in page],
+        "next": _encode_cursor(page[-1][3], page[-1][0]) if len(rows) > limit else None,
+    }
+
+
+def history_ips(qs: dict, min_bans: int = 1) -> dict:
+    """
+    IPs by number of bans (most first), with at least `min_bans` (or
+    ?min=) bans in the range. Paged with a (bans, ip) cursor.
+    """
+    history = ban_history()
+    limit = _history_limit(qs, 20)
+    min_bans = int(qs.get("min", [str(min_bans)])[0])
+    where, params = _history_filter(qs)
+    having, having_params = ["bans >= ?"], [min_bans]
+    if qs.get("cursor"):
+        count, ip = _decode_cursor(qs["cursor"][0], 2)
+        having.append("(bans < ? OR (bans = ? AND ip > ?))")
+        having_params += [int(count), int(count), ip]
+    rows = history.query(
+        "SELECT ip, count(*) AS bans, min(timeofban), max(timeofban),"
+        " max(bancount), group_concat(DISTINCT jail) FROM bans"
+        + (" WHERE " + " AND ".join(where) if where else "")
+        + " GROUP BY ip HAVING " + " AND ".join(having)
+        + " ORDER BY bans DESC, ip LIMIT ?", params + having_params + [limit + 1])
+    page = rows[:limit]
+    return {
+        "ips": [{"ip": ip, "bans": bans, "first": first, "last": last,
+                 "maxBancount": bancount, "jails": sorted(jails.split(","))}
+                for ip, bans, first, last, bancount, jails in page],
+        "next": _encode_cursor(page[-1][1], page[-1][0]) if len(rows) > limit else None,
+    }
+
+
+HISTOGRAM_BUCKETS = {"hour": 3600, "day": 86400}
+HISTOGRAM_MAX_BUCKETS = 10000
 
 
-def flatten_response(resp):
-    """Recursively flatten nested lists/tuples to a newline-separated string."""
-    if isinstance(resp, (list, tuple)):
-        parts = [flatten_response(item) for item in resp]
-        return "\n".join(part for part in parts if part)
-    return str(resp)
+def history_histogram(qs: dict) -> dict:
+    """Ban counts per hour or day (UTC), empty buckets included."""
+    history = ban_history()
+    bucket = qs.get("bucket", ["hour"])[0]
+    size = HISTOGRAM_BUCKETS.get(bucket)
+    if size is None:
+        raise ValueError("bucket must be hour or day")
+    where, params = _history_filter(qs)
+    rows = history.query(
+        "SELECT timeofban / ? * ? AS start, count(*) FROM bans"
+        + (" WHERE " + " AND ".join(where) if where else "")
+        + " GROUP BY start ORDER BY start", [size, size] + params)
+    counts = dict(rows)
+    first = parse_time(qs["since"][0]) // size * size if qs.get("since") else None
+    last = (parse_time(qs["until"][0]) - 1) // size * size if qs.get("until") else None
+    if counts:
+        first = min(counts) if first is None else first
+        last = max(counts) if last is None else last
+    if first is None or last is None or last < first:
+        return {"bucket": bucket, "counts": []}
+    if (last - first) // size >= HISTOGRAM_MAX_BUCKETS:
+        raise ValueError(f"more than {HISTOGRAM_MAX_BUCKETS} buckets; narrow since/until")
+    return {"bucket": bucket,
+            "counts": [[t, counts.get(t, 0)] for t in range(first, last + 1, size)]}
 
-# -------- parsers -------------------------------------------------------------
 
+HISTORY_ROUTES = {
+    "bans": history_bans,
+    "top": history_ips,
+    "repeat": lambda qs: history_ips(qs, min_bans=2),
+    "histogram": history_histogram,
+}
 
-def parse_global_status(output_or_resp):
-    # structured preferred
-    if not isinstance(output_or_resp, str):
-        d = _normalize_structured_response(output_or_resp)
-        if d:
-            jails = int(d.get("Number of jail", 0) or 0)
-            jail_list_raw = d.get("Jail list", "")
-            if isinstance(jail_list_raw, str):
-                lst = [s.strip() for s in jail_list_raw.replace(
-                    ',', ' ').split() if s.strip()]
-            elif isinstance(jail_list_raw, (list, tuple)):
-                lst = [str(x).strip() for x in jail_list_raw if str(x).strip()]
-            else:
-                lst = []
-            return {"jails": jails, "list": lst}
+# -------- reads -------------------------------------------------------------
 
-    # fallback text
-    output = str(output_or_resp)
-    lines = output.splitlines()
-    jails = 0
-    jail_list = []
-    for line in lines:
-        m = re.search(r"Number of jail:\s*(\d+)", line)
-        if m:
-            jails = int(m.group(1))
-        m = re.search(r"Jail list:\s*(.+)", line)
-        if m:
-            jail_list = re.split(r",?\s+", m.group(1).strip())
-    jail_list = [j for j in jail_list if j]
-    return {"jails": jails, "list": jail_list}
+def live_read(parts: list, query: str, banned_query: dict | None = None,
+              fields: set | None = None):
+    """
+    Result of the read-only API route `parts` (/api/<parts>) for the
+    current host, answered through the command cache; None if `parts` is
+    not such a route. /api/hosts/<route> runs this once per host.
+    """
+    if parts == ["status"]:
+        return parse_global_status(cached_command(["status"]))
 
+    if parts == ["jails"]:
+        return parse_global_status(cached_command(["status"]))["list"]
 
-def parse_jail_status(output_or_resp):
-    # structured
-    if not isinstance(output_or_resp, str):
-        d = _normalize_structured_response(output_or_resp)
-        if d:
-            filt = d.get("Filter", {})
-            act = d.get("Actions", {})
+    if parts == ["banned"]:
+        # maps to: fail2ban-client banned
+        if banned_query is not None:
+            return banned_page(banned_index(banned_query["jail"]), banned_query)
+        ips = _collect_ips(cached_command(["banned"]))
+        return {"ips": ips, "count": len(ips)}
 
-            def g(obj, *keys, default=0):
-                for k in keys:
-                    if k in obj:
-                        return obj[k]
-                return default
+    if parts == ["jails", "status"]:
+        known = parse_global_status(cached_command(["status"]))["list"]
+        wanted = _jail_filter(query)
+        jails = [j for j in (known if wanted is None else wanted) if j in known]
 
-            currently_failed = int(
-                g(filt, "Currently failed", "currently failed", default=0) or 0)
-            total_failed = int(
-                g(filt, "Total failed", "total failed", default=0) or 0)
-            file_list_raw = g(filt, "File list", "file list", default=[])
-            file_list = _process_file_list(file_list_raw)
+        def fetch(jail):
+            return shape_jail_status(
+                get_jail_status(jail, fields=fields), None,
+                banned_query, lambda: banned_index(jail))
 
-            currently_banned = int(
-                g(act, "Currently banned", "currently banned", default=0) or 0)
-            total_banned = int(
-                g(act, "Total banned", "total banned", default=0) or 0)
-            banned_raw = g(act, "Banned IP list", "banned IP list", default=[])
+        fetched = get_jails_status(jails, fetch=fetch)
+        return {j: fetched.get(j, {"error": "Unknown jail"})
+                for j in (known if wanted is None else wanted)}
 
-            if isinstance(banned_raw, str):
-                banned_list = [s.strip()
-                               for s in banned_raw.split() if s.strip()]
-            elif isinstance(banned_raw, (list, tuple)):
-                banned_list = [str(x).strip()
-                               for x in banned_raw if str(x).strip()]
-            else:
-                banned_list = []
+    if len(parts) == 3 and parts[0] == "jail" and parts[2] == "status":
+        jail = parts[1]
+        return shape_jail_status(get_jail_status(jail, fields=fields), None,
+                                 banned_query, lambda: banned_index(jail))
+    return None
 
-            return {
-                "filter": {
-                    "currentlyFailed": currently_failed,
-                    "totalFailed": total_failed,
-                    "fileList": file_list,
-                },
-                "actions": {
-                    "currentlyBanned": currently_banned,
-                    "totalBanned": total_banned,
-                    "bannedIPList": banned_list,
-                },
-            }
 
-    # fallback text
-    output = str(output_or_resp)
-    lines = output.splitlines()
-    currently_failed = 0
-    total_failed = 0
-    file_list = []
-    currently_banned = 0
-    total_banned = 0
-    banned_ip_list = []
+def _host_param(query: str) -> list | None:
+    """Host names of a `hosts=a,b` query parameter, None if absent."""
+    value = parse_qs(query).get("hosts", [""])[0]
+    if not value.strip():
+        return None
+    return list(dict.fromkeys(h.strip() for h in value.split(",") if h.strip()))
 
-    for line in lines:
-        m = re.search(r"Currently failed:\s*(\d+)", line)
-        if m:
-            currently_failed = int(m.group(1))
-            continue
-        m = re.search(r"Total failed:\s*(\d+)", line)
-        if m:
-            total_failed = int(m.group(1))
-            continue
-        m = re.search(r"File list:\s*(.+)", line)
-        if m:
-            raw_files = re.split(r",?\s+", m.group(1).strip())
-            file_list = _process_file_list(raw_files)
-            continue
-        m = re.search(r"Currently banned:\s*(\d+)", line)
-        if m:
-            currently_banned = int(m.group(1))
-            continue
-        m = re.search(r"Total banned:\s*(\d+)", line)
-        if m:
-            total_banned = int(m.group(1))
-            continue
-        m = re.search(r"Banned IP list:\s*(.+)", line)
-        if m:
-            banned_ip_list = re.split(r"\s+", m.group(1).strip())
-            continue
 
-    banned_ip_list = [ip for ip in banned_ip_list if ip]
-    return {
-        "filter": {
-            "currentlyFailed": currently_failed,
-            "totalFailed": total_failed,
-            "fileList": file_list,
-        },
-        "actions": {
-            "currentlyBanned": currently_banned,
-            "totalBanned": total_banned,
-            "bannedIPList": banned_ip_list,
-        },
-    }
+def _use_request_host(self, query: str) -> bool:
+    """
+    Apply `?host=<name>` to the rest of the request. Sends 404 and returns
+    False for an unknown host.
+    """
+    name = parse_qs(query).get("host", [""])[0].strip()
+    if not name:
+        return True
+    host = HOSTS.get(name)
+    if host is None:
+        _json(self, 404, {"error": f"Unknown host {name!r}",
+                          "hosts": list(HOSTS)})
+        return False
+    select_host(host)
+    return True
 
 
-def _process_file_list(file_list_raw):
-    """Converts file_list_raw to a list of {path, exists} objects."""
-    if isinstance(file_list_raw, str):
-        paths = [s.strip()
-                 for s in re.split(r",\s*|\s+", file_list_raw) if s.strip()]
-    elif isinstance(file_list_raw, (list, tuple)):
-        paths = [str(x).strip() for x in file_list_raw if str(x).strip()]
-    else:
-        paths = []
-    return [{"path": p, "exists": os.path.exists(p)} for p in paths]
+def hosts_info() -> list:
+    return [{"name": h.name, "socket": h.path, "default": h is DEFAULT_HOST,
+             "breaker": h.pool.breaker.state} for h in HOSTS.values()]
 
+# -------- bulk ban/unban ------------------------------------------------------
 
-def _pairs_to_dict(obj):
-    """Recursively converts [("Key", Value), ...] structures into dicts."""
-    if isinstance(obj, (list, tuple)):
-        if all(isinstance(x, (list, tuple)) and len(x) == 2 for x in obj):
-            d = {}
-            for k, v in obj:
-                d[str(k)] = _pairs_to_dict(v)
-            return d
-    return obj
+
+def _bulk_items(body: str, data) -> list:
+    """
+    Items of a bulk request: a JSON array, {"ips": [...]} or plain text with
+    one address per line (blank lines and # comments are skipped).
+    """
+    if isinstance(data, dict):
+        data = data.get("ips")
+    if isinstance(data, list):
+        return [str(x).strip() for x in data]
+    items = []
+    for line in body.splitlines():
+        line = line.split("#", 1)[0].strip()
+        if line:
+            items.append(line)
+    return items
 
 
-def _normalize_structured_response(resp):
+def _bulk_target(item: str) -> str:
+    """Normalized address or CIDR block; ValueError if it is neither."""
+    if "/" not in item:
+        if not _is_valid_ip(item):
+            raise ValueError("not a valid IPv4 or IPv6 address")
+        return item
+    network = ipaddress.ip_network(item, strict=False)
+    if network.prefixlen == network.max_prefixlen:
+        return str(network.network_address)
+    return str(network)
+
+
+def _bulk_ban(self, jail: str, action: str, body: str, data):
     """
-    Fail2ban often returns [0, [(k,v), ...]].
-    Returns a dict or None if unrecognizable.
+    POST /api/jail/<jail>/ban/bulk and /unban/bulk. Items are validated in
+    one pass, then sent as multi-address `banip`/`unbanip` commands of
+    BULK_CHUNK_SIZE addresses, BULK_WINDOW commands pipelined per round
+    trip. One NDJSON line per item is streamed back as each window
+    completes, followed by a summary line.
     """
-    root = resp
-    if isinstance(root, (list, tuple)) and len(root) == 2 and isinstance(root[1], (list, tuple)):
-        root = root[1]
-    if isinstance(root, (list, tuple)) and all(isinstance(x, (list, tuple)) and len(x) == 2 for x in root):
-        return _pairs_to_dict(root)
-    return None
+    items = _bulk_items(body, data)
+    if not items:
+        _json(self, 400, {"error": "Body must contain IP addresses or CIDR blocks "
+                                   "(JSON array or one per line)"})
+        return
+    if len(items) > BULK_MAX_ITEMS:
+        _json(self, 413, {"error": f"At most {BULK_MAX_ITEMS} items per request"})
+        return
+
+    op = "banip" if action == "ban" else "unbanip"
+    targets, seen, invalid = [], set(), []
+    for item in items:
+        try:
+            target = _bulk_target(item)
+        except ValueError as e:
+            invalid.append({"item": item, "ok": False, "error": str(e)})
+            continue
+        if target not in seen:
+            seen.add(target)
+            targets.append(target)
+
+    self.send_response(200)
+    self.send_header("Content-Type", "application/x-ndjson")
+    self.send_header("Cache-Control", "no-store")
+    self.send_header("X-Accel-Buffering", "no")
+    self.end_headers()
+
+    def emit(lines):
+        self.wfile.write(b"".join(_dumps(line) + b"\n" for line in lines))
+        self.wfile.flush()
+
+    done, failed = [], 0
+    chunks = [targets[i:i + BULK_CHUNK_SIZE]
+              for i in range(0, len(targets), BULK_CHUNK_SIZE)]
+    try:
+        emit(invalid)
+        for w in range(0, len(chunks), BULK_WINDOW):
+            window = chunks[w:w + BULK_WINDOW]
+            raws = send_commands([["set", jail, op, *chunk] for chunk in window])
+            retry = []
+            for chunk, raw in zip(window, raws):
+                if reply_error(raw) is None:
+                    done.extend(chunk)
+                    emit({"item": t, "ok": True} for t in chunk)
+                else:
+                    retry.extend(chunk)
+            if retry:
+                # find out which addresses made the batch fail
+                singles = send_commands([["set", jail, op, t] for t in retry])
+                lines = []
+                for t, raw in zip(retry, singles):
+                    error = reply_error(raw)
+                    if error is None:
+                        done.append(t)
+                        lines.append({"item": t, "ok": True})
+                    else:
+                        failed += 1
+                        lines.append({"item": t, "ok": False, "error": error})
+                emit(lines)
+        emit([{"done": True, "action": action, "jail": jail, "ok": len(done),
+               "failed": failed, "invalid": len(invalid),
+               "duplicates": len(items) - len(invalid) - len(targets)}])
+    except (BrokenPipeError, ConnectionResetError, TimeoutError):
+        pass
+    except Exception as e:
+        try:
+            emit([{"done": False, "error": str(e), "ok": len(done)}])
+        except OSError:
+            pass
+    finally:
+        if done:
+            _written(["set", jail, op, *done])
+
 
 # -------- HTTP handler --------------------------------------------------------
 
@@ -367,15 +3922,54 @@ def _normalize_structured_response(resp):
 class Handler(BaseHTTPRequestHandler):
     """HTTP request handler for the Fail2ban web interface."""
 
+    # ------------------------------ metrics ----------------------------------
+    def handle_one_request(self):
+        self._status = None
+        take_timings()
+        select_host(None)
+        HTTP_IN_FLIGHT.inc()
+        started = _time.perf_counter()
+        try:
+            session = _PROFILE
+            if session is not None:
+                session.handle(super().handle_one_request)
+            else:
+                super().handle_one_request()
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            if self._status is not None:
+                method = self.command or "-"
+                route = _route_template(method, urlparse(getattr(self, "path", "")).path,
+                                        self._status)
+                HTTP_REQUESTS.inc((method, route, str(self._status)))
+                HTTP_SECONDS.observe((method, route),
+                                     _time.perf_counter() - started)
+
+    def send_response(self, code, message=None):
+        self._status = code
+        super().send_response(code, message)
+
     # ------------------------------ GET --------------------------------------
     def do_GET(self):
+        take_stale()
         parsed = urlparse(self.path)
         path = parsed.path
+        if path.startswith("/api/") and not _use_request_host(self, parsed.query):
+            return
 
         # API endpoints
         if path.startswith("/api/"):
             parts = path[len("/api/"):].strip("/").split("/")
             try:
+                if parts == ["admin", "profile"]:
+                    if not ADMIN_TOKEN:
+                        _json(self, 404, {"error": "Not found (set F2B_ADMIN_TOKEN)"})
+                    elif not _admin_authorized(self):
+                        _json(self, 401, {"error": "invalid admin token"},
+                              headers={"WWW-Authenticate": "Bearer"})
+                    else:
+                        _admin_profile(self, parse_qs(parsed.query))
+                    return
                 if len(parts) == 1 and parts[0] == "overview":
                     qs = parse_qs(parsed.query)
 
@@ -394,65 +3988,136 @@ class Handler(BaseHTTPRequestHandler):
                     else:
                         fields = None  # take defaults in _build_overview
 
-                    # optional micro-cache to smooth bursts
+                    # optional: max. age of cached values in ms
                     try:
-                        ttl_ms = int(qs.get("ttl", ["0"])[0])
+                        ttl_ms = int(qs.get("ttl", [""])[0])
+                        max_age = max(0, ttl_ms) / 1000
                     except Exception:
-                        ttl_ms = 0
+                        max_age = None  # per-command TTLs
 
-                    now = _time.time() * 1000
-                    if ttl_ms > 0 and _OVERVIEW_CACHE["data"] is not None:
-                        is_fresh = (
-                            now - _OVERVIEW_CACHE["ts"]) < min(ttl_ms, _OVERVIEW_CACHE["ttl"] or ttl_ms)
+                    _json(self, 200, _build_overview(fields, max_age))
+                    return
+                if parts == ["hosts"]:
+                    _json(self, 200, hosts_info())
+                    return
+                if len(parts) == 3 and parts[0] == "jail" and parts[2] == "series":
+                    if not _SERIES.enabled:
+                        _json(self, 404, {"error": "series are disabled (F2B_SERIES_INTERVAL=0)"})
+                        return
+                    try:
+                        result = jail_series(parts[1], parse_qs(parsed.query))
+                    except ValueError as e:
+                        _json(self, 400, {"error": str(e)})
+                        return
+                    if result is None:
+                        _json(self, 404, {"error": "No series for this jail (yet)"})
                     else:
-                        is_fresh = False
-
-                    if is_fresh:
-                        _json(self, 200, _OVERVIEW_CACHE["data"])
+                        _json(self, 200, result)
+                    return
+                if len(parts) == 2 and parts[0] == "history" and parts[1] in HISTORY_ROUTES:
+                    try:
+                        result = HISTORY_ROUTES[parts[1]](parse_qs(parsed.query))
+                    except HistoryUnavailable as e:
+                        _json(self, 503, {"error": str(e)})
                         return
+                    except ValueError as e:
+                        _json(self, 400, {"error": str(e)})
+                        return
+                    _json(self, 200, result, headers={"X-History-Syncing": "1"}
+                          if ban_history().syncing else None)
+                    return
+                # /api/hosts/<route>: <route> on every host
+                route = parts[1:] if parts[0] == "hosts" else parts
 
-                    data = _build_overview(fields)
-                    # store for subsequent callers within ttl window
-                    if ttl_ms > 0:
-                        _OVERVIEW_CACHE.update(
-                            {"data": data, "ts": now, "ttl": ttl_ms})
+                # paging/filters for /api/banned and /api/jail(s)/.../status
+                banned_query = None
+                if route[0] in ("banned", "jail", "jails") and parsed.query:
+                    try:
+                        banned_query = _banned_query(parse_qs(parsed.query))
+                        if banned_query and banned_query["net"]:
+                            ipaddress.ip_network(
+                                banned_query["net"].strip(), strict=False)
+                    except ValueError as e:
+                        _json(self, 400, {"error": str(e)})
+                        return
 
-                    _json(self, 200, data)
-                    return
-                if len(parts) == 1 and parts[0] == "status":
-                    raw = send_command(["status"])
-                    result = parse_global_status(raw)
-                    _json(self, 200, result)
-                    return
+                # field projection for /api/jail(s)/.../status
+                fields = None
+                if route[0] in ("jail", "jails") and parsed.query:
+                    fields = _fields_param(parsed.query)
 
-                if len(parts) == 1 and parts[0] == "jails":
-                    raw = send_command(["status"])
-                    result = parse_global_status(raw)
-                    _json(self, 200, result["list"])
+                if parts[0] == "hosts":
+                    results = for_each_host(
+                        lambda: live_read(route, parsed.query, banned_query, fields),
+                        _host_param(parsed.query))
+                    if any(r is None for r in results.values()):
+                        _json(self, 404, {"error": "Not found"})
+                    else:
+                        _json(self, 200, results)
                     return
 
-                if len(parts) == 1 and parts[0] == "banned":
-                    # maps to: fail2ban-client banned
-                    raw = send_command(["banned"])
-                    ips = _collect_ips(raw)
-                    _json(self, 200, {"ips": ips, "count": len(ips)})
-                    return
+                snap = _COLLECTOR.current() if current_host() is DEFAULT_HOST else None
+                if snap is not None:
+                    def reply(name, obj):
+                        _json(self, 200, headers=_COLLECTOR.age_headers(snap),
+                              encoded=_COLLECTOR.encoded(snap, name, obj))
 
-                if len(parts) == 3 and parts[0] == "jail" and parts[2] == "status":
-                    jail = parts[1]
-                    raw = send_command(["status", jail])
-                    result = parse_jail_status(raw)
+                    if len(parts) == 1 and parts[0] == "status":
+                        reply("status", snap["status"])
+                        return
+                    if len(parts) == 1 and parts[0] == "jails":
+                        reply("jails", snap["status"]["list"])
+                        return
+                    if len(parts) == 1 and parts[0] == "banned":
+                        if banned_query is None:
+                            reply("banned", snap["banned"])
+                            return
+                        jail = banned_query["jail"]
+                        if jail is None or jail in snap["jails"]:
+                            _json(self, 200, banned_page(
+                                _COLLECTOR.banned_index(snap, jail), banned_query),
+                                headers=_COLLECTOR.age_headers(snap))
+                            return
+                    if len(parts) == 2 and parts[0] == "jails" and parts[1] == "status":
+                        wanted = _jail_filter(parsed.query)
+                        if wanted is None and banned_query is None and fields is None:
+                            reply("jails:status", snap["jails"])
+                            return
+                        out = {}
+                        for jail in (snap["status"]["list"] if wanted is None else wanted):
+                            if jail in snap["jails"]:
+                                out[jail] = shape_jail_status(
+                                    snap["jails"][jail], fields, banned_query,
+                                    lambda: _COLLECTOR.banned_index(snap, jail))
+                            else:
+                                out[jail] = {"error": "Unknown jail"
+                                             if jail not in snap["status"]["list"]
+                                             else "Status not available"}
+                        _json(self, 200, out, headers=_COLLECTOR.age_headers(snap))
+                        return
+                    if (len(parts) == 3 and parts[0] == "jail" and parts[2] == "status"
+                            and parts[1] in snap["jails"]):
+                        if banned_query is None and fields is None:
+                            reply("jail:" + parts[1], snap["jails"][parts[1]])
+                        else:
+                            _json(self, 200, shape_jail_status(
+                                snap["jails"][parts[1]], fields, banned_query,
+                                lambda: _COLLECTOR.banned_index(snap, parts[1])),
+                                headers=_COLLECTOR.age_headers(snap))
+                        return
 
-                    try:
-                        extras = get_jail_extrainfo(jail)
-                        result["extra"] = extras
-                    except Exception as e:
-                        result.setdefault("_errors", {})["extrainfo"] = str(e)
+                result = live_read(parts, parsed.query, banned_query, fields)
+                if result is not None:
                     _json(self, 200, result)
                     return
 
+                if len(parts) == 2 and parts[0] == "file" and parts[1] == "stream":
+                    _stream_file(self, parse_qs(
+                        parsed.query, keep_blank_values=True))
+                    return
+
                 if len(parts) == 1 and parts[0] == "file":
-                    qs = parse_qs(parsed.query)
+                    qs = parse_qs(parsed.query, keep_blank_values=True)
                     file_path = qs.get("path", [""])[0]
                     try:
                         lines_param = int(qs.get("lines", ["0"])[0])
@@ -465,15 +4130,22 @@ class Handler(BaseHTTPRequestHandler):
                               "error": "File not found", "path": file_path})
                         return
 
+                    cursor = qs.get("cursor", [None])[0]
+                    if cursor is not None:
+                        try:
+                            follow = _follow_file(abs_path, lines_param, cursor)
+                        except Exception as e:
+                            _json(self, 500, {"error": str(e)})
+                            return
+                        _json(self, 200, {
+                            "path": file_path, "exists": True, **follow})
+                        return
+
                     try:
-                        with open(abs_path, "r", encoding="utf-8", errors="replace") as f:
-                            if lines_param == 0:
-                                content_lines = f.readlines()
-                            elif lines_param > 0:
-                                content_lines = [next(f) for _ in range(
-                                    lines_param) if not f.closed]
-                            else:
-                                content_lines = f.readlines()[lines_param:]
+                        if lines_param < 0:
+                            content_lines = _tail_lines(abs_path, -lines_param)
+                        else:
+                            content_lines = _head_lines(abs_path, lines_param)
                     except Exception as e:
                         _json(self, 500, {"error": str(e)})
                         return
@@ -487,40 +4159,48 @@ class Handler(BaseHTTPRequestHandler):
 
                 # --- NEW: /api/version ---
                 if len(parts) == 1 and parts[0] == "version":
-                    raw = send_command(["version"])
+                    raw = cached_command(["version"])
                     _json(self, 200, {
                           "version": flatten_response(raw).strip()})
                     return
 
                 # --- NEW: logging get ---
                 if len(parts) == 1 and parts[0] == "loglevel":
-                    raw = send_command(["get", "loglevel"])
+                    raw = cached_command(["get", "loglevel"])
                     _json(self, 200, {
                           "loglevel": flatten_response(raw).strip()})
                     return
 
                 # --- NEW: database gets ---
                 if len(parts) == 2 and parts[0] == "db" and parts[1] == "file":
-                    raw = send_command(["get", "dbfile"])
+                    raw = cached_command(["get", "dbfile"])
                     _json(self, 200, {"dbfile": flatten_response(raw).strip()})
                     return
 
                 if len(parts) == 2 and parts[0] == "db" and parts[1] == "maxmatches":
-                    raw = send_command(["get", "dbmaxmatches"])
+                    raw = cached_command(["get", "dbmaxmatches"])
                     _json(self, 200, {
                           "dbmaxmatches": flatten_response(raw).strip()})
                     return
 
                 if len(parts) == 2 and parts[0] == "db" and parts[1] == "purgeage":
-                    raw = send_command(["get", "dbpurgeage"])
+                    raw = cached_command(["get", "dbpurgeage"])
                     _json(self, 200, {
                           "dbpurgeage": flatten_response(raw).strip()})
                     return
 
+            except (TimeoutError, CircuitOpenError, PoolBusyError) as e:
+                _unavailable(self, e)
+                return
             except Exception as e:
                 _json(self, 500, {"error": str(e)})
                 return
 
+        if path == "/metrics":
+            _send_bytes(self, 200, render_metrics(),
+                        "text/plain; version=0.0.4; charset=utf-8")
+            return
+
         # Static files
         if path == "/" or path == "":
             rel = "index.html"
@@ -534,33 +4214,12 @@ class Handler(BaseHTTPRequestHandler):
             _json(self, 404, {"error": "Not found (path)"})
             return
 
-        if os.path.exists(file_path) and os.path.isfile(file_path):
-            ext = os.path.splitext(file_path)[1].lower()
-            content_types = {
-                ".html": "text/html",
-                ".css": "text/css",
-                ".js": "application/javascript",
-                ".mjs": "application/javascript",
-                ".json": "application/json",
-                ".png": "image/png",
-                ".jpg": "image/jpeg",
-                ".jpeg": "image/jpeg",
-                ".gif": "image/gif",
-                ".svg": "image/svg+xml",
-                ".ico": "image/x-icon",
-                ".map": "application/json",
-                ".woff": "font/woff",
-                ".woff2": "font/woff2",
-                ".ttf": "font/ttf",
-            }
-            ctype = content_types.get(ext, "application/octet-stream")
+        entry = _STATIC.get(file_path)
+        if entry is not None:
+            _send_static(self, entry)
+        elif os.path.exists(file_path) and os.path.isfile(file_path):
             try:
-                with open(file_path, "rb") as f:
-                    data = f.read()
-                self.send_response(200)
-                self.send_header("Content-Type", ctype)
-                self.end_headers()
-                self.wfile.write(data)
+                _send_static_file(self, file_path)
             except Exception as e:
                 _json(self, 500, {"error": str(e)}, ctype="application/json")
         else:
@@ -575,6 +4234,8 @@ class Handler(BaseHTTPRequestHandler):
             self.end_headers()
             self.wfile.write(b"Not found")
             return
+        if not _use_request_host(self, parsed.query):
+            return
 
         parts = path[len("/api/"):].strip("/").split("/")
         try:
@@ -590,29 +4251,60 @@ class Handler(BaseHTTPRequestHandler):
             data = {}
 
         try:
+            # POST /api/jail/<jail>/ban/bulk, /unban/bulk
+            if (len(parts) == 4 and parts[0] == "jail" and parts[2] in ("ban", "unban")
+                    and parts[3] == "bulk"):
+                _bulk_ban(self, parts[1], parts[2], body, data)
+                return
+
+            # POST /api/hosts/jail/<jail>/ban, /unban and /api/hosts/unban:
+            # the same command on every host
+            if parts[0] == "hosts" and (
+                    parts[1:] == ["unban"] or (len(parts) == 4 and parts[1] == "jail"
+                                               and parts[3] in ("ban", "unban"))):
+                ip = data.get("ip", "")
+                if not _is_valid_ip(ip):
+                    _json(self, 400, {
+                          "error": "A valid IPv4 or IPv6 address must be provided in the body as \"ip\""})
+                    return
+                if parts[1] == "unban":
+                    cmd = ["unban", ip]
+                else:
+                    cmd = ["set", parts[2], "banip" if parts[3] == "ban" else "unbanip", ip]
+
+                def broadcast():
+                    raw = write_command(cmd)
+                    error = reply_error(raw)
+                    if error is not None:
+                        return {"error": error}
+                    return {"result": flatten_response(raw).strip()}
+
+                _json(self, 200, for_each_host(broadcast, _host_param(parsed.query)))
+                return
+
             # ------- existing jail ban/unban -------
             if len(parts) == 3 and parts[0] == "jail" and parts[2] in ("ban", "unban"):
                 jail = parts[1]
                 action = parts[2]
                 ip = data.get("ip", "")
-                if not _is_valid_ipv4(ip):
+                if not _is_valid_ip(ip):
                     _json(self, 400, {
-                          "error": "A valid IPv4 address must be provided in the body as \"ip\""})
+                          "error": "A valid IPv4 or IPv6 address must be provided in the body as \"ip\""})
                     return
                 cmd = ["set", jail, "banip" if action ==
                        "ban" else "unbanip", ip]
-                raw = send_command(cmd)
+                raw = write_command(cmd)
                 _json(self, 200, {"result": flatten_response(raw).strip()})
                 return
 
             # ------- NEW: BASIC server control -------
             if len(parts) == 2 and parts[0] == "server" and parts[1] == "start":
-                raw = send_command(["start"])
+                raw = write_command(["start"])
                 _json(self, 200, {"result": flatten_response(raw).strip()})
                 return
 
             if len(parts) == 2 and parts[0] == "server" and parts[1] == "restart":
-                raw = send_command(["restart"])
+                raw = write_command(["restart"])
                 _json(self, 200, {"result": flatten_response(raw).strip()})
                 return
 
@@ -626,13 +4318,13 @@ class Handler(BaseHTTPRequestHandler):
                 if _bool(data.get("all",     False)):
                     flags.append("--all")
                 cmd = ["reload"] + flags
-                raw = send_command(cmd)
+                raw = write_command(cmd)
                 _json(self, 200, {"result": flatten_response(
                     raw).strip(), "command": cmd})
                 return
 
             if len(parts) == 2 and parts[0] == "server" and parts[1] == "stop":
-                raw = send_command(["stop"])
+                raw = write_command(["stop"])
                 _json(self, 200, {"result": flatten_response(raw).strip()})
                 return
 
@@ -651,7 +4343,7 @@ class Handler(BaseHTTPRequestHandler):
                 if _bool(data.get("ifExists", False)):
                     flags.append("--if-exists")
                 cmd = ["restart"] + flags + [jail]
-                raw = send_command(cmd)
+                raw = write_command(cmd)
                 _json(self, 200, {"result": flatten_response(
                     raw).strip(), "command": cmd})
                 return
@@ -667,7 +4359,7 @@ class Handler(BaseHTTPRequestHandler):
                 if _bool(data.get("ifExists", False)):
                     flags.append("--if-exists")
                 cmd = ["reload"] + flags + [jail]
-                raw = send_command(cmd)
+                raw = write_command(cmd)
                 _json(self, 200, {"result": flatten_response(
                     raw).strip(), "command": cmd})
                 return
@@ -675,15 +4367,15 @@ class Handler(BaseHTTPRequestHandler):
             # ------- NEW: global unban -------
             # POST /api/unban/all  ->  unban --all
             if len(parts) == 2 and parts[0] == "unban" and parts[1] == "all":
-                raw = send_command(["unban", "--all"])
+                raw = write_command(["unban", "--all"])
                 _json(self, 200, {"result": flatten_response(
                     raw).strip(), "command": ["unban", "--all"]})
                 return
 
             # POST /api/unban/<ip>  ->  unban <ip>
-            if len(parts) == 2 and parts[0] == "unban" and _is_valid_ipv4(parts[1]):
+            if len(parts) == 2 and parts[0] == "unban" and _is_valid_ip(parts[1]):
                 ip = parts[1]
-                raw = send_command(["unban", ip])
+                raw = write_command(["unban", ip])
                 _json(self, 200, {"result": flatten_response(
                     raw).strip(), "command": ["unban", ip]})
                 return
@@ -691,11 +4383,11 @@ class Handler(BaseHTTPRequestHandler):
             # POST /api/unban  with body { "ip": "1.2.3.4" }  ->  unban <ip>
             if len(parts) == 1 and parts[0] == "unban":
                 ip = data.get("ip", "")
-                if not _is_valid_ipv4(ip):
+                if not _is_valid_ip(ip):
                     _json(self, 400, {
-                          "error": "Body must contain a single valid IPv4 as \"ip\""})
+                          "error": "Body must contain a single valid IPv4 or IPv6 address as \"ip\""})
                     return
-                raw = send_command(["unban", ip])
+                raw = write_command(["unban", ip])
                 _json(self, 200, {"result": flatten_response(
                     raw).strip(), "command": ["unban", ip]})
                 return
@@ -713,7 +4405,7 @@ class Handler(BaseHTTPRequestHandler):
                     lvl_str = str(level).strip().upper()
                 # Accepted by fail2ban: CRITICAL, ERROR, WARNING, NOTICE, INFO, DEBUG, TRACEDEBUG, HEAVYDEBUG or 50-5
                 cmd = ["set", "loglevel", lvl_str]
-                raw = send_command(cmd)
+                raw = write_command(cmd)
                 _json(self, 200, {"result": flatten_response(
                     raw).strip(), "command": cmd})
                 return
@@ -731,7 +4423,7 @@ class Handler(BaseHTTPRequestHandler):
                 except Exception:
                     _json(self, 400, {"error": "\"value\" must be an integer"})
                     return
-                raw = send_command(["set", "dbmaxmatches", str(ival)])
+                raw = write_command(["set", "dbmaxmatches", str(ival)])
                 _json(self, 200, {"result": flatten_response(raw).strip()})
                 return
 
@@ -748,7 +4440,7 @@ class Handler(BaseHTTPRequestHandler):
                     _json(self, 400, {
                           "error": "\"seconds\" must be an integer"})
                     return
-                raw = send_command(["set", "dbpurgeage", str(ival)])
+                raw = write_command(["set", "dbpurgeage", str(ival)])
                 _json(self, 200, {"result": flatten_response(raw).strip()})
                 return
             if len(parts) == 3 and parts[0] == "jail" and parts[2] == "bantime":
@@ -764,7 +4456,7 @@ class Handler(BaseHTTPRequestHandler):
                     _json(self, 400, {
                           "error": "\"value\" must be an integer"})
                     return
-                raw = send_command(["set", jailname,  "bantime", str(ival)])
+                raw = write_command(["set", jailname,  "bantime", str(ival)])
                 _json(self, 200, {"result": flatten_response(raw).strip()})
                 return
             if len(parts) == 3 and parts[0] == "jail" and parts[2] == "findtime":
@@ -780,7 +4472,7 @@ class Handler(BaseHTTPRequestHandler):
                     _json(self, 400, {
                           "error": "\"value\" must be an integer"})
                     return
-                raw = send_command(["set", jailname,  "findtime", str(ival)])
+                raw = write_command(["set", jailname,  "findtime", str(ival)])
                 _json(self, 200, {"result": flatten_response(raw).strip()})
                 return
             if len(parts) == 3 and parts[0] == "jail" and parts[2] == "maxretry":
@@ -796,7 +4488,7 @@ class Handler(BaseHTTPRequestHandler):
                     _json(self, 400, {
                           "error": "\"value\" must be an integer"})
                     return
-                raw = send_command(["set", jailname,  "maxretry", str(ival)])
+                raw = write_command(["set", jailname,  "maxretry", str(ival)])
                 _json(self, 200, {"result": flatten_response(raw).strip()})
                 return
             if len(parts) == 3 and parts[0] == "jail" and parts[2] == "maxmatches":
@@ -812,7 +4504,7 @@ class Handler(BaseHTTPRequestHandler):
                     _json(self, 400, {
                           "error": "\"value\" must be an integer"})
                     return
-                raw = send_command(["set", jailname,  "maxmatches", str(ival)])
+                raw = write_command(["set", jailname,  "maxmatches", str(ival)])
                 _json(self, 200, {"result": flatten_response(raw).strip()})
                 return
             if len(parts) == 3 and parts[0] == "jail" and parts[2] == "maxlines":
@@ -828,9 +4520,12 @@ class Handler(BaseHTTPRequestHandler):
                     _json(self, 400, {
                           "error": "\"value\" must be an integer"})
                     return
-                raw = send_command(["set", jailname,  "maxlines", str(ival)])
+                raw = write_command(["set", jailname,  "maxlines", str(ival)])
                 _json(self, 200, {"result": flatten_response(raw).strip()})
                 return
+        except (TimeoutError, CircuitOpenError, PoolBusyError) as e:
+            _unavailable(self, e)
+            return
         except Exception as e:
             _json(self, 500, {"error": str(e)})
             return
@@ -840,12 +4535,136 @@ class Handler(BaseHTTPRequestHandler):
 # -------- boot ---------------------------------------------------------------
 
 
+class PooledHTTPServer(HTTPServer):
+    """
+    HTTPServer that hands every accepted connection to a bounded worker pool.
+    At most `workers` requests run at once and up to `queue_size` more wait
+    for a free worker; beyond that new connections get an immediate 503.
+    """
+
+    _BUSY_BODY = json.dumps({"error": "Server busy"}).encode()
+
+    def __init__(self, server_address, handler_class, workers=16, queue_size=64):
+        # listen() backlog, applied when the socket is activated
+        self.request_queue_size = max(5, queue_size)
+        # before super(): a failing bind() already calls server_close()
+        self._pool = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="http-worker")
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._detached = set()
+        self._detached_lock = threading.Lock()
+        super().__init__(server_address, handler_class)
+
+    def process_request(self, request, client_address):
+        if not self._slots.acquire(blocking=False):
+            self._reject_busy(request)
+            return
+        try:
+            future = self._pool.submit(self._process_in_worker, request, client_address)
+        except RuntimeError:
+            # pool already shut down
+            self._slots.release()
+            self.shutdown_request(request)
+            return
+        future.add_done_callback(functools.partial(self._drop_cancelled, request))
+
+    def _drop_cancelled(self, request, future):
+        # queued connections cancelled by server_close() never reach a worker
+        if future.cancelled():
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def _process_in_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            with self._detached_lock:
+                detached = request in self._detached
+            if not detached:
+                self.shutdown_request(request)
+            self._slots.release()
+
+    def detach(self, request):
+        """
+        Take over a connection from its worker, which returns without closing
+        it. The caller must pass it to release_detached() when done.
+        """
+        with self._detached_lock:
+            self._detached.add(request)
+
+    def release_detached(self, request):
+        with self._detached_lock:
+            self._detached.discard(request)
+        self.shutdown_request(request)
+
+    def _reject_busy(self, request):
+        head = (
+            "HTTP/1.0 503 Service Unavailable\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(self._BUSY_BODY)}\r\n"
+            "Retry-After: 1\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode()
+        try:
+            request.sendall(head + self._BUSY_BODY)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        stop_streams()
+        # let running requests finish, drop the ones still waiting
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+
 def run():
     """Entry point to start the HTTP server."""
     port = int(os.getenv("PORT", "9000"))
-    server = HTTPServer(("0.0.0.0", port), Handler)
-    print(f"Server running on port {port}")
-    server.serve_forever()
+    # HTTP_WORKERS=0 falls back to the single-threaded HTTPServer
+    workers = int(os.getenv("HTTP_WORKERS", "16"))
+    queue_size = int(os.getenv("HTTP_QUEUE", "64"))
+    Handler.timeout = float(os.getenv("HTTP_TIMEOUT", "30")) or None
+
+    if workers > 0:
+        server = PooledHTTPServer(("0.0.0.0", port), Handler,
+                                  workers=workers, queue_size=queue_size)
+    else:
+        server = HTTPServer(("0.0.0.0", port), Handler)
+
+    def _shutdown():
+        # open log streams would keep the single-threaded server busy
+        stop_streams()
+        server.shutdown()
+
+    def _stop(signum, frame):
+        # shutdown() blocks until serve_forever() returns, so it must not
+        # run on the thread that is serving
+        threading.Thread(target=_shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    _STATIC.load()
+    _COLLECTOR.start()
+    _SERIES.start()
+    threading.Thread(target=_start_history, name="history-start", daemon=True).start()
+    print(f"Server running on port {port} (workers={workers}, queue={queue_size})")
+    if len(HOSTS) > 1:
+        print("fail2ban hosts: " + ", ".join(f"{h.name}={h.path}" for h in HOSTS.values()))
+    try:
+        server.serve_forever()
+    finally:
+        _COLLECTOR.stop()
+        _SERIES.stop()
+        server.server_close()
+        for host in HOSTS.values():
+            host.pool.close()
+        for history in _HISTORIES.values():
+            history.close()
+        print("Server stopped")
 
 
 if __name__ == "__main__":
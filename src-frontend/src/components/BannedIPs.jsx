@@ -1,31 +1,68 @@
-import { React, useState, useEffect } from 'react';
+import { React, useState, useEffect, useCallback } from 'react';
 import PropTypes from 'prop-types';
 import {
     Card,
     CardHeader,
     CardContent,
+    Button,
     Chip,
     Stack,
+    TextField,
     IconButton,
     Tooltip,
     Typography,
 } from '@mui/material';
-import { unbanIP, unbanAll } from './api';
+import { unbanIP, unbanAll, getBanned } from './api';
 import HighlightOffIcon from '@mui/icons-material/HighlightOff';
 
 const DeleteAllIcon = HighlightOffIcon;
+const PAGE_SIZE = 200;
+
+// "203.0.113.0/24" filters by network, anything else by address prefix
+const filterQuery = (filter) => {
+    const f = filter.trim();
+    if (!f) return {};
+    return f.includes('/') ? { net: f } : { prefix: f };
+};
 
 export default function BannedIPs({
     jailname,
-    ips,
+    refreshKey,
     refreshStatus,
     doOverviewRefresh,
     setJailRefresh,
 }) {
     const [ipList, setIPList] = useState([]);
+    const [count, setCount] = useState(0);
+    const [next, setNext] = useState(null);
+    const [filter, setFilter] = useState('');
+    const [error, setError] = useState('');
+
+    // the server returns sorted pages; only loaded pages are kept here
+    const loadPage = useCallback(
+        async (cursor) => {
+            try {
+                const page = await getBanned({
+                    jail: jailname || undefined,
+                    limit: PAGE_SIZE,
+                    cursor,
+                    ...filterQuery(filter),
+                });
+                setIPList((list) => (cursor ? [...list, ...page.ips] : page.ips));
+                setCount(page.count);
+                setNext(page.next);
+                setError('');
+            } catch (e) {
+                setError(e.message);
+            }
+        },
+        [jailname, filter]
+    );
+
     useEffect(() => {
-        setIPList(ips);
-    }, [ips]);
+        const t = setTimeout(() => loadPage(), 300);
+        return () => clearTimeout(t);
+    }, [loadPage, refreshKey]);
     const styles = {
         card: {
             margin: '0px 0px',
@@ -56,38 +93,17 @@ export default function BannedIPs({
             color: 'var(--text-color)',
         },
     };
-    const sortIP = (a, b) => {
-        return (
-            Number(
-                a
-                    .split('.')
-                    .map(Number)
-                    .reduce(
-                        (acc, val) => acc + String(val).padStart(3, '0'),
-                        ''
-                    )
-            ) -
-            Number(
-                b
-                    .split('.')
-                    .map(Number)
-                    .reduce(
-                        (acc, val) => acc + String(val).padStart(3, '0'),
-                        ''
-                    )
-            )
-        );
-    };
-
     const handleDelete = async (ipToDelete) => {
         await unbanIP(jailname, ipToDelete);
         refreshStatus();
+        loadPage();
         if (doOverviewRefresh) doOverviewRefresh(true);
         if (setJailRefresh) setJailRefresh(true);
     };
     const handleDeleteAll = async () => {
         await unbanAll();
         refreshStatus();
+        loadPage();
         doOverviewRefresh(true);
     };
     return (
@@ -115,11 +131,21 @@ export default function BannedIPs({
                 }
             />
             <CardContent sx={styles.cardcontent}>
+                <TextField
+                    label="Filter (prefix or CIDR)"
+                    size="small"
+                    fullWidth
+                    value={filter}
+                    onChange={(e) => setFilter(e.target.value)}
+                    error={!!error}
+                    helperText={error || `${ipList.length} of ${count}`}
+                    sx={{ marginBottom: '8px' }}
+                />
                 <Stack direction="row" flexWrap="wrap" gap={1} useFlexGap>
                     {ipList.length === 0 && (
                         <Typography variant="body2">No banned IPs</Typography>
                     )}
-                    {ipList.sort(sortIP).map((ip) => (
+                    {ipList.map((ip) => (
                         <Chip
                             key={ip}
                             label={ip}
@@ -128,13 +154,18 @@ export default function BannedIPs({
                         />
                     ))}
                 </Stack>
+                {next && (
+                    <Button size="small" onClick={() => loadPage(next)}>
+                        Load more
+                    </Button>
+                )}
             </CardContent>
         </Card>
     );
 }
 BannedIPs.propTypes = {
     jailname: PropTypes.number.isRequired,
-    ips: PropTypes.array.isRequired,
+    refreshKey: PropTypes.any,
     refreshStatus: PropTypes.func.isRequired,
     doOverviewRefresh: PropTypes.func.isRequired,
     setJailRefresh: PropTypes.func.isRequired,
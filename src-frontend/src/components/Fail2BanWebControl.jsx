@@ -5,12 +5,13 @@ import f2bLogo from '../assets/fail2ban-logo.png';
 import Jail from './Jail.jsx';
 import Overview from './Overview.jsx';
 import Footer from './Footer.jsx';
-import { getGlobalStatus } from './api';
+import { getGlobalStatus, getJailsStatus } from './api';
 
 export default function Fail2BanWebControl({ themeMode, setThemeMode }) {
     const [overviewRefresh, setOverviewRefresh] = useState(false);
     const [jailRefresh, setJailRefresh] = useState(false);
     const [status, setStatus] = useState(null);
+    const [jailsStatus, setJailsStatus] = useState(null);
     const styles = {
         fail2ban: {
             width: '900px',
@@ -24,6 +25,10 @@ export default function Fail2BanWebControl({ themeMode, setThemeMode }) {
         getGlobalStatus()
             .then(setStatus)
             .catch((error) => setStatus({ error: error.message }));
+        // all jails in one request; each Jail refreshes itself afterwards
+        getJailsStatus({ limit: 0 })
+            .then(setJailsStatus)
+            .catch(() => setJailsStatus({}));
     }, []);
     return (
         <Box sx={styles.fail2ban}>
@@ -43,10 +48,11 @@ export default function Fail2BanWebControl({ themeMode, setThemeMode }) {
                 overviewRefresh={overviewRefresh}
                 setJailRefresh={setJailRefresh}
             />
-            {status?.list?.map((jailname) => (
+            {jailsStatus && status?.list?.map((jailname) => (
                 <Jail
                     key={jailname}
                     jailname={jailname}
+                    initialStatus={jailsStatus[jailname]}
                     doOverviewRefresh={setOverviewRefresh}
                     setJailRefresh={setJailRefresh}
                     jailRefresh={jailRefresh}
@@ -1,4 +1,4 @@
-import { React, useState, useEffect, useCallback } from 'react';
+import { React, useState, useEffect, useCallback, useRef } from 'react';
 import PropTypes from 'prop-types';
 import {
     Card,
@@ -16,7 +16,7 @@ import {
     Switch,
     TextField,
 } from '@mui/material';
-import { getFile } from './api';
+import { getFile, streamFile } from './api';
 
 const LS_KEYS = {
     tailLines: 'f2b.filelist.tailLines',
@@ -50,6 +50,9 @@ export default function Filelist({ filelist }) {
     const [dialogTitle, setDialogTitle] = useState('');
     const [fileText, setFileText] = useState('');
     const [currentFilePath, setCurrentFilePath] = useState(null);
+    // follow state: cursor of the last response and the lines shown so far
+    const cursorRef = useRef('');
+    const linesRef = useRef([]);
 
     const [tailMode, setTailMode] = useState(() =>
         readBoolLS(LS_KEYS.tailMode, true)
@@ -134,58 +137,95 @@ export default function Filelist({ filelist }) {
         },
     };
 
+    const computeLinesParam = useCallback(() => {
+        if (!tailMode) return 0;
+        const n = Number(tailLines) || 0;
+        return n > 0 ? -n : -20;
+    }, [tailMode, tailLines]);
+
+    const applyFileData = useCallback(
+        (filedata, linesParam) => {
+            const newLines = Array.isArray(filedata.lines)
+                ? filedata.lines
+                : [];
+            let lines = filedata.reset
+                ? newLines
+                : linesRef.current.concat(newLines);
+            if (linesParam < 0) lines = lines.slice(linesParam);
+            linesRef.current = lines;
+            cursorRef.current = filedata.cursor ?? '';
+            setFileText(lines.join('\n'));
+        },
+        [setFileText]
+    );
+
     const fetchFileData = useCallback(
-        async (path) => {
-            const computeLinesParam = () => {
-                if (!tailMode) return 0;
-                const n = Number(tailLines) || 0;
-                return n > 0 ? -n : -20;
-            };
+        async (path, restart = false) => {
+            if (restart) cursorRef.current = '';
             try {
                 const linesParam = computeLinesParam();
-                const filedata = await getFile(path, linesParam);
-                setFileText(
-                    Array.isArray(filedata.lines)
-                        ? filedata.lines.join('\n')
-                        : filedata.content || ''
+                const filedata = await getFile(
+                    path,
+                    linesParam,
+                    cursorRef.current
                 );
+                applyFileData(filedata, linesParam);
             } catch (error) {
                 console.error(error);
             }
         },
-        [tailMode, tailLines, setFileText]
+        [computeLinesParam, applyFileData]
     );
 
     const handleClick = async (file) => {
         setDialogTitle(file.path);
         setCurrentFilePath(file.path);
-        await fetchFileData(file.path);
+        await fetchFileData(file.path, true);
         setDialogOpen(true);
     };
 
     useEffect(() => {
         if (!dialogOpen || !currentFilePath) return;
 
-        const id = setInterval(() => {
-            fetchFileData(currentFilePath);
-        }, Math.max(1, Number(pollIntervalSec) || 5) * 1000);
+        let id = null;
+        const startPolling = () => {
+            id = setInterval(() => {
+                fetchFileData(currentFilePath);
+            }, Math.max(1, Number(pollIntervalSec) || 5) * 1000);
+        };
+
+        if (typeof EventSource === 'undefined') {
+            fetchFileData(currentFilePath, true);
+            startPolling();
+            return () => clearInterval(id);
+        }
 
-        return () => clearInterval(id);
+        // live stream; the server pushes new lines as the file grows
+        const linesParam = computeLinesParam();
+        const es = streamFile(currentFilePath, linesParam, (data) =>
+            applyFileData(data, linesParam)
+        );
+        es.onerror = () => {
+            // stream refused (e.g. too many streams): fall back to polling
+            if (es.readyState === EventSource.CLOSED && id === null) {
+                fetchFileData(currentFilePath, true);
+                startPolling();
+            }
+        };
+
+        return () => {
+            es.close();
+            if (id !== null) clearInterval(id);
+        };
     }, [
         dialogOpen,
         currentFilePath,
         pollIntervalSec,
-        tailMode,
-        tailLines,
+        computeLinesParam,
+        applyFileData,
         fetchFileData,
     ]);
 
-    useEffect(() => {
-        if (dialogOpen && currentFilePath) {
-            fetchFileData(currentFilePath);
-        }
-    }, [tailMode, tailLines]);
-
     return (
         <>
             <Card sx={styles.card}>
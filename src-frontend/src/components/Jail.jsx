@@ -19,6 +19,7 @@ import JailExtraInfo from './JailExtrainfo.jsx';
 
 export default function Jail({
     jailname,
+    initialStatus,
     doOverviewRefresh,
     setJailRefresh,
     jailRefresh,
@@ -28,14 +29,20 @@ export default function Jail({
     const [jail, setJail] = useState(null);
 
     const refreshStatus = useCallback(() => {
-        getJailStatus(jailname).then(setJail).catch(console.error);
+        // the banned list itself is paged by BannedIPs
+        getJailStatus(jailname, { limit: 0 }).then(setJail).catch(console.error);
     }, [jailname]);
 
     useEffect(() => {
-        refreshStatus();
-    }, [refreshStatus]);
+        if (initialStatus && !initialStatus.error) {
+            setJail(initialStatus);
+        } else {
+            refreshStatus();
+        }
+    }, [refreshStatus, initialStatus]);
 
     useEffect(() => {
+        if (!jailRefresh) return;
         refreshStatus();
         setJailRefresh(false);
     }, [jailRefresh]);
@@ -161,8 +168,8 @@ export default function Jail({
                     <Filelist filelist={jail?.filter?.fileList || []} />
                     <BannedIPs
                         refreshStatus={refreshStatus}
-                        name={jailname}
-                        ips={jail?.actions?.bannedIPList || []}
+                        jailname={jailname}
+                        refreshKey={jail}
                         doOverviewRefresh={doOverviewRefresh}
                     />
                     <Stack direction="row" spacing={1}>
@@ -199,6 +206,7 @@ export default function Jail({
 }
 Jail.propTypes = {
     jailname: PropTypes.string.isRequired,
+    initialStatus: PropTypes.object,
     doOverviewRefresh: PropTypes.func.isRequired,
     setJailRefresh: PropTypes.func.isRequired,
     jailRefresh: PropTypes.bool.isRequired,
@@ -23,6 +23,7 @@ import LightModeIcon from '@mui/icons-material/LightMode';
 import DarkModeIcon from '@mui/icons-material/DarkMode';
 
 import BannedIPs from './BannedIPs.jsx';
+import { withHost } from './api';
 import LogLevelSlider from './LogLevelSlider.jsx';
 
 const StartIcon = PlayArrowIcon;
@@ -30,7 +31,7 @@ const RestartIcon = RestartAltIcon;
 const ReloadIcon = SystemUpdateAltIcon;
 
 async function postJSON(url, body) {
-    const res = await fetch(url, {
+    const res = await fetch(withHost(url), {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: body ? JSON.stringify(body) : undefined,
@@ -57,7 +58,7 @@ export default function Overview({
     const [inputDbMaxMatches, setInputDbMaxMatches] = useState('');
     const [dbPurgeAge, setDbPurgeAge] = useState('');
     const [inputDbPurgeAge, setInputDbPurgeAge] = useState('');
-    const [banned, setBanned] = useState([]);
+    const [bannedRefresh, setBannedRefresh] = useState(0);
     const [busy, setBusy] = useState(false);
     const [snack, setSnack] = useState({
         open: false,
@@ -133,7 +134,10 @@ export default function Overview({
     const loadInfo = useCallback(async () => {
         try {
             // optional: add ?ttl=300 to smooth bursts when multiple components call at once
-            const o = await fetchJSON('/api/overview?ttl=300');
+            // banned IPs are paged by BannedIPs, so they are not part of this request
+            const o = await fetchJSON(
+                '/api/overview?ttl=300&fields=version,loglevel,db.file,db.maxmatches,db.purgeage'
+            );
 
             // o.version e.g. "Fail2Ban v1.0.2"
             setVersion(o.version.split('\n')[1] || '');
@@ -152,7 +156,7 @@ export default function Overview({
             setDbPurgeAge(paVal);
             setInputDbPurgeAge(paVal);
 
-            setBanned(o.banned?.ips ?? []);
+            setBannedRefresh((n) => n + 1);
         } catch (e) {
             showErr(e);
         }
@@ -263,7 +267,8 @@ export default function Overview({
         });
 
     async function fetchJSON(url) {
-        const res = await fetch(url);
+        // revalidate with If-None-Match instead of re-downloading unchanged data
+        const res = await fetch(withHost(url), { cache: 'no-cache' });
         let errorDetail = '';
 
         if (!res.ok) {
@@ -491,8 +496,8 @@ export default function Overview({
 
                     <BannedIPs
                         refreshStatus={loadInfo}
-                        name=""
-                        ips={banned || []}
+                        jailname=""
+                        refreshKey={bannedRefresh}
                         setJailRefresh={setJailRefresh}
                     />
                 </CardContent>
@@ -1,11 +1,26 @@
 const API_BASE = '/api';
 
+// Multi-host mode: opening the UI as /?host=<name> talks to that fail2ban host
+const HOST = new URLSearchParams(window.location.search).get('host');
+
+/**
+* Add the selected fail2ban host (if any) to an API URL
+*/
+export function withHost(url) {
+    if (!HOST) return url;
+    return `${url}${url.includes('?') ? '&' : '?'}host=${encodeURIComponent(HOST)}`;
+}
+
+// Let the browser revalidate cached responses with If-None-Match;
+// unchanged data then comes back as a body-less 304.
+const REVALIDATE = { cache: 'no-cache' };
+
 /**
 * Get global fail2ban status
 * -> { jails: number, list: string[] }
 */
 export async function getGlobalStatus() {
-    const res = await fetch(`${API_BASE}/status`);
+    const res = await fetch(withHost(`${API_BASE}/status`), REVALIDATE);
     let errorDetail = "";
 
     if (!res.ok) {
@@ -26,28 +41,85 @@ export async function getGlobalStatus() {
 * -> string[]
 */
 export async function getJails() {
-    const res = await fetch(`${API_BASE}/jails`);
+    const res = await fetch(withHost(`${API_BASE}/jails`), REVALIDATE);
     if (!res.ok) throw new Error(`Error: ${res.status}`);
 
     let data = await res.json();
     return data;
 }
 
+// { a: 1, b: undefined } -> "?a=1" (empty values are left out)
+function queryString(params = {}) {
+    const qs = new URLSearchParams();
+    for (const [key, value] of Object.entries(params)) {
+        if (value !== undefined && value !== null && value !== '') {
+            qs.set(key, value);
+        }
+    }
+    const s = qs.toString();
+    return s ? `?${s}` : '';
+}
+
 /**
 * Retrieve status for a specific jail
+* @param {object} [page] - { offset, limit, cursor, net, prefix }: return only
+*   one page of actions.bannedIPList (plus actions.bannedIPCount and actions.next)
 * -> { filter: {...}, actions: {...} }
 */
-export async function getJailStatus(jailName) {
-    const res = await fetch(`${API_BASE}/jail/${encodeURIComponent(jailName)}/status`);
+export async function getJailStatus(jailName, page) {
+    const res = await fetch(
+        withHost(`${API_BASE}/jail/${encodeURIComponent(jailName)}/status${queryString(page)}`),
+        REVALIDATE
+    );
     if (!res.ok) throw new Error(`Error: ${res.status}`);
     return res.json();
 }
 
+/**
+* Status of several jails in one request
+* @param {object} [query] - { jails: 'a,b' (default: all), plus the page options of getJailStatus }
+* -> { [jail]: { filter: {...}, actions: {...}, extra: {...} } | { error: string } }
+*/
+export async function getJailsStatus(query) {
+    const res = await fetch(withHost(`${API_BASE}/jails/status${queryString(query)}`), REVALIDATE);
+    if (!res.ok) throw new Error(`Error: ${res.status}`);
+    return res.json();
+}
+
+/**
+* Counter history of a jail for charts
+* @param {object} [query] - { window: '1h' | '24h' | '7d' (default 1h), since, until, step }
+* -> { jail, step: number, ts: number[], values: { currentlyFailed: number[], totalFailed: number[],
+*      currentlyBanned: number[], totalBanned: number[] } }
+*/
+export async function getJailSeries(jailName, query) {
+    const res = await fetch(
+        withHost(`${API_BASE}/jail/${encodeURIComponent(jailName)}/series${queryString(query)}`),
+        REVALIDATE
+    );
+    if (!res.ok) throw new Error(`Error: ${res.status}`);
+    return res.json();
+}
+
+/**
+* One page of banned IPs, sorted numerically
+* @param {object} query - { jail, offset, limit, cursor, net (CIDR), prefix }
+* -> { ips: string[], count: number, offset: number, limit: number, next: string|null }
+*/
+export async function getBanned(query = {}) {
+    const res = await fetch(withHost(`${API_BASE}/banned${queryString({ offset: 0, ...query })}`), REVALIDATE);
+    if (!res.ok) {
+        const msg = await res.text().catch(() => "");
+        throw new Error(`Error ${res.status}: ${msg}`);
+    }
+    return res.json();
+}
+
 /**
 * Jail an IP address
 */
 export async function banIP(jailName, ip) {
-    const res = await fetch(`${API_BASE}/jail/${encodeURIComponent(jailName)}/ban`, {
+    const res = await fetch(withHost(`${API_BASE}/jail/${encodeURIComponent(jailName)}/ban`), {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ ip }),
@@ -61,7 +133,7 @@ export async function banIP(jailName, ip) {
 */
 export async function unbanIP(jailName, ip) {
     if (!jailName) {
-        const res = await fetch(`${API_BASE}/unban`, {
+        const res = await fetch(withHost(`${API_BASE}/unban`), {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({ ip }),   // { "ip": "123.123.123.123" }
@@ -73,7 +145,7 @@ export async function unbanIP(jailName, ip) {
         }
         return res.json(); // -> { result: "...", command: ["unban", "123.123.123.123"] }
     } else {
-        const res = await fetch(`${API_BASE}/jail/${encodeURIComponent(jailName)}/unban`, {
+        const res = await fetch(withHost(`${API_BASE}/jail/${encodeURIComponent(jailName)}/unban`), {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({ ip }),
@@ -87,7 +159,7 @@ export async function unbanIP(jailName, ip) {
 }
 
 export async function unbanAll() {
-    const res = await fetch(`${API_BASE}/unban/all`, {
+    const res = await fetch(withHost(`${API_BASE}/unban/all`), {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: ""
@@ -103,16 +175,39 @@ export async function unbanAll() {
 * Retrieve the contents of a file
 * @param {string} filePath - Absolute path to the file
 * @param {number} lines - Number of lines: >0 = first N, <0 = last N, 0 = entire file
-* -> { path: string, exists: boolean, lines: string[] }
+* @param {string} [cursor] - Follow mode: '' to start, then the cursor of the previous response
+* -> { path: string, exists: boolean, lines: string[], cursor?: string, reset?: boolean }
 */
-export async function getFile(filePath, lines = 0) {
-    const url = `${API_BASE}/file?path=${encodeURIComponent(filePath)}&lines=${lines}`;
-    const res = await fetch(url);
+export async function getFile(filePath, lines = 0, cursor) {
+    let url = `${API_BASE}/file?path=${encodeURIComponent(filePath)}&lines=${lines}`;
+    if (cursor !== undefined && cursor !== null) {
+        url += `&cursor=${encodeURIComponent(cursor)}`;
+    }
+    const res = await fetch(url, REVALIDATE);
     if (!res.ok) throw new Error(`Error: ${res.status}`);
     return res.json();
 }
+/**
+* Follow a file live via Server-Sent Events
+* @param {string} filePath - Absolute path to the file
+* @param {number} lines - Initial snapshot: <0 = last N, 0 = entire file
+* @param {function} onData - called with { path, lines: string[], reset: boolean }
+* -> EventSource (call close() to stop)
+*/
+export function streamFile(filePath, lines, onData) {
+    const url = `${API_BASE}/file/stream?path=${encodeURIComponent(filePath)}&lines=${lines}`;
+    const es = new EventSource(url);
+    es.onmessage = (ev) => {
+        try {
+            onData(JSON.parse(ev.data));
+        } catch (e) {
+            console.error(e);
+        }
+    };
+    return es;
+}
 export async function postJSON(url, body) {
-    const res = await fetch(url, {
+    const res = await fetch(withHost(url), {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: body ? JSON.stringify(body) : undefined,
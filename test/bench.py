@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+End-to-end load benchmark for the backend.
+
+Starts test/fake_fail2ban.py with synthetic state and src-backend/app.py
+on top of it, then drives each endpoint with concurrent clients and
+reports throughput, p50/p95/p99 latency and the app's peak RSS per
+endpoint. Results are written as JSON; --compare prints the change
+against an earlier result file.
+
+    python3 test/bench.py --jails 25 --banned 10000 --output bench-1.10.json
+    python3 test/bench.py --compare bench-1.9.json
+    python3 test/bench.py --env F2B_COLLECT_INTERVAL=2 --endpoint /api/jails/status
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(HERE)
+APP = os.path.join(REPO_ROOT, "src-backend", "app.py")
+FAKE = os.path.join(HERE, "fake_fail2ban.py")
+
+# {jail} is replaced by the first jail of the fake server
+DEFAULT_ENDPOINTS = [
+    "GET /api/status",
+    "GET /api/jails",
+    "GET /api/overview",
+    "GET /api/version",
+    "GET /api/banned",
+    "GET /api/banned?limit=100",
+    "GET /api/banned?prefix=10.&limit=100",
+    "GET /api/jail/{jail}/status",
+    "GET /api/jail/{jail}/status?fields=actions.currentlyBanned",
+    "GET /api/jails/status",
+    "GET /api/jails/status?limit=0",
+    "POST /api/jail/{jail}/ban",
+]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_for(check, timeout: float, what: str):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if check():
+                return
+        except OSError:
+            pass
+        time.sleep(0.05)
+    raise RuntimeError(f"{what} did not come up within {timeout}s")
+
+
+def _rss_kb(pid: int) -> int | None:
+    """Current resident set size of a process (Linux only)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+class RssSampler:
+    """Samples a process' RSS in the background and keeps the maximum."""
+
+    def __init__(self, pid: int, interval: float = 0.01):
+        self.pid = pid
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = _rss_kb(self.pid)
+            if rss is not None and (self.peak is None or rss > self.peak):
+                self.peak = rss
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def _request(port: int, method: str, path: str, headers: dict, body_fn):
+    """One request on a fresh connection (the server speaks HTTP/1.0)."""
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    try:
+        body = body_fn() if method == "POST" else None
+        started = time.perf_counter()
+        conn.request(method, path, body=body, headers=headers)
+        resp = conn.getresponse()
+        size = len(resp.read())
+        return time.perf_counter() - started, resp.status, size
+    finally:
+        conn.close()
+
+
+def _ban_body():
+    ip = "198.18.%d.%d" % (random.randint(0, 255), random.randint(1, 254))
+    return json.dumps({"ip": ip})
+
+
+def run_endpoint(port: int, pid: int, method: str, path: str, requests: int,
+                 concurrency: int, warmup: int, headers: dict) -> dict:
+    for _ in range(warmup):
+        _request(port, method, path, headers, _ban_body)
+
+    latencies, statuses, sizes = [], {}, []
+    lock = threading.Lock()
+
+    def one(_):
+        try:
+            elapsed, status, size = _request(port, method, path, headers, _ban_body)
+        except OSError as e:
+            elapsed, status, size = None, type(e).__name__, 0
+        with lock:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+            if elapsed is not None:
+                latencies.append(elapsed)
+                sizes.append(size)
+
+    with RssSampler(pid) as rss, ThreadPoolExecutor(concurrency) as pool:
+        started = time.perf_counter()
+        list(pool.map(one, range(requests)))
+        wall = time.perf_counter() - started
+
+    latencies.sort()
+    ms = [v * 1000 for v in latencies]
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "seconds": round(wall, 4),
+        "throughput_rps": round(len(latencies) / wall, 1) if wall else 0.0,
+        "p50_ms": round(percentile(ms, 50), 3),
+        "p95_ms": round(percentile(ms, 95), 3),
+        "p99_ms": round(percentile(ms, 99), 3),
+        "max_ms": round(ms[-1], 3) if ms else 0.0,
+        "mean_bytes": round(sum(sizes) / len(sizes)) if sizes else 0,
+        "status": statuses,
+        "peak_rss_kb": rss.peak,
+    }
+
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "-C", REPO_ROOT, "describe", "--always", "--dirty"],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old: dict, new: dict):
+    """Print throughput and p95 changes per endpoint."""
+    print(f"\n{'endpoint':60} {'rps':>18} {'p95 ms':>20}")
+    for name, cur in new["results"].items():
+        prev = old.get("results", {}).get(name)
+        if prev is None:
+            continue
+
+        def delta(a, b):
+            return f"{(b - a) / a * 100:+.0f}%" if a else "n/a"
+        print(f"{name:60} {cur['throughput_rps']:>9} {delta(prev['throughput_rps'], cur['throughput_rps']):>8}"
+              f" {cur['p95_ms']:>11} {delta(prev['p95_ms'], cur['p95_ms']):>8}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--jails", type=int, default=10)
+    parser.add_argument("--banned", type=int, default=5000,
+                        help="banned IPs per jail (default: %(default)s)")
+    parser.add_argument("--latency", type=float, default=0.5,
+                        help="fake fail2ban delay per command in ms (default: %(default)s)")
+    parser.add_argument("--requests", type=int, default=500,
+                        help="requests per endpoint (default: %(default)s)")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--endpoint", action="append", dest="endpoints",
+                        help='"[METHOD] /path", repeatable (default: a standard set)')
+    parser.add_argument("--accept-encoding", default="",
+                        help="Accept-Encoding header to send, e.g. gzip")
+    parser.add_argument("--env", action="append", default=[],
+                        help="KEY=VALUE for the app, repeatable")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="earlier JSON result to compare with")
+    args = parser.parse_args(argv)
+
+    tmp = tempfile.mkdtemp(prefix="f2b-bench-")
+    sock_path = os.path.join(tmp, "fail2ban.sock")
+    port = _free_port()
+    env = {**os.environ, "F2B_SOCKET": sock_path, "PORT": str(port),
+           **dict(kv.split("=", 1) for kv in args.env)}
+
+    fake = subprocess.Popen([sys.executable, FAKE, "--socket", sock_path,
+                             "--jails", str(args.jails), "--banned", str(args.banned),
+                             "--latency", str(args.latency)])
+    app = None
+    app_log = open(os.path.join(tmp, "app.log"), "wb")
+    try:
+        _wait_for(lambda: os.path.exists(sock_path), 120, "fake fail2ban")
+        app = subprocess.Popen([sys.executable, APP], env=env, stdout=app_log,
+                               stderr=subprocess.STDOUT, cwd=os.path.dirname(APP))
+        _wait_for(lambda: _request(port, "GET", "/api/version", {}, None)[1] == 200,
+                  30, "app")
+
+        headers = {"Content-Type": "application/json"}
+        if args.accept_encoding:
+            headers["Accept-Encoding"] = args.accept_encoding
+        results = {}
+        for spec in args.endpoints or DEFAULT_ENDPOINTS:
+            method, _, path = spec.partition(" ") if " " in spec else ("GET", "", spec)
+            path = path.replace("{jail}", "jail-00")
+            name = f"{method} {path}"
+            results[name] = run_endpoint(port, app.pid, method, path, args.requests,
+                                         args.concurrency, args.warmup, headers)
+            r = results[name]
+            print(f"{name:60} {r['throughput_rps']:>8} rps  p50 {r['p50_ms']:>8} ms  "
+                  f"p95 {r['p95_ms']:>8} ms  p99 {r['p99_ms']:>8} ms  "
+                  f"rss {r['peak_rss_kb']} kB  {r['status']}", flush=True)
+    finally:
+        for proc in (app, fake):
+            if proc is not None:
+                proc.terminate()
+                proc.wait()
+        app_log.close()
+        print(f"app log: {app_log.name}")
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "jails": args.jails,
+            "banned_per_jail": args.banned,
+            "latency_ms": args.latency,
+            "env": dict(kv.split("=", 1) for kv in args.env),
+            "accept_encoding": args.accept_encoding,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"results written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
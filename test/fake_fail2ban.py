@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Stand-in for the fail2ban server socket, for benchmarks and local testing
+without a real fail2ban.
+
+Speaks the fail2ban socket protocol (pickled command lists terminated by
+<F2B_END_COMMAND>, many commands per connection) and answers from
+synthetic in-memory state: N jails with M banned IPs each, optionally
+with artificial latency per command.
+
+    python3 test/fake_fail2ban.py --socket /tmp/f2b.sock --jails 25 --banned 10000
+    F2B_SOCKET=/tmp/f2b.sock PORT=9000 python3 src-backend/app.py
+"""
+
+import argparse
+import os
+import pickle
+import random
+import signal
+import socket
+import sys
+import threading
+import time
+
+END_MARKER = b"<F2B_END_COMMAND>"
+CLOSE_MARKER = b"<F2B_CLOSE_COMMAND>"
+
+EXTRAINFO_DEFAULTS = {
+    "maxlines": 1,
+    "maxmatches": 5,
+    "maxretry": 5,
+    "findtime": 600,
+    "bantime": 3600,
+}
+
+
+class UnknownJailException(KeyError):
+    """Same name as fail2ban's error for unknown jails."""
+
+
+def _random_ip(rng: random.Random, ipv6_ratio: float) -> str:
+    if rng.random() < ipv6_ratio:
+        return "2001:db8:%x:%x::%x" % (rng.getrandbits(16), rng.getrandbits(16),
+                                      rng.getrandbits(16))
+    return "%d.%d.%d.%d" % (rng.randint(1, 223), rng.randint(0, 255),
+                            rng.randint(0, 255), rng.randint(1, 254))
+
+
+class FakeState:
+    """Synthetic fail2ban state; all access goes through one lock."""
+
+    def __init__(self, jails: int, banned: int, ipv6_ratio: float = 0.0, seed: int = 1):
+        rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.settings = {
+            "loglevel": "INFO",
+            "logtarget": "/var/log/fail2ban.log",
+            "dbfile": "/var/lib/fail2ban/fail2ban.sqlite3",
+            "dbmaxmatches": 10,
+            "dbpurgeage": 86400,
+        }
+        self.jails = {}
+        for i in range(jails):
+            ips = {}
+            while len(ips) < banned:
+                ips[_random_ip(rng, ipv6_ratio)] = None
+            self.jails[f"jail-{i:02d}"] = {
+                "banned": ips,  # insertion-ordered set
+                "total_banned": banned + rng.randint(0, banned),
+                "failed": rng.randint(0, 50),
+                "total_failed": rng.randint(50, 5000),
+                "files": [f"/var/log/fake/jail-{i:02d}.log"],
+                "extra": dict(EXTRAINFO_DEFAULTS),
+            }
+
+    def _jail(self, name: str) -> dict:
+        jail = self.jails.get(name)
+        if jail is None:
+            raise UnknownJailException(name)
+        return jail
+
+    def execute(self, cmd: list):
+        """Return the [code, value] reply for one command."""
+        try:
+            with self.lock:
+                return [0, self._execute(cmd)]
+        except Exception as e:
+            return [1, e]
+
+    def _execute(self, cmd: list):
+        verb, args = (cmd[0], cmd[1:]) if cmd else ("", [])
+        if verb == "ping":
+            return "pong"
+        if verb == "version":
+            return "1.1.0"
+        if verb == "status" and not args:
+            return [("Number of jail", len(self.jails)),
+                    ("Jail list", ", ".join(self.jails))]
+        if verb == "status":
+            jail = self._jail(args[0])
+            return [
+                ("Filter", [("Currently failed", jail["failed"]),
+                            ("Total failed", jail["total_failed"]),
+                            ("File list", list(jail["files"]))]),
+                ("Actions", [("Currently banned", len(jail["banned"])),
+                             ("Total banned", jail["total_banned"]),
+                             ("Banned IP list", list(jail["banned"]))]),
+            ]
+        if verb == "banned":
+            if args:
+                return [[name for name, j in self.jails.items() if ip in j["banned"]]
+                        for ip in args]
+            return [{name: list(j["banned"])} for name, j in self.jails.items()]
+        if verb == "get" and len(args) == 1:
+            if args[0] not in self.settings:
+                raise ValueError(f"Invalid command: get {args[0]}")
+            return self.settings[args[0]]
+        if verb == "get" and len(args) == 2:
+            jail = self._jail(args[0])
+            if args[1] not in jail["extra"]:
+                raise ValueError(f"Invalid command: get {args[0]} {args[1]}")
+            return jail["extra"][args[1]]
+        if verb == "set" and len(args) == 2 and args[0] in self.settings:
+            self.settings[args[0]] = args[1]
+            return args[1]
+        if verb == "set" and len(args) >= 3 and args[1] == "banip":
+            jail = self._jail(args[0])
+            added = 0
+            for ip in args[2:]:
+                if ip not in jail["banned"]:
+                    jail["banned"][ip] = None
+                    jail["total_banned"] += 1
+                    added += 1
+            return added
+        if verb == "set" and len(args) >= 3 and args[1] == "unbanip":
+            jail = self._jail(args[0])
+            removed = 0
+            for ip in args[2:]:
+                if jail["banned"].pop(ip, False) is None:
+                    removed += 1
+            return removed
+        if verb == "set" and len(args) == 3:
+            jail = self._jail(args[0])
+            jail["extra"][args[1]] = args[2]
+            return args[2]
+        if verb == "unban":
+            removed = 0
+            for jail in self.jails.values():
+                if args == ["--all"]:
+                    removed += len(jail["banned"])
+                    jail["banned"].clear()
+                    continue
+                for ip in args:
+                    if jail["banned"].pop(ip, False) is None:
+                        removed += 1
+            return removed
+        if verb in ("start", "stop", "restart", "reload"):
+            return None
+        raise ValueError("Invalid command: " + " ".join(map(str, cmd)))
+
+
+class FakeServer:
+    """Unix socket server with one thread per connection, like fail2ban."""
+
+    def __init__(self, path: str, state: FakeState, latency: float = 0.0,
+                 jitter: float = 0.0):
+        self.path = path
+        self.state = state
+        self.latency = latency
+        self.jitter = jitter
+        self.connections = 0
+        self.commands = 0
+        self._sock = None
+
+    def serve_forever(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(self.path)
+        self._sock.listen(128)
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return  # closed
+            self.connections += 1
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def _handle(self, conn):
+        buf = bytearray()
+        try:
+            while True:
+                chunk = conn.recv(65536)
+                if not chunk:
+                    return
+                buf += chunk
+                while True:
+                    idx = buf.find(END_MARKER)
+                    if idx == -1:
+                        break
+                    msg = bytes(buf[:idx])
+                    del buf[:idx + len(END_MARKER)]
+                    if msg == CLOSE_MARKER:
+                        return
+                    self.commands += 1
+                    if self.latency or self.jitter:
+                        time.sleep(self.latency + random.random() * self.jitter)
+                    reply = self.state.execute(pickle.loads(msg))
+                    conn.sendall(pickle.dumps(reply, pickle.HIGHEST_PROTOCOL) + END_MARKER)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--socket", default="/tmp/fail2ban-fake.sock",
+                        help="Unix socket path (default: %(default)s)")
+    parser.add_argument("--jails", type=int, default=5,
+                        help="number of jails (default: %(default)s)")
+    parser.add_argument("--banned", type=int, default=1000,
+                        help="banned IPs per jail (default: %(default)s)")
+    parser.add_argument("--ipv6-ratio", type=float, default=0.1,
+                        help="share of IPv6 addresses (default: %(default)s)")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="delay per command in ms (default: %(default)s)")
+    parser.add_argument("--jitter", type=float, default=0.0,
+                        help="additional random delay per command in ms, 0..N")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    state = FakeState(args.jails, args.banned, args.ipv6_ratio, args.seed)
+    server = FakeServer(args.socket, state, args.latency / 1000, args.jitter / 1000)
+    print(f"fake fail2ban on {args.socket}: {args.jails} jails, "
+          f"{args.banned} banned IPs each", file=sys.stderr, flush=True)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
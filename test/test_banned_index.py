@@ -0,0 +1,200 @@
+"""Unit tests for BannedIndex paging, keyset cursors and net/prefix filters."""
+
+import base64
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "src-backend"))
+
+import app  # noqa: E402
+
+IPS = [
+    "10.0.0.1", "10.0.0.2", "10.0.1.7", "10.1.0.1", "100.64.0.1",
+    "192.168.1.10", "192.168.1.9", "192.168.10.1", "203.0.113.5",
+    "2001:db8::1", "2001:db8::ff", "2001:db8:1::1", "fe80::1",
+]
+
+
+def query(**kw):
+    q = {"offset": 0, "limit": None, "after": None, "net": None,
+         "prefix": None, "jail": None}
+    q.update(kw)
+    return q
+
+
+def decode_cursor(value):
+    return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4)).decode()
+
+
+class BannedIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = app.BannedIndex.from_ips(IPS + ["not-an-ip", "10.0.0.1"])
+
+    def test_sorted_numerically_ipv4_first(self):
+        self.assertEqual(len(self.index), len(IPS))
+        listed = self.index.to_list()
+        self.assertEqual(listed[:9], [
+            "10.0.0.1", "10.0.0.2", "10.0.1.7", "10.1.0.1", "100.64.0.1",
+            "192.168.1.9", "192.168.1.10", "192.168.10.1", "203.0.113.5"])
+        self.assertEqual(listed[9:], [
+            "2001:db8::1", "2001:db8::ff", "2001:db8:1::1", "fe80::1"])
+
+    def test_from_reply_matches_from_ips(self):
+        reply = [["sshd", ["10.0.0.1", "2001:db8::1"]],
+                 {"nginx": "192.168.1.9 fe80::1"}]
+        self.assertEqual(app.BannedIndex.from_reply(reply).to_list(),
+                         ["10.0.0.1", "192.168.1.9", "2001:db8::1", "fe80::1"])
+
+    def test_add_discard_keep_order(self):
+        index = self.index.copy()
+        self.assertTrue(index.add("10.0.0.3"))
+        self.assertFalse(index.add("10.0.0.3"))
+        self.assertTrue(index.add("2001:db8::2"))
+        self.assertTrue(index.discard("fe80::1"))
+        self.assertFalse(index.discard("fe80::1"))
+        listed = index.to_list()
+        self.assertEqual(listed, sorted(listed, key=lambda ip: (":" in ip, app._parse_ip(ip))))
+        self.assertIn("10.0.0.3", index)
+        self.assertNotIn("fe80::1", index)
+        # the copy is independent
+        self.assertIn("fe80::1", self.index)
+
+    def test_offset_limit(self):
+        page = app.banned_page(self.index, query(offset=3, limit=4))
+        self.assertEqual(page["ips"], ["10.1.0.1", "100.64.0.1",
+                                       "192.168.1.9", "192.168.1.10"])
+        self.assertEqual(page["count"], len(IPS))
+        self.assertIsNotNone(page["next"])
+
+    def test_cursor_walks_all_pages_across_families(self):
+        seen, after = [], None
+        while True:
+            page = app.banned_page(self.index, query(limit=4, after=after))
+            seen += page["ips"]
+            if page["next"] is None:
+                break
+            after = decode_cursor(page["next"])
+            self.assertEqual(after, seen[-1])
+        self.assertEqual(seen, self.index.to_list())
+
+    def test_cursor_survives_removal_of_last_seen(self):
+        page = app.banned_page(self.index, query(limit=2))
+        after = decode_cursor(page["next"])
+        index = self.index.copy()
+        index.discard(after)
+        page = app.banned_page(index, query(limit=2, after=after))
+        self.assertEqual(page["ips"], ["10.0.1.7", "10.1.0.1"])
+
+    def test_net_filter(self):
+        cases = {
+            "10.0.0.0/16": ["10.0.0.1", "10.0.0.2", "10.0.1.7"],
+            "192.168.1.0/24": ["192.168.1.9", "192.168.1.10"],
+            "192.168.1.10": ["192.168.1.10"],
+            "2001:db8::/48": ["2001:db8::1", "2001:db8::ff"],
+            "2001:db8::/32": ["2001:db8::1", "2001:db8::ff", "2001:db8:1::1"],
+            "172.16.0.0/12": [],
+        }
+        for net, expected in cases.items():
+            with self.subTest(net=net):
+                page = app.banned_page(self.index, query(net=net))
+                self.assertEqual(page["ips"], expected)
+                self.assertEqual(page["count"], len(expected))
+
+    def test_prefix_filter_ipv4(self):
+        cases = {
+            "10.0.": ["10.0.0.1", "10.0.0.2", "10.0.1.7"],
+            "10.": ["10.0.0.1", "10.0.0.2", "10.0.1.7", "10.1.0.1"],
+            "10": ["10.0.0.1", "10.0.0.2", "10.0.1.7", "10.1.0.1", "100.64.0.1"],
+            "192.168.1": ["192.168.1.9", "192.168.1.10", "192.168.10.1"],
+            "192.168.1.1": ["192.168.1.10"],
+            "203.0.113.5": ["203.0.113.5"],
+            "01": [],
+            "300": [],
+        }
+        for prefix, expected in cases.items():
+            with self.subTest(prefix=prefix):
+                page = app.banned_page(self.index, query(prefix=prefix))
+                self.assertEqual(page["ips"], expected)
+
+    def test_prefix_filter_ipv6(self):
+        cases = {
+            "2001:db8::": ["2001:db8::1", "2001:db8::ff"],
+            "2001:db8:": ["2001:db8::1", "2001:db8::ff", "2001:db8:1::1"],
+            "FE80": ["fe80::1"],
+        }
+        for prefix, expected in cases.items():
+            with self.subTest(prefix=prefix):
+                page = app.banned_page(self.index, query(prefix=prefix))
+                self.assertEqual(page["ips"], expected)
+
+    def test_filters_combine_with_paging(self):
+        q = query(net="10.0.0.0/8", prefix="10.0", limit=2)
+        page = app.banned_page(self.index, q)
+        self.assertEqual(page["ips"], ["10.0.0.1", "10.0.0.2"])
+        self.assertEqual(page["count"], 3)
+        page = app.banned_page(self.index, {**q, "after": decode_cursor(page["next"])})
+        self.assertEqual(page["ips"], ["10.0.1.7"])
+        self.assertIsNone(page["next"])
+
+    def test_matches_brute_force(self):
+        listed = self.index.to_list()
+        for prefix in ("1", "10", "10.0", "19", "192.168.1", "2", "2001:db8", ""):
+            with self.subTest(prefix=prefix):
+                expected = [ip for ip in listed if ip.startswith(prefix)]
+                page = app.banned_page(self.index, query(prefix=prefix or None))
+                self.assertEqual(page["ips"], expected)
+
+
+class BannedQueryTest(unittest.TestCase):
+
+    def test_no_parameters(self):
+        self.assertIsNone(app._banned_query({}))
+
+    def test_cursor_roundtrip(self):
+        cursor = base64.urlsafe_b64encode(b"2001:db8::1").decode().rstrip("=")
+        q = app._banned_query({"cursor": [cursor], "limit": ["5"]})
+        self.assertEqual(q["after"], "2001:db8::1")
+        self.assertEqual(q["limit"], 5)
+
+    def test_invalid_values(self):
+        for qs in ({"cursor": ["!!!"]},
+                   {"cursor": [base64.urlsafe_b64encode(b"nope").decode()]},
+                   {"offset": ["-1"]}, {"limit": ["x"]}):
+            with self.subTest(qs=qs), self.assertRaises(ValueError):
+                app._banned_query(qs)
+
+
+class IndexCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        app._INDEXES.clear()
+
+    def tearDown(self):
+        app._INDEXES.clear()
+
+    def test_rebuilt_only_for_a_new_reply(self):
+        raw = ["10.0.0.1"]
+        first = app._indexed("h", raw, app.BannedIndex.from_reply)
+        self.assertIs(app._indexed("h", raw, app.BannedIndex.from_reply), first)
+        self.assertIsNot(app._indexed("h", ["10.0.0.1"], app.BannedIndex.from_reply), first)
+
+    def test_bounded(self):
+        with mock.patch.object(app, "INDEX_CACHE_SIZE", 3):
+            for i in range(10):
+                app._indexed(f"h:jail:j{i}", [], app.BannedIndex.from_reply)
+        self.assertEqual(list(app._INDEXES), ["h:jail:j7", "h:jail:j8", "h:jail:j9"])
+
+    def test_failed_build_is_not_stored(self):
+        def fail(raw):
+            raise ValueError("unknown jail")
+        with self.assertRaises(ValueError):
+            app._indexed("h:jail:nope", ["x"], fail)
+        self.assertNotIn("h:jail:nope", app._INDEXES)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+"""Tests for copying fail2ban's bans table into the history sidecar."""
+
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "src-backend"))
+
+import app  # noqa: E402
+
+# fail2ban's own schema (v4) of the bans table
+SOURCE_SCHEMA = """
+CREATE TABLE bans(jail TEXT NOT NULL, ip TEXT, timeofban INTEGER NOT NULL,
+                  bantime INTEGER NOT NULL, bancount INTEGER NOT NULL default 1,
+                  data JSON);
+CREATE INDEX bans_jail_timeofban_ip ON bans(jail, timeofban);
+CREATE INDEX bans_jail_ip ON bans(jail, ip);
+CREATE INDEX bans_ip ON bans(ip);
+"""
+
+
+class BanHistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        # characters that need quoting in a file: URI
+        self.dir = tempfile.mkdtemp(prefix="f2b hist#?%")
+        self.addCleanup(shutil.rmtree, self.dir, True)
+        self.source = os.path.join(self.dir, "fail2ban.sqlite3")
+        self.db = sqlite3.connect(self.source)
+        self.db.executescript(SOURCE_SCHEMA)
+        self.addCleanup(self.db.close)
+        self.now = int(time.time())
+        self.history = app.BanHistory(
+            self.source, os.path.join(self.dir, "state", "history.sqlite3"))
+        self.addCleanup(self.history.close)
+
+    def ban(self, jail, ip, ago=0):
+        self.db.execute("INSERT INTO bans VALUES (?, ?, ?, 600, 1, '{}')",
+                        (jail, ip, self.now - ago))
+        self.db.commit()
+
+    def ips(self):
+        return [ip for ip, in self.history.query("SELECT ip FROM bans ORDER BY timeofban, ip")]
+
+    def wait_synced(self):
+        self.history.start()
+        self.history._first.join(10)
+        self.assertTrue(self.history.synced_at)
+
+    def test_copies_all_jails(self):
+        for i in range(5):
+            self.ban("sshd", f"10.0.0.{i}", ago=100 - i)
+            self.ban("nginx", f"10.0.1.{i}", ago=50 - i)
+        self.wait_synced()
+        self.assertEqual(len(self.ips()), 10)
+        self.ban("postfix", "10.0.2.1")
+        self.history.sync()
+        self.assertEqual(self.ips()[-1], "10.0.2.1")
+        self.assertEqual(oct(os.stat(os.path.dirname(self.history.sidecar)).st_mode & 0o777), "0o700")
+
+    def test_reused_rowid_after_unban(self):
+        for i in range(3):
+            self.ban("sshd", f"10.0.0.{i}", ago=10 - i)
+        self.wait_synced()
+        last = self.db.execute("SELECT max(rowid) FROM bans").fetchone()[0]
+        # fail2ban deletes the row on unban; SQLite reuses its rowid
+        self.db.execute("DELETE FROM bans WHERE rowid = ?", (last,))
+        self.ban("sshd", "192.0.2.1")
+        reused = self.db.execute("SELECT rowid FROM bans WHERE ip = '192.0.2.1'").fetchone()[0]
+        self.assertEqual(reused, last)
+        self.history.sync()
+        self.assertIn("192.0.2.1", self.ips())
+        # the unbanned row stays in the history
+        self.assertIn("10.0.0.2", self.ips())
+
+    def test_late_insert_inside_the_overlap_is_copied(self):
+        self.ban("sshd", "10.0.0.1")
+        self.wait_synced()
+        self.ban("sshd", "10.0.0.2", ago=app.HISTORY_SYNC_OVERLAP // 2)
+        self.history.sync()
+        self.assertIn("10.0.0.2", self.ips())
+
+    def test_resync_does_not_duplicate(self):
+        self.ban("sshd", "10.0.0.1")
+        self.wait_synced()
+        for _ in range(3):
+            self.history.sync()
+        self.assertEqual(self.ips(), ["10.0.0.1"])
+
+    def test_first_query_does_not_wait_for_the_copy(self):
+        self.ban("sshd", "10.0.0.1")
+        # a long first copy holds the sync lock
+        self.history._sync_lock.acquire()
+        try:
+            started = time.monotonic()
+            self.assertEqual(self.ips(), [])
+            self.assertLess(time.monotonic() - started, 1)
+            self.assertTrue(self.history.syncing)
+        finally:
+            self.history._sync_lock.release()
+        self.history._first.join(10)
+        self.assertFalse(self.history.syncing)
+        self.assertEqual(self.ips(), ["10.0.0.1"])
+
+    def test_failed_first_copy_is_reported_and_retried(self):
+        with open(self.source, "r+b") as f:
+            f.write(b"not a database" * 10)
+        self.history.start()
+        self.history._first.join(10)
+        with self.assertRaises(app.HistoryUnavailable):
+            self.history.query("SELECT count(*) FROM bans")
+        self.history._first.join(10)
+        self.assertFalse(self.history.synced_at)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,208 @@
+"""Tests for the circuit breaker, pool slot waits and stale responses."""
+
+import http.client
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "src-backend"))
+sys.path.insert(0, HERE)
+
+import app  # noqa: E402
+from test_socket_protocol import start_fake  # noqa: E402
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def test_opens_after_threshold(self):
+        breaker = app.CircuitBreaker(2, 60)
+        breaker.before()
+        breaker.failure()
+        self.assertEqual(breaker.state, "closed")
+        breaker.before()
+        breaker.failure()
+        self.assertEqual(breaker.state, "open")
+        with self.assertRaises(app.CircuitOpenError):
+            breaker.before()
+
+    def test_success_resets_the_count(self):
+        breaker = app.CircuitBreaker(2, 60)
+        breaker.failure()
+        breaker.success()
+        breaker.failure()
+        self.assertEqual(breaker.state, "closed")
+
+    def test_half_open_trial_closes_on_success(self):
+        breaker = app.CircuitBreaker(1, 0.05)
+        breaker.failure()
+        time.sleep(0.06)
+        breaker.before()  # the trial call
+        self.assertEqual(breaker.state, "half-open")
+        with self.assertRaises(app.CircuitOpenError):
+            breaker.before()  # only one trial at a time
+        breaker.success()
+        self.assertEqual(breaker.state, "closed")
+        breaker.before()
+
+    def test_failed_trial_opens_again(self):
+        breaker = app.CircuitBreaker(1, 0.05)
+        breaker.failure()
+        time.sleep(0.06)
+        breaker.before()
+        breaker.failure()
+        self.assertEqual(breaker.state, "open")
+        with self.assertRaises(app.CircuitOpenError):
+            breaker.before()
+
+    def test_cancelled_trial_lets_the_next_call_try(self):
+        breaker = app.CircuitBreaker(1, 0.05)
+        breaker.failure()
+        time.sleep(0.06)
+        breaker.before()
+        breaker.cancel()
+        self.assertEqual(breaker.state, "open")
+        breaker.before()
+        self.assertEqual(breaker.state, "half-open")
+
+    def test_disabled(self):
+        breaker = app.CircuitBreaker(0, 60)
+        for _ in range(10):
+            breaker.failure()
+            breaker.before()
+
+
+class SocketPoolTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # 200 ms per command keeps the single pooled connection busy
+        cls.server, cls.path = start_fake(jails=1, banned=1, latency=0.2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.close()
+
+    @staticmethod
+    def ping():
+        return app._encode_command(["ping"])
+
+    def test_pool_wait_is_not_a_failure(self):
+        pool = app.SocketPool(self.path, 1, app.CircuitBreaker(1, 60))
+        self.addCleanup(pool.close)
+        errors = []
+
+        def busy():
+            try:
+                pool.request([self.ping()], timeout=0.1)
+            except Exception as e:
+                errors.append(e)
+
+        holder = threading.Thread(target=pool.request, args=([self.ping()], 5))
+        holder.start()
+        time.sleep(0.05)
+        waiters = [threading.Thread(target=busy) for _ in range(4)]
+        for t in waiters:
+            t.start()
+        for t in waiters + [holder]:
+            t.join()
+        self.assertEqual([type(e) for e in errors], [app.PoolBusyError] * 4)
+        self.assertEqual(pool.breaker.state, "closed")
+        self.assertEqual(pool.breaker._failures, 0)
+
+    def test_pool_wait_clears_the_trial(self):
+        pool = app.SocketPool(self.path, 1, app.CircuitBreaker(1, 0.01))
+        self.addCleanup(pool.close)
+        pool.breaker.failure()
+        time.sleep(0.02)
+        conn, _ = pool._acquire()
+        with self.assertRaises(app.PoolBusyError):
+            pool.request([self.ping()], timeout=0.05)
+        self.assertEqual(pool.breaker.state, "open")
+        pool._release(conn)
+        pool.request([self.ping()], timeout=5)
+        self.assertEqual(pool.breaker.state, "closed")
+
+    def test_connect_failures_open_the_breaker(self):
+        pool = app.SocketPool(self.path + ".missing", 2, app.CircuitBreaker(2, 60))
+        for _ in range(2):
+            with self.assertRaises(OSError):
+                pool.request([self.ping()], timeout=1)
+        self.assertEqual(pool.breaker.state, "open")
+        with self.assertRaises(app.CircuitOpenError):
+            pool.request([self.ping()], timeout=1)
+
+    def test_exchange_timeout_counts(self):
+        pool = app.SocketPool(self.path, 1, app.CircuitBreaker(1, 60))
+        self.addCleanup(pool.close)
+        with self.assertRaises(TimeoutError):
+            pool.request([self.ping()], timeout=0.05)
+        self.assertEqual(pool.breaker.state, "open")
+
+
+class StaleResponseTest(unittest.TestCase):
+    """A read answered from the cache while fail2ban is down is marked stale."""
+
+    def setUp(self):
+        self.fake, path = start_fake(jails=2, banned=3)
+        self.host = app.Host("stale-test", path)
+        patcher = mock.patch.dict(app.HOSTS, {"stale-test": self.host})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.server = app.PooledHTTPServer(("127.0.0.1", 0), app.Handler,
+                                           workers=2, queue_size=4)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.addCleanup(self.fake.close)
+
+    def get(self, path):
+        conn = http.client.HTTPConnection(*self.server.server_address, timeout=10)
+        try:
+            conn.request("GET", path)
+            resp = conn.getresponse()
+            return resp, json.loads(resp.read())
+        finally:
+            conn.close()
+
+    def fail2ban_down(self, age: float):
+        self.fake.close()
+        self.host.pool.close()
+        # let the cached replies expire
+        cache = self.host.cache
+        with cache._lock:
+            for key, (ts, value) in list(cache._entries.items()):
+                cache._entries[key] = (ts - age, value)
+
+    def test_fresh_response_is_not_marked(self):
+        resp, body = self.get("/api/status?host=stale-test")
+        self.assertEqual(resp.status, 200)
+        self.assertIsNone(resp.getheader("Warning"))
+        self.assertIsNone(resp.getheader("X-Stale-Age"))
+        self.assertEqual(body["list"], ["jail-00", "jail-01"])
+
+    def test_stale_response_while_down(self):
+        _, fresh = self.get("/api/status?host=stale-test")
+        self.fail2ban_down(age=30)
+        resp, body = self.get("/api/status?host=stale-test")
+        self.assertEqual(resp.status, 200)
+        self.assertEqual(body, fresh)
+        self.assertEqual(resp.getheader("Warning"), '110 - "Response is Stale"')
+        self.assertGreaterEqual(int(resp.getheader("X-Stale-Age")), 30)
+
+    def test_too_old_is_not_served(self):
+        self.get("/api/status?host=stale-test")
+        self.fail2ban_down(age=app.STALE_MAX_AGE + 10)
+        resp, body = self.get("/api/status?host=stale-test")
+        # the socket is gone: the connect error itself, no stale data
+        self.assertEqual(resp.status, 500)
+        self.assertIsNone(resp.getheader("Warning"))
+        self.assertIn("error", body)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+"""Tests for the ring layout of the jail counter series."""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "src-backend"))
+
+import app  # noqa: E402
+
+
+def windows(interval):
+    """(step, window) in seconds per ring for a sampling interval."""
+    return [(interval * mult, interval * mult * slots)
+            for mult, slots in app.series_levels(interval)]
+
+
+class SeriesLevelsTest(unittest.TestCase):
+
+    def test_documented_layout_at_ten_seconds(self):
+        self.assertEqual(app.series_levels(10), ((1, 360), (6, 1440), (60, 1008)))
+
+    def test_windows_hold_for_any_interval(self):
+        for interval in (0.5, 1, 2, 5, 7, 10, 15, 30):
+            with self.subTest(interval=interval):
+                steps = windows(interval)
+                self.assertEqual(len(steps), 3)
+                (raw, hour), (minute, day), (ten, week) = steps
+                self.assertEqual(raw, interval)
+                self.assertGreaterEqual(hour, 3600)
+                self.assertLess(hour, 3600 + interval)
+                self.assertAlmostEqual(minute, 60, delta=interval)
+                self.assertGreaterEqual(day, 86400)
+                self.assertAlmostEqual(ten, 600, delta=60)
+                self.assertGreaterEqual(week, 7 * 86400)
+
+    def test_steps_are_multiples_of_the_previous(self):
+        for interval in (1, 7, 13, 30, 90, 250):
+            with self.subTest(interval=interval):
+                mults = [m for m, _ in app.series_levels(interval)]
+                self.assertEqual(mults[0], 1)
+                for a, b in zip(mults, mults[1:]):
+                    self.assertGreater(b, a)
+                    self.assertEqual(b % a, 0)
+
+    def test_coarse_interval_merges_levels(self):
+        self.assertEqual(windows(60), [(60, 86400), (600, 7 * 86400)])
+        # a 1 min step is not coarser than 45 s samples
+        self.assertEqual(windows(45), [(45, 86400), (585, 604890)])
+        self.assertEqual(windows(1000), [(1000, 605000)])
+
+    def test_default_window_uses_the_finest_ring(self):
+        series = app.JailSeries(1, app.series_levels(1))
+        self.assertEqual(series.ring_for(3600).step, 1)
+        self.assertEqual(series.ring_for(86400).step, 60)
+        self.assertEqual(series.ring_for(7 * 86400).step, 600)
+
+    def test_averaged_rows_roll_up(self):
+        series = app.JailSeries(10, app.series_levels(10))
+        for i in range(12):
+            series.record(1000 + 10 * i, [i, 100 + i, 2 * i, 200 + i])
+        minute = series.rings[1]
+        self.assertEqual(minute.step, 60)
+        ts, (failed, total_failed, banned, total_banned) = minute.window(0, 10 ** 10)
+        # one row per 6 samples: gauges averaged, totals the last value
+        self.assertEqual(list(ts), [1050, 1110])
+        self.assertEqual(list(failed), [2.5, 8.5])
+        self.assertEqual(list(total_failed), [105, 111])
+        self.assertEqual(list(banned), [5.0, 17.0])
+        self.assertEqual(list(total_banned), [205, 211])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,210 @@
+"""Tests for the fail2ban socket framing, reply decoding and pipelining."""
+
+import io
+import os
+import pickle
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "src-backend"))
+sys.path.insert(0, HERE)
+
+import app  # noqa: E402
+import fake_fail2ban  # noqa: E402
+
+END = app.END_MARKER
+
+
+def frame(obj) -> bytes:
+    return pickle.dumps(obj, 2) + END
+
+
+def start_fake(jails=2, banned=10, latency=0.0):
+    """FakeServer on a temporary socket; returns (server, path)."""
+    path = os.path.join(tempfile.mkdtemp(prefix="f2b-test-"), "f2b.sock")
+    server = fake_fail2ban.FakeServer(
+        path, fake_fail2ban.FakeState(jails, banned, 0.2), latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    for _ in range(200):
+        if os.path.exists(path):
+            break
+        time.sleep(0.01)
+    return server, path
+
+
+class ExchangeTest(unittest.TestCase):
+    """_exchange() against a socketpair whose peer writes in chosen chunks."""
+
+    def setUp(self):
+        self.client, self.peer = socket.socketpair()
+        self.addCleanup(self.client.close)
+        self.addCleanup(self.peer.close)
+
+    def serve(self, data: bytes, chunk: int, close: bool = False):
+        def write():
+            try:
+                for i in range(0, len(data), chunk):
+                    self.peer.sendall(data[i:i + chunk])
+                    time.sleep(0.0005)
+                if close:
+                    self.peer.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass  # the test is done and closed the pair
+        threading.Thread(target=write, daemon=True).start()
+
+    def exchange(self, n: int, reused: bool = False):
+        return app._exchange(self.client, [b"x" + END] * n, reused,
+                             time.monotonic() + 5)
+
+    def test_marker_split_across_reads(self):
+        data = frame([0, "pong"]) + frame([0, "a" * 50])
+        with mock.patch.object(app, "RECV_SIZE", 5):
+            # 3-byte writes put every marker boundary inside a read
+            self.serve(data, 3)
+            replies, complete = self.exchange(2)
+        self.assertTrue(complete)
+        self.assertEqual([pickle.loads(r) for r in replies],
+                         [[0, "pong"], [0, "a" * 50]])
+
+    def test_pipelined_replies_in_one_read(self):
+        data = b"".join(frame([0, i]) for i in range(20))
+        self.serve(data, len(data))
+        replies, complete = self.exchange(20)
+        self.assertTrue(complete)
+        self.assertEqual([pickle.loads(r)[1] for r in replies], list(range(20)))
+
+    def test_extra_bytes_after_last_reply_are_ignored(self):
+        self.serve(frame([0, 1]) + frame([0, 2]), 1000)
+        replies, complete = self.exchange(1)
+        self.assertEqual([pickle.loads(r) for r in replies], [[0, 1]])
+
+    def test_buffer_grows_for_large_reply(self):
+        big = [0, ["10.0.%d.%d" % (i // 256, i % 256) for i in range(5000)]]
+        with mock.patch.object(app, "RECV_SIZE", 64):
+            self.serve(frame(big) + frame([0, "tail"]), 997)
+            replies, complete = self.exchange(2)
+        self.assertTrue(complete)
+        self.assertEqual(pickle.loads(replies[0]), big)
+        self.assertEqual(pickle.loads(replies[1]), [0, "tail"])
+
+    def test_reply_over_max_size_is_rejected(self):
+        with mock.patch.object(app, "RECV_SIZE", 64), \
+                mock.patch.object(app, "MAX_REPLY_SIZE", 1024):
+            self.serve(b"y" * 4096 + END, 512)
+            with self.assertRaises(ConnectionError):
+                self.exchange(1)
+
+    def test_early_close_keeps_partial_reply(self):
+        self.serve(frame([0, 1]) + b"partial", 100, close=True)
+        replies, complete = self.exchange(2)
+        self.assertFalse(complete)
+        self.assertEqual(pickle.loads(replies[0]), [0, 1])
+        self.assertEqual(replies[1], b"partial")
+
+    def test_reused_connection_closed_before_reply_is_stale(self):
+        self.peer.shutdown(socket.SHUT_WR)
+        with self.assertRaises(app._StaleConnection):
+            self.exchange(1, reused=True)
+
+
+class ReplyUnpicklerTest(unittest.TestCase):
+
+    def test_plain_values(self):
+        for value in ([0, "pong"], [0, {"a": (1, 2.5, None)}], [0, {1, 2}],
+                      [0, frozenset("ab")], [0, b"raw"]):
+            for protocol in (0, 2, pickle.HIGHEST_PROTOCOL):
+                with self.subTest(value=value, protocol=protocol):
+                    self.assertEqual(app._decode_reply(pickle.dumps(value, protocol)), value)
+
+    def test_builtin_exception(self):
+        reply = app._decode_reply(pickle.dumps([1, ValueError("bad")], 2))
+        self.assertIsInstance(reply[1], ValueError)
+        self.assertEqual(str(reply[1]), "bad")
+
+    def test_foreign_exception_becomes_remote_error(self):
+        data = b"(lp0\nI1\nacfail2ban.server.jails\nUnknownJailException\np1\n(S'sshd'\ntRp2\na."
+        reply = app._decode_reply(data)
+        self.assertIsInstance(reply[1], app.RemoteError)
+        self.assertEqual(reply[1].name, "fail2ban.server.jails.UnknownJailException")
+        self.assertIn("sshd", str(reply[1]))
+
+    def test_refuses_other_globals(self):
+        class Probe:
+            def __reduce__(self):
+                return (os.getcwd, ())
+
+        for data in (pickle.dumps([0, Probe()], 2),
+                     b"cos\nsystem\n(S'true'\ntR.",
+                     b"cbuiltins\neval\n(S'1+1'\ntR."):
+            with self.subTest(data=data[:20]):
+                with self.assertRaises(pickle.UnpicklingError):
+                    app._ReplyUnpickler(io.BytesIO(data)).load()
+                # _decode_reply falls back to the raw text, never to the call
+                self.assertIsInstance(app._decode_reply(data), str)
+
+
+class SendCommandsTest(unittest.TestCase):
+    """send_commands() end to end against test/fake_fail2ban.py."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server, path = start_fake(jails=3, banned=5000)
+        cls.host = app.Host("test", path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.host.pool.close()
+        cls.server.close()
+
+    def setUp(self):
+        app.select_host(self.host)
+        self.addCleanup(app.select_host, None)
+
+    def test_pipelined_batch_on_one_connection(self):
+        before = self.server.connections
+        replies = app.send_commands([["ping"], ["version"], ["get", "loglevel"],
+                                     ["status"], ["status", "nope"]])
+        self.assertEqual(replies[0], [0, "pong"])
+        self.assertEqual(replies[1], [0, "1.1.0"])
+        self.assertEqual(replies[2], [0, "INFO"])
+        self.assertEqual(replies[3][1][0], ("Number of jail", 3))
+        self.assertEqual(replies[4][0], 1)
+        self.assertIsInstance(replies[4][1], app.RemoteError)
+        self.assertLessEqual(self.server.connections - before, 1)
+
+    def test_large_reply(self):
+        with mock.patch.object(app, "RECV_SIZE", 4096):
+            code, value = app.send_command(["banned"])
+        self.assertEqual(code, 0)
+        self.assertEqual(sum(len(ips) for d in value for ips in d.values()), 15000)
+
+    def test_connection_is_reused(self):
+        app.send_command(["ping"])
+        before = self.server.connections
+        for _ in range(5):
+            self.assertEqual(app.send_command(["ping"]), [0, "pong"])
+        self.assertEqual(self.server.connections, before)
+
+    def test_concurrent_callers(self):
+        results = []
+
+        def worker():
+            app.select_host(self.host)
+            results.append(app.send_commands([["get", "dbpurgeage"], ["ping"]]))
+
+        threads = [threading.Thread(target=worker) for _ in range(16)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, [[[0, 86400], [0, "pong"]]] * 16)
+
+
+if __name__ == "__main__":
+    unittest.main()